@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for the photo_gis API.
+
+Run with `python manage.py benchmark`. Scenarios execute against a throwaway test database
+and a temporary media root, and results are written as JSON so runs can be compared between commits.
+"""
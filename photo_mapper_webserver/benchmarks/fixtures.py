@@ -0,0 +1,63 @@
+import io
+import random
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image, ExifTags
+
+
+def make_jpeg(megapixels: float, timestamp: datetime, lon: float, lat: float, seed: int = 0):
+    """
+    Builds a JPEG with EXIF DateTimeOriginal, OffsetTimeOriginal and GPS tags.
+
+    The content is a gradient with noise so that it compresses roughly like a photograph
+    rather than like a flat colour.
+
+    Args:
+        megapixels: Approximate size of the image in millions of pixels, with a 3:2 aspect ratio
+        timestamp: Timezone aware capture time written to the EXIF data
+        lon: Longitude in decimal degrees
+        lat: Latitude in decimal degrees
+        seed: Seed for the noise so fixtures are reproducible
+    Returns:
+        The encoded JPEG as bytes
+    """
+    height = max(1, int((megapixels * 1_000_000 / 1.5) ** 0.5))
+    width = max(1, int(height * 1.5))
+
+    random.seed(seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), random.uniform(20, 60))
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+    exif = image.getexif()
+    exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+    exif_ifd[ExifTags.Base.DateTimeOriginal] = timestamp.strftime(r"%Y:%m:%d %H:%M:%S")
+    exif_ifd[ExifTags.Base.OffsetTimeOriginal] = timestamp.strftime("%z")[:3] + ":" + timestamp.strftime("%z")[3:]
+
+    gps_ifd = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    gps_ifd[ExifTags.GPS.GPSLatitude] = decimal_to_DMS(lat)
+    gps_ifd[ExifTags.GPS.GPSLatitudeRef] = "N" if lat >= 0 else "S"
+    gps_ifd[ExifTags.GPS.GPSLongitude] = decimal_to_DMS(lon)
+    gps_ifd[ExifTags.GPS.GPSLongitudeRef] = "E" if lon >= 0 else "W"
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+def decimal_to_DMS(value: float):
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 4)
+    return (float(degrees), float(minutes), seconds)
+
+
+def random_capture(index: int, seed: int = 0):
+    """
+    Returns a distinct (timestamp, lon, lat) for the index-th synthetic photo,
+    so generated photos never collide on the unique time and place constraint.
+    """
+    rng = random.Random(seed * 1_000_003 + index)
+    timestamp = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index)
+    return timestamp, rng.uniform(-180, 180), rng.uniform(-85, 85)
@@ -0,0 +1,145 @@
+import os
+import queue
+import threading
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+_DONE = object()
+
+
+def percentile(sorted_values, fraction: float):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# Seconds between samples of the resident memory while a scenario runs
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+def rss_bytes():
+    """
+    Current resident set size of the process, or None where /proc is not available. Not ru_maxrss,
+    the high-water mark of the whole process, which every scenario after the heaviest one would repeat.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class RssSampler(threading.Thread):
+    """
+    Samples rss_bytes() until stopped and keeps the largest value seen.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = rss_bytes()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+
+def run_scenario(make_request, iterations: int, concurrency: int, warmup: int = 0, prepare=None):
+    """
+    Calls make_request(worker, payload) iterations times spread over concurrency threads.
+
+    The payload is prepare(index), or the index itself without a prepare function. The index runs
+    from 0 to warmup + iterations so scenarios can hand every call distinct input. Payloads are
+    prepared in a background thread and not timed. Each call must return a response with a
+    status_code. Warmup calls are made first and not measured.
+
+    Returns:
+        Dictionary of throughput, latency percentiles in milliseconds, queries per request,
+        error count and the process' RSS before, at its peak during and after the scenario.
+        Payloads are prepared in the same process, so they count towards it.
+    """
+    if prepare is None:
+        prepare = lambda index: index
+
+    for index in range(warmup):
+        make_request(0, prepare(index))
+
+    latencies = []
+    query_counts = []
+    errors = []
+    lock = threading.Lock()
+
+    # Payloads are prepared ahead by a producer thread. The bounded queue keeps memory flat
+    # while letting preparation overlap with the measured requests.
+    payloads = queue.Queue(maxsize=2 * concurrency)
+
+    def producer():
+        for index in range(warmup, warmup + iterations):
+            payloads.put(prepare(index))
+        for _ in range(concurrency):
+            payloads.put(_DONE)
+
+    def worker(worker_id):
+        try:
+            while True:
+                payload = payloads.get()
+                if payload is _DONE:
+                    return
+
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = make_request(worker_id, payload)
+                    elapsed = time.perf_counter() - start
+
+                with lock:
+                    latencies.append(elapsed)
+                    query_counts.append(len(queries))
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=producer)]
+    threads += [threading.Thread(target=worker, args=(worker_id,)) for worker_id in range(concurrency)]
+    rss_before = rss_bytes()
+    sampler = RssSampler() if rss_before is not None else None
+    if sampler is not None:
+        sampler.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    rss_peak = sampler.stop() if sampler is not None else None
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "wall_time_s": wall_time,
+        "throughput_rps": iterations / wall_time if wall_time else None,
+        "latency_ms": {
+            "mean": 1000 * sum(latencies) / len(latencies) if latencies else None,
+            "p50": 1000 * percentile(latencies, 0.50) if latencies else None,
+            "p95": 1000 * percentile(latencies, 0.95) if latencies else None,
+            "p99": 1000 * percentile(latencies, 0.99) if latencies else None,
+            "max": 1000 * latencies[-1] if latencies else None,
+        },
+        "queries_per_request": sum(query_counts) / len(query_counts) if query_counts else None,
+        "errors": len(errors),
+        "rss_before_bytes": rss_before,
+        "peak_rss_bytes": rss_peak,
+        "rss_after_bytes": rss_bytes(),
+    }
@@ -0,0 +1,218 @@
+import random
+from datetime import timedelta
+
+from django.contrib.gis.geos import Point
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import AccessToken
+
+from benchmarks.fixtures import make_jpeg, random_capture
+from photo_gis.filters import parse_bbox
+from photo_gis.models import Photo, PhotoTag, Tag
+from photo_gis.serializers import CompactPhotoSerializer, PhotoSerializer
+from photo_mapper_auth.authentication import invalidate_user_state
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """
+    Registers a scenario. A scenario takes a BenchmarkContext and yields (result_name, make_request, prepare)
+    tuples as accepted by run_scenario.
+    """
+    def register(fn):
+        SCENARIOS[name] = fn
+        return fn
+    return register
+
+
+class BenchmarkContext:
+    def __init__(self, owner, iterations, warmup, concurrency, megapixels, seed_photos):
+        self.owner = owner
+        self.iterations = iterations
+        self.warmup = warmup
+        self.concurrency = concurrency
+        self.megapixels = megapixels
+        self.seed_photos = seed_photos
+
+        token = AccessToken.for_user(owner)
+        token.set_exp(lifetime=timedelta(hours=12))
+        self.clients = [Client(headers={"Authorization": f"Bearer {token}"}) for _ in range(concurrency)]
+
+    def client(self, worker):
+        return self.clients[worker]
+
+
+def seed_photos(owner, count: int, seed: int = 0, batch_size: int = 5000):
+    """
+    Inserts count photo rows with up to three of twenty tags each. The rows share one image
+    name so seeding does not write files, and are built per batch so millions of rows fit in memory.
+    """
+    rng = random.Random(seed)
+    tags = Tag.objects.bulk_create([Tag(name=f"bench-tag-{i}") for i in range(20)])
+
+    for start in range(0, count, batch_size):
+        photos = []
+        for index in range(start, min(start + batch_size, count)):
+            timestamp, lon, lat = random_capture(index, seed=seed)
+            photos.append(Photo(
+                owner=owner,
+                image="images/bench/seed.jpg",
+                location=Point(lon, lat, srid=4326),
+                timestamp=timestamp,
+            ))
+        photos = Photo.objects.bulk_create(photos)
+
+        PhotoTag.objects.bulk_create([
+            PhotoTag(photo_id=photo.id, tag_id=tag.id, owner_id=owner.id)
+            for photo in photos
+            for tag in rng.sample(tags, rng.randint(0, 3))
+        ])
+
+
+@scenario("upload")
+def upload(context):
+    for size_index, megapixels in enumerate(context.megapixels):
+        # Images are built per request outside the timed section. They are built in this process and count
+        # towards its RSS, the bounded payload queue keeps that to a few images at a time
+        def prepare(index, size_index=size_index, megapixels=megapixels):
+            # Offset captures per size so uploads never collide on time and place
+            timestamp, lon, lat = random_capture(index, seed=1000 + size_index)
+            return SimpleUploadedFile(
+                f"bench_{index}.jpg",
+                make_jpeg(megapixels, timestamp, lon, lat, seed=index),
+                content_type="image/jpeg"
+            )
+
+        def make_request(worker, image):
+            return context.client(worker).post("/collections/photos/", {"image": image, "tags": ["bench"]})
+
+        yield f"upload_{megapixels:g}mp", make_request, prepare
+
+
+@scenario("list")
+def list_photos(context):
+    """
+    Lists pages of 100 photos, rendered in SQL and, for comparison, by PhotoSerializer.
+    """
+    page_size = 100
+    pages = max(1, context.seed_photos // page_size)
+
+    def make_request(worker, index):
+        page = index % pages + 1
+        return context.client(worker).get("/collections/photos/", {"page": page, "page_size": page_size})
+
+    yield "list_page_100", make_request, None
+
+    # Scenarios run as they are yielded, so the override lasts for exactly this one
+    with override_settings(PHOTO_LIST_SQL_GEOJSON=False):
+        yield "list_page_100_serializer", make_request, None
+
+
+@scenario("detail")
+def photo_detail(context):
+    ids = list(Photo.objects.filter(owner=context.owner).values_list("id", flat=True)[:1000])
+
+    def get_request(worker, index):
+        return context.client(worker).get(f"/collections/photos/{ids[index % len(ids)]}/")
+
+    def patch_request(worker, index):
+        return context.client(worker).patch(
+            f"/collections/photos/{ids[index % len(ids)]}/",
+            {"tags": ["bench", f"bench-{index % 10}"]},
+            content_type="application/json",
+        )
+
+    yield "detail_get", get_request, None
+    yield "detail_patch", patch_request, None
+
+
+@scenario("auth")
+def cached_authentication(context):
+    ids = list(Photo.objects.filter(owner=context.owner).values_list("id", flat=True)[:1000])
+
+    def cached_request(worker, index):
+        return context.client(worker).get(f"/collections/photos/{ids[index % len(ids)]}/")
+
+    def uncached_request(worker, index):
+        # Dropping the cached user state first costs the user query the stock JWTAuthentication makes on every request
+        invalidate_user_state(context.owner.id)
+        return context.client(worker).get(f"/collections/photos/{ids[index % len(ids)]}/")
+
+    yield "auth_uncached_detail_get", uncached_request, None
+    yield "auth_cached_detail_get", cached_request, None
+
+
+@scenario("bbox_time")
+def bbox_and_time(context):
+    """
+    Lists photos inside random 20x20 degree boxes and 30 day windows within the seeded data,
+    the query shape the (owner, location_geometry, timestamp) GiST index serves. Run with a few million
+    --seed-photos and --keepdb to see its effect.
+    """
+    first, *_ = random_capture(0)
+    last, *_ = random_capture(max(context.seed_photos - 1, 0))
+    span_days = max((last - first).days - 30, 1)
+
+    def make_request(worker, index):
+        rng = random.Random(index)
+        lon, lat = rng.uniform(-180, 160), rng.uniform(-85, 65)
+        taken_after = first + timedelta(days=rng.randrange(span_days))
+        return context.client(worker).get("/collections/photos/", {
+            "bbox": f"{lon},{lat},{lon + 20},{lat + 20}",
+            "taken_after": taken_after.isoformat(),
+            "taken_before": (taken_after + timedelta(days=30)).isoformat(),
+            "page_size": 100,
+        })
+
+    yield "list_bbox_time", make_request, None
+
+
+@scenario("bbox_geometry")
+def bbox_geometry_and_geography(context):
+    """
+    Counts the photos inside random boxes of 1 and 20 degrees, filtering on the geometry column and,
+    for comparison, on the geography one. Both have a GiST index. Run with a few million --seed-photos.
+    """
+    photos = Photo.objects.filter(owner=context.owner)
+
+    def count(field, size):
+        def make_request(worker, index):
+            rng = random.Random(index)
+            lon, lat = rng.uniform(-180, 180 - size), rng.uniform(-85, 85 - size)
+            box = parse_bbox(f"{lon},{lat},{lon + size},{lat + size}")
+            return HttpResponse(str(photos.filter(**{f"{field}__intersects": box}).count()))
+        return make_request
+
+    for size in (1, 20):
+        yield f"bbox_{size}deg_geometry", count("location_geometry", size), None
+        yield f"bbox_{size}deg_geography", count("location", size), None
+
+
+@scenario("serialize")
+def serialize_features(context):
+    """
+    Serializes and renders the same 1,000 already loaded photos per request, isolating
+    serialization cost from the database.
+    """
+    photos = list(
+        Photo.objects.filter(owner=context.owner)
+        .select_related("owner")
+        .prefetch_related(Prefetch("tags", queryset=Tag.objects.order_by("name")))[:1000]
+    )
+    request = Request(RequestFactory().get("/collections/photos/"))
+    renderer = JSONRenderer()
+
+    def serializer(serializer_class, **kwargs):
+        def make_request(worker, index):
+            data = serializer_class(photos, many=True, context={"request": request}, **kwargs).data
+            return HttpResponse(renderer.render(data), content_type="application/json")
+        return make_request
+
+    yield "serialize_1000_full", serializer(PhotoSerializer), None
+    yield "serialize_1000_sparse", serializer(PhotoSerializer, fields=["timestamp"]), None
+    yield "serialize_1000_compact", serializer(CompactPhotoSerializer), None
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PhotoGisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'photo_gis'
+
+    def ready(self):
+        from photo_gis import checks
+        from photo_gis.metrics import observe_phase
+        from utils.profiling import add_phase_listener
+
+        add_phase_listener(observe_phase)
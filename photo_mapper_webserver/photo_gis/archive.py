@@ -0,0 +1,80 @@
+import os
+from datetime import timezone as dt_timezone
+
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from photo_gis.models import Tag
+from photo_gis.serializers import PhotoSerializer
+from utils.zipstream import IterableReader, ZipEntry
+
+MANIFEST_NAME = "manifest.geojson"
+# Formats that are already compressed, deflating them again only costs CPU
+COMPRESSED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic"}
+ITERATOR_CHUNK_SIZE = 500
+
+
+def archive_name(photo):
+    """
+    Returns:
+        Path of the photo's file inside the archive, sorting by when it was taken
+    """
+    extension = os.path.splitext(photo.image.name)[1].lower() or ".jpg"
+    return f"photos/{photo.timestamp.astimezone(dt_timezone.utc):%Y%m%d_%H%M%S}_{photo.id.hex[:8]}{extension}"
+
+
+def manifest_chunks(photos, request):
+    """
+    Yields the GeoJSON manifest one feature at a time: a FeatureCollection of the photos
+    as the API represents them, each with a 'file' property giving its path in the archive.
+    """
+    renderer = JSONRenderer()
+    yield b'{"type":"FeatureCollection","features":['
+    for i, photo in enumerate(photos):
+        feature = PhotoSerializer(photo, context={"request": request}).data
+        feature["properties"]["file"] = archive_name(photo)
+        yield (b"," if i else b"") + renderer.render(feature)
+    yield b"]}"
+
+
+def archive_entries(photos, request):
+    """
+    Yields the ZIP entries of an archive of photos: the manifest first, so readers of the stream get it
+    before the images, then each photo's file. The photos are read from the database in chunks twice,
+    once for each, and a photo whose file has gone since the manifest was written is left out.
+
+    Args:
+        photos: Photo queryset of the photos to archive
+        request: The DRF request, for the URLs in the manifest
+    Yields:
+        ZipEntry
+    """
+    photos = photos.order_by("timestamp", "id")
+    features = photos.select_related("owner").prefetch_related(
+        Prefetch("tags", queryset=Tag.objects.using(photos.db).order_by("name"))
+    )
+
+    yield ZipEntry(
+        MANIFEST_NAME,
+        lambda: IterableReader(manifest_chunks(features.iterator(chunk_size=ITERATOR_CHUNK_SIZE), request)),
+        None,
+        timezone.now(),
+        True,
+    )
+
+    storage = photos.model._meta.get_field("image").storage
+    for photo in photos.only("id", "image", "timestamp").iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        try:
+            size = storage.size(photo.image.name)
+        except FileNotFoundError:
+            continue
+
+        name = archive_name(photo)
+        yield ZipEntry(
+            name,
+            lambda photo=photo: storage.open(photo.image.name, "rb"),
+            size,
+            photo.timestamp,
+            os.path.splitext(name)[1] not in COMPRESSED_EXTENSIONS,
+        )
@@ -0,0 +1,128 @@
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from photo_gis.models import Photo, PhotoTag, PhotoTombstone, Tag
+
+
+def resolve_tags(names, create=True):
+    """
+    Fetches the tags with the given (lower case) names in two queries instead of one get_or_create per tag.
+
+    Args:
+        names: Iterable of normalised tag names
+        create: Whether tags that do not exist yet should be created
+    Returns:
+        List of Tag objects
+    """
+    names = list(names)
+    if not names:
+        return []
+
+    if create:
+        # Conflicts on the case insensitive unique constraint mean the tag already exists
+        Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+
+    return list(Tag.objects.annotate(lower_name=Lower("name")).filter(lower_name__in=names))
+
+
+def touch(photos):
+    """
+    Marks the photos in the queryset as modified for the changes feed.
+    Changing a photo's tags bypasses Photo.save(), which would do this otherwise.
+    """
+    Photo.objects.filter(id__in=photos.values("id")).update(updated_at=timezone.now())
+
+
+def add_tags(photos, names):
+    """
+    Adds tags to every photo in the queryset with a single INSERT ... SELECT on the through table.
+
+    Returns:
+        Number of photo-tag links created
+    """
+    tag_ids = [tag.id for tag in resolve_tags(names)]
+    if not tag_ids:
+        return 0
+
+    try:
+        photo_sql, photo_params = photos.values("id", "owner_id").query.sql_with_params()
+    except EmptyResultSet:
+        # Querysets that can match nothing, like filter(id__in=[]), have no SQL
+        return 0
+    table = connection.ops.quote_name(PhotoTag._meta.db_table)
+    photo_column = connection.ops.quote_name(PhotoTag._meta.get_field("photo").column)
+    tag_column = connection.ops.quote_name(PhotoTag._meta.get_field("tag").column)
+    owner_column = connection.ops.quote_name(PhotoTag._meta.get_field("owner").column)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({photo_column}, {tag_column}, {owner_column}) "
+            f"SELECT photos.id, tags.id, photos.owner_id "
+            f"FROM ({photo_sql}) AS photos CROSS JOIN unnest(%s::bigint[]) AS tags(id) "
+            f"ON CONFLICT DO NOTHING",
+            (*photo_params, tag_ids)
+        )
+        added = cursor.rowcount
+
+    if added:
+        touch(photos)
+    return added
+
+
+def remove_tags(photos, names):
+    """
+    Removes tags from every photo in the queryset with a single DELETE on the through table.
+
+    Returns:
+        Number of photo-tag links removed
+    """
+    tags = resolve_tags(names, create=False)
+    if not tags:
+        return 0
+
+    deleted, _ = PhotoTag.objects.filter(photo__in=photos.values("id"), tag__in=tags).delete()
+    if deleted:
+        touch(photos)
+    return deleted
+
+
+def set_tags(photos, names):
+    """
+    Replaces the tags of every photo in the queryset.
+
+    Returns:
+        Number of photo-tag links removed and created
+    """
+    tag_ids = [tag.id for tag in resolve_tags(names)]
+
+    removed, _ = PhotoTag.objects.filter(photo__in=photos.values("id")).exclude(tag_id__in=tag_ids).delete()
+    if removed:
+        touch(photos)
+    return removed + add_tags(photos, names)
+
+
+def delete_photos(photos):
+    """
+    Deletes every photo in the queryset, leaving a tombstone for each. Image files are removed once the
+    surrounding transaction commits so that a rollback never leaves rows pointing at missing files.
+
+    Returns:
+        Number of photos deleted
+    """
+    storage = Photo._meta.get_field("image").storage
+    rows = list(photos.values_list("id", "image", "owner_id"))
+    ids = [id for id, _, _ in rows]
+
+    # Through table rows are removed by the collector with a single DELETE ... WHERE photo_id IN (...)
+    _, deleted = Photo.objects.filter(id__in=ids).delete()
+    PhotoTombstone.objects.bulk_create([PhotoTombstone(photo_id=id, owner_id=owner_id) for id, _, owner_id in rows])
+
+    def delete_files():
+        for _, name, _ in rows:
+            if name:
+                storage.delete(name)
+
+    transaction.on_commit(delete_files)
+    return deleted.get(Photo._meta.label, 0)
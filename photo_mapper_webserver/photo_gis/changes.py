@@ -0,0 +1,104 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from photo_gis.models import Photo, PhotoTombstone, Tag
+
+TOKEN_SALT = "photo_gis.changes"
+
+
+def make_token(timestamp, id=None):
+    """
+    Returns a signed token for the position (timestamp, id) in an owner's change feed.
+    Without an id the position is just before every change made at timestamp.
+    """
+    return signing.dumps({"t": timestamp.isoformat(), "id": str(id) if id else None}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """
+    Returns:
+        (timestamp, id or None) of the position the token was made for
+    Raises:
+        ValueError if the token was not made by make_token
+    """
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT)
+        timestamp = parse_datetime(payload["t"])
+        id = uuid.UUID(payload["id"]) if payload["id"] else None
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise ValueError("Invalid change token")
+
+    if timestamp is None:
+        raise ValueError("Invalid change token")
+    return timestamp, id
+
+
+def after(position, timestamp_field, id_field):
+    # Keyset condition (timestamp, id) > position, served by the (owner, timestamp) indexes
+    timestamp, id = position
+    if id is None:
+        return Q(**{f"{timestamp_field}__gte": timestamp})
+    return Q(**{f"{timestamp_field}__gt": timestamp}) | Q(**{timestamp_field: timestamp, f"{id_field}__gt": id})
+
+
+def changes_since(owner_id, position=None, limit=None):
+    """
+    Returns the owner's photos created or modified and the photos deleted after position, oldest change first.
+
+    Photos are saved with a timestamp taken before their transaction commits, so a change can become
+    visible after later ones have been read. Once a client has caught up, its next token is therefore moved
+    back to settings.PHOTO_CHANGES_SAFETY_WINDOW_SECONDS ago, and changes in that window are sent again.
+    Applying a change twice is harmless.
+
+    Reads go to the primary, a lagging replica could hide changes older than the safety window.
+
+    Args:
+        owner_id: Id of the user whose collection is synced
+        position: (timestamp, id or None) from read_token, or None to start from the beginning
+        limit: Maximum number of changes, settings.PHOTO_CHANGES_PAGE_SIZE by default
+    Returns:
+        (photos, deleted photo ids, token for the next call, whether more changes are waiting)
+    """
+    limit = limit or settings.PHOTO_CHANGES_PAGE_SIZE
+    now = timezone.now()
+
+    photos = Photo.objects.using("default").filter(owner_id=owner_id)
+    tombstones = PhotoTombstone.objects.using("default").filter(owner_id=owner_id)
+    if position is not None:
+        photos = photos.filter(after(position, "updated_at", "id"))
+        tombstones = tombstones.filter(after(position, "deleted_at", "photo_id"))
+
+    photos = (
+        photos.select_related("owner")
+        .prefetch_related(Prefetch("tags", queryset=Tag.objects.using("default").order_by("name")))
+        .order_by("updated_at", "id")[:limit + 1]
+    )
+    tombstones = tombstones.order_by("deleted_at", "photo_id").values_list("deleted_at", "photo_id")[:limit + 1]
+
+    changes = sorted(
+        [(photo.updated_at, photo.id, photo) for photo in photos]
+        + [(deleted_at, photo_id, None) for deleted_at, photo_id in tombstones],
+        key=lambda change: change[:2],
+    )
+    more = len(changes) > limit
+    changes = changes[:limit]
+
+    horizon = now - timedelta(seconds=settings.PHOTO_CHANGES_SAFETY_WINDOW_SECONDS)
+    last = changes[-1][:2] if changes else position
+    if more or (last is not None and last[0] <= horizon):
+        token = make_token(*last)
+    else:
+        token = make_token(horizon)
+
+    return (
+        [photo for _, _, photo in changes if photo is not None],
+        [photo_id for _, photo_id, photo in changes if photo is None],
+        token,
+        more,
+    )
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Caches each process keeps to itself
+PROCESS_LOCAL_CACHE_BACKENDS = {
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+}
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Sticky replica routing, facet cache versions and cached authentication keep state in the default cache
+    that every process must see. With a per-process cache a write only takes effect in the process handling it.
+    """
+    if settings.CACHES["default"]["BACKEND"] in PROCESS_LOCAL_CACHE_BACKENDS:
+        return [Error(
+            "The default cache is not shared between processes.",
+            hint=(
+                "Replica routing after writes, facet cache invalidation and user deactivation would only take "
+                "effect in the process handling the write. Set CACHE_URL to a shared cache such as redis://localhost:6379/1."
+            ),
+            id="photo_gis.E001",
+        )]
+    return []
@@ -0,0 +1,31 @@
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def collection_version_key(owner_id):
+    return f"photo-collection-version:{owner_id}"
+
+
+def get_collection_version(owner_id):
+    """
+    Returns an opaque token that changes whenever the owner's photos or their tags change.
+    Cached results keyed on it are never served stale and need no explicit invalidation.
+    """
+    key = collection_version_key(owner_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        # add() so concurrent first readers settle on the same version
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_collection_version(owner_id):
+    """
+    Gives the owner's collection a new version once the current transaction commits,
+    so readers never cache pre-commit data under the new version.
+    """
+    transaction.on_commit(lambda: cache.set(collection_version_key(owner_id), uuid.uuid4().hex, timeout=None))
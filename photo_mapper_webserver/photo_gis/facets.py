@@ -0,0 +1,44 @@
+from django.db import connections
+
+from photo_gis.models import PhotoTag, Tag
+
+
+def tag_facets(photos):
+    """
+    Counts the photos in the queryset per tag with one GROUP BY GROUPING SETS query,
+    which also yields the total in the same pass.
+
+    Returns:
+        dict with 'total', 'untagged' and 'tags', a list of {'name', 'count'} by descending count
+    """
+    # Run on whichever database the router picks for the queryset, which may be a replica
+    connection = connections[photos.db]
+    photo_sql, photo_params = photos.values("id").query.sql_with_params()
+    quote = connection.ops.quote_name
+    through_table = quote(PhotoTag._meta.db_table)
+    photo_column = quote(PhotoTag._meta.get_field("photo").column)
+    tag_column = quote(PhotoTag._meta.get_field("tag").column)
+    tag_table = quote(Tag._meta.db_table)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT GROUPING(pt.{tag_column}), pt.{tag_column}, t.name, COUNT(DISTINCT photos.id) "
+            f"FROM ({photo_sql}) AS photos "
+            f"LEFT JOIN {through_table} AS pt ON pt.{photo_column} = photos.id "
+            f"LEFT JOIN {tag_table} AS t ON t.id = pt.{tag_column} "
+            f"GROUP BY GROUPING SETS ((pt.{tag_column}, t.name), ())",
+            photo_params
+        )
+        rows = cursor.fetchall()
+
+    facets = {"total": 0, "untagged": 0, "tags": []}
+    for is_total, tag_id, name, count in rows:
+        if is_total:
+            facets["total"] = count
+        elif tag_id is None:
+            facets["untagged"] = count
+        else:
+            facets["tags"].append({"name": name, "count": count})
+
+    facets["tags"].sort(key=lambda tag: (-tag["count"], tag["name"]))
+    return facets
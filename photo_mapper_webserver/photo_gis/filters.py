@@ -0,0 +1,169 @@
+import math
+
+from django.contrib.gis.geos import Polygon
+from django.db.models import Count
+from django.db.models.functions import Lower
+from django.utils.dateparse import parse_datetime
+import rest_framework.exceptions as exceptions
+
+from photo_gis.models import PhotoTag, Tag
+from utils.exif_reader import CAMERA_NUMBER_TAGS, CAMERA_STRING_TAGS
+
+FILTER_PARAMS = ("bbox", "taken_after", "taken_before", "place", "country", "tags", "match")
+# exif.<field> and exif.<field>__<lookup> parameters filter on the photo's extended EXIF fields
+EXIF_PREFIX = "exif."
+EXIF_STRING_FIELDS = {name for names in CAMERA_STRING_TAGS.values() for name in names}
+EXIF_NUMBER_FIELDS = {name for names in CAMERA_NUMBER_TAGS.values() for name in names}
+EXIF_LOOKUPS = ("gte", "gt", "lte", "lt")
+
+
+def filter_params(params):
+    """
+    Returns:
+        dict of the non empty filter parameters in params, e.g. to key a cache on
+    """
+    return {
+        name: params.get(name) for name in params
+        if (name in FILTER_PARAMS or name.startswith(EXIF_PREFIX)) and params.get(name)
+    }
+
+
+def filter_photos(queryset, params):
+    """
+    Applies the photo filters found in params to a Photo queryset.
+
+    Args:
+        queryset: Photo queryset to filter, usually already restricted to one owner
+        params: QueryDict or dict that may contain
+            bbox: "min_lon,min_lat,max_lon,max_lat"
+            taken_after: ISO 8601 datetime, inclusive
+            taken_before: ISO 8601 datetime, exclusive
+            place: exact place name
+            country: ISO 3166-1 alpha-2 country code
+            tags: comma separated tag names
+            match: 'all' (default) keeps photos having every tag, 'any' photos having at least one
+            exif.<field>: exact value of an extended EXIF field, e.g. exif.Model
+            exif.<field>__<lookup>: gte, gt, lte or lt bound of a numeric EXIF field, e.g. exif.FocalLength__gte, not indexed
+    Returns:
+        The filtered queryset
+    Raises:
+        ParseError if a filter value is malformed
+    """
+    bbox = params.get("bbox")
+    if bbox:
+        queryset = queryset.filter(location_geometry__intersects=parse_bbox(bbox))
+
+    taken_after = params.get("taken_after")
+    if taken_after:
+        queryset = queryset.filter(timestamp__gte=parse_timestamp(taken_after, "taken_after"))
+
+    taken_before = params.get("taken_before")
+    if taken_before:
+        queryset = queryset.filter(timestamp__lt=parse_timestamp(taken_before, "taken_before"))
+
+    place = params.get("place")
+    if place:
+        queryset = queryset.filter(place=place)
+
+    country = params.get("country")
+    if country:
+        queryset = queryset.filter(country_code=str(country).upper())
+
+    tags = params.get("tags")
+    if tags:
+        # A comma separated string in query parameters, a list in bulk filters
+        names = [str(name) for name in tags] if isinstance(tags, list) else str(tags).split(",")
+        queryset = filter_by_tags(queryset, names, params.get("match", "all"))
+
+    exif = {name: value for name, value in filter_params(params).items() if name.startswith(EXIF_PREFIX)}
+    if exif:
+        queryset = filter_by_exif(queryset, exif)
+
+    return queryset
+
+
+def filter_by_tags(queryset, names, match: str = "all"):
+    """
+    Keeps the photos tagged with all or any of names. Resolved with one subquery over the
+    PhotoTag through table rather than one join per tag.
+    """
+    if match not in ("all", "any"):
+        raise exceptions.ParseError("'match' must be 'all' or 'any'.")
+
+    names = {name.strip().lower() for name in names if name.strip()}
+    if not names:
+        return queryset
+
+    tag_ids = Tag.objects.annotate(lower_name=Lower("name")).filter(lower_name__in=names).values("id")
+    tagged = PhotoTag.objects.filter(tag_id__in=tag_ids)
+
+    if match == "all":
+        # A photo has each tag at most once, so having all of them means one row per requested name
+        tagged = tagged.values("photo_id").annotate(matched=Count("tag_id")).filter(matched=len(names))
+
+    return queryset.filter(id__in=tagged.values("photo_id"))
+
+
+def filter_by_exif(queryset, params):
+    """
+    Keeps the photos whose extended EXIF fields match params, a dict of exif.<field>[__<lookup>] -> value.
+    Exact values are combined into one jsonb containment (exif @> {...}), which the GIN index on Photo.exif
+    answers. Range lookups such as exif.FocalLength__gte are not indexed, jsonb_path_ops only serves containment.
+    They compare the field's number on the rows the other conditions leave.
+    """
+    exact = {}
+    for param, value in params.items():
+        name, _, lookup = param[len(EXIF_PREFIX):].partition("__")
+
+        if name in EXIF_STRING_FIELDS:
+            if lookup:
+                raise exceptions.ParseError(f"'{param}': {name} can only be matched exactly.")
+            exact[name] = str(value)
+        elif name in EXIF_NUMBER_FIELDS:
+            try:
+                number = float(value)
+            except ValueError:
+                number = math.nan
+            if not math.isfinite(number):
+                raise exceptions.ParseError(f"'{param}' must be a number.")
+            if not lookup:
+                exact[name] = number
+            elif lookup in EXIF_LOOKUPS:
+                queryset = queryset.filter(**{f"exif__{name}__{lookup}": number})
+            else:
+                raise exceptions.ParseError(f"'{param}': lookup must be one of {', '.join(EXIF_LOOKUPS)}.")
+        else:
+            fields = ", ".join(sorted(EXIF_STRING_FIELDS | EXIF_NUMBER_FIELDS))
+            raise exceptions.ParseError(f"'{param}': EXIF field must be one of {fields}.")
+
+    if exact:
+        queryset = queryset.filter(exif__contains=exact)
+    return queryset
+
+
+def parse_bbox(value: str):
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in str(value).split(","))
+    except ValueError:
+        raise exceptions.ParseError("'bbox' must be four comma separated numbers: min_lon,min_lat,max_lon,max_lat.")
+
+    if min_lon > max_lon or min_lat > max_lat:
+        raise exceptions.ParseError("'bbox' minimums must not be larger than its maximums.")
+
+    polygon = Polygon.from_bbox((min_lon, min_lat, max_lon, max_lat))
+    polygon.srid = 4326
+    return polygon
+
+
+def parse_timestamp(value: str, name: str):
+    try:
+        dt = parse_datetime(str(value))
+    except ValueError:
+        dt = None
+
+    if dt is None:
+        raise exceptions.ParseError(f"'{name}' must be an ISO 8601 datetime.")
+    if dt.tzinfo is None:
+        raise exceptions.ParseError(f"'{name}' must include a timezone offset.")
+
+    return dt
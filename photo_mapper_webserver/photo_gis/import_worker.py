@@ -0,0 +1,51 @@
+"""
+Code run inside the import_photos worker processes. It must not import models at module level
+because spawned workers unpickle these functions before Django is set up.
+"""
+import os
+from dataclasses import dataclass
+
+import django
+from django.conf import settings
+
+from utils.admission import decode_cost
+from utils.exif_reader import read_photo_metadata
+from utils.resize_photo import resize_image
+
+
+@dataclass
+class ProcessedFile:
+    path: str
+    size: int
+    timestamp: object = None
+    coordinates: tuple = None
+    image: bytes = None
+    perceptual_hash: int = None
+    exif: dict = None
+    error: str = None
+
+
+def init_worker():
+    django.setup()
+
+
+def process_file(path: str):
+    """
+    Reads the metadata of an image file and resizes it. Runs inside a worker process.
+
+    Returns:
+        ProcessedFile with the timestamp, (lon, lat), resized JPEG bytes and EXIF camera fields, or with error set
+    """
+    size = os.path.getsize(path)
+    try:
+        with open(path, "rb") as f:
+            # Workers already bound how many images are decoded at once, only the pixel limit applies
+            decode_cost(f, settings.INGEST_MAX_IMAGE_PIXELS)
+            timestamp, point, camera = read_photo_metadata(f)
+            f.seek(0)
+            resized = resize_image(f)
+        return ProcessedFile(
+            path, size, timestamp, (point.x, point.y), resized.read(), resized.perceptual_hash, camera
+        )
+    except Exception as e:
+        return ProcessedFile(path, size, error=f"{type(e).__name__}: {e}")
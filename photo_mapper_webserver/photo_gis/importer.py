@@ -0,0 +1,80 @@
+import os
+
+from django.contrib.gis.geos import Point
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from photo_gis.collection import bump_collection_version
+from photo_gis.import_worker import ProcessedFile
+from photo_gis.models import Photo, PhotoTag
+from utils.geocoder import reverse_geocode
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp"}
+
+
+def iter_image_paths(directory: str):
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(dirpath, filename)
+
+
+def build_photo(owner, processed: ProcessedFile):
+    """
+    Writes the resized image to storage and returns the unsaved Photo for it,
+    so the image bytes do not have to be held until the batch is inserted.
+    """
+    photo = Photo(
+        owner=owner,
+        location=Point(*processed.coordinates, srid=4326),
+        timestamp=processed.timestamp,
+        perceptual_hash=processed.perceptual_hash,
+        exif=processed.exif or {},
+    )
+    place = reverse_geocode(photo.location)
+    if place is not None:
+        photo.place, photo.country_code = place.name, place.country_code
+    photo.image.save(os.path.basename(processed.path), ContentFile(processed.image), save=False)
+    return photo
+
+
+def write_batch(owner, photos, tags):
+    """
+    Inserts a batch of photos with one bulk INSERT for the photos and one for their tags.
+
+    Photos matching an existing photo of the owner on time and place are skipped
+    and their image files deleted.
+
+    Returns:
+        (imported, duplicates) counts
+    """
+    existing = {
+        (timestamp, location.x, location.y)
+        for timestamp, location in Photo.objects.filter(
+            owner=owner, timestamp__in=[photo.timestamp for photo in photos]
+        ).values_list("timestamp", "location")
+    }
+
+    new_photos = []
+    for photo in photos:
+        key = (photo.timestamp, photo.location.x, photo.location.y)
+        if key not in existing:
+            existing.add(key)
+            new_photos.append(photo)
+
+    with transaction.atomic():
+        # A concurrent upload can still win the race on the unique constraint, so conflicts are ignored
+        # and the rows that actually made it are read back
+        Photo.objects.bulk_create(new_photos, ignore_conflicts=True)
+        inserted = set(Photo.objects.filter(id__in=[photo.id for photo in new_photos]).values_list("id", flat=True))
+        PhotoTag.objects.bulk_create(
+            [PhotoTag(photo_id=photo_id, tag_id=tag.id, owner_id=owner.id) for photo_id in inserted for tag in tags]
+        )
+        bump_collection_version(owner.id)
+
+    for photo in photos:
+        if photo.id not in inserted:
+            photo.image.delete(save=False)
+
+    return len(inserted), len(photos) - len(inserted)
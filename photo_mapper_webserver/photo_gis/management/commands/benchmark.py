@@ -0,0 +1,112 @@
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment, override_settings
+
+from benchmarks.harness import run_scenario
+from benchmarks.scenarios import SCENARIOS, BenchmarkContext, seed_photos
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the photo API against a throwaway test database and prints the results as JSON. "
+        "Results include the git commit so runs can be compared."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "scenarios", nargs="*", default=["upload", "list", "detail", "auth", "bbox_time", "bbox_geometry", "serialize"],
+            help=f"Scenarios to run. Available: {', '.join(sorted(SCENARIOS))}."
+        )
+        parser.add_argument("--iterations", type=int, default=100, help="Measured requests per scenario.")
+        parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests made first.")
+        parser.add_argument("--concurrency", type=int, default=4, help="Number of concurrent client threads.")
+        parser.add_argument(
+            "--megapixels", default="1,12",
+            help="Comma separated image sizes for the upload scenario."
+        )
+        parser.add_argument("--seed-photos", type=int, default=10000, help="Photos inserted before the read scenarios.")
+        parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        unknown = set(options["scenarios"]) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options["keepdb"])
+        try:
+            with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+                results = self.run_benchmarks(options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+
+        report = json.dumps(
+            {"meta": self.metadata(), "config": self.config(options), "results": results},
+            indent=2
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(report)
+        else:
+            self.stdout.write(report)
+
+    def run_benchmarks(self, options):
+        owner = get_user_model().objects.create_user(username="benchmark", password="benchmark")
+        seed_photos(owner, options["seed_photos"])
+        # Fresh statistics, so the planner picks the indexes it would on a long-lived database
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        context = BenchmarkContext(
+            owner=owner,
+            iterations=options["iterations"],
+            warmup=options["warmup"],
+            concurrency=options["concurrency"],
+            megapixels=[float(value) for value in options["megapixels"].split(",")],
+            seed_photos=options["seed_photos"],
+        )
+
+        results = {}
+        for name in options["scenarios"]:
+            for result_name, make_request, prepare in SCENARIOS[name](context):
+                self.stderr.write(f"Running {result_name}...")
+                results[result_name] = run_scenario(
+                    make_request,
+                    iterations=options["iterations"],
+                    concurrency=options["concurrency"],
+                    warmup=options["warmup"],
+                    prepare=prepare,
+                )
+        return results
+
+    def metadata(self):
+        return {
+            "commit": self.git(["rev-parse", "HEAD"]),
+            "dirty": bool(self.git(["status", "--porcelain", "--untracked-files=no"])),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "django": django.get_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        }
+
+    def config(self, options):
+        keys = ["scenarios", "iterations", "warmup", "concurrency", "megapixels", "seed_photos"]
+        return {key: options[key] for key in keys}
+
+    def git(self, args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
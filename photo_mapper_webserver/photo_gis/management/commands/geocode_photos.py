@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from photo_gis.collection import bump_collection_version
+from photo_gis.models import Photo
+from utils.geocoder import get_reverse_geocoder
+
+
+class Command(BaseCommand):
+    help = "Fills in the place and country code of photos that have none, e.g. after configuring GAZETTEER_PATH."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Photos updated per query.")
+
+    def handle(self, *args, **options):
+        geocoder = get_reverse_geocoder()
+        if geocoder is None:
+            raise CommandError("GAZETTEER_PATH is not set")
+
+        batch_size = options["batch_size"]
+        queryset = Photo.objects.filter(place="").only("id", "owner_id", "location").order_by("id")
+
+        updated = scanned = 0
+        last_id = None
+        while True:
+            # Keyset pagination, since updated photos drop out of the queryset and unresolved ones stay in it
+            page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+            batch = list(page[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            scanned += len(batch)
+
+            changed = []
+            for photo in batch:
+                place = geocoder.lookup(photo.location.x, photo.location.y)
+                if place is not None:
+                    photo.place, photo.country_code = place.name, place.country_code
+                    photo.updated_at = timezone.now()
+                    changed.append(photo)
+            Photo.objects.bulk_update(changed, ["place", "country_code", "updated_at"])
+            for owner_id in {photo.owner_id for photo in changed}:
+                bump_collection_version(owner_id)
+            updated += len(changed)
+
+        self.stdout.write(f"Scanned {scanned} photos without a place, labelled {updated}.")
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from PIL import Image
+
+from photo_gis.models import Photo
+from utils.resize_photo import perceptual_hash
+
+
+class Command(BaseCommand):
+    help = "Computes the perceptual hash of photos uploaded before hashes were stored, for similar photo search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Photos updated per query.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        queryset = Photo.objects.filter(perceptual_hash__isnull=True).only("id", "image").order_by("id")
+
+        hashed = failed = 0
+        last_id = None
+        while True:
+            # Keyset pagination, since hashed photos drop out of the queryset and unreadable ones stay in it
+            page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+            batch = list(page[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            changed = []
+            for photo in batch:
+                try:
+                    # Stored images are the resized ones uploads are hashed from
+                    with photo.image.open("rb") as image_file, Image.open(image_file) as img:
+                        photo.perceptual_hash = perceptual_hash(img)
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    self.stderr.write(f"Could not hash {photo.id}: {e}")
+                    continue
+                photo.updated_at = timezone.now()
+                changed.append(photo)
+            Photo.objects.bulk_update(changed, ["perceptual_hash", "updated_at"])
+            hashed += len(changed)
+
+        self.stdout.write(f"Hashed {hashed} photos, {failed} could not be read.")
@@ -0,0 +1,126 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from photo_gis.bulk import resolve_tags
+from photo_gis.import_worker import init_worker, process_file
+from photo_gis.importer import build_photo, iter_image_paths, write_batch
+from photo_gis.serializers import normalize_tags
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports every image below a directory for one user. Metadata extraction and resizing run in a "
+        "process pool and rows are written in bulk. Progress is checkpointed so an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory to import recursively.")
+        parser.add_argument("--owner", required=True, help="Username of the owner of the imported photos.")
+        parser.add_argument("--tags", nargs="*", default=[], help="Tags added to every imported photo.")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Photos inserted per bulk_create.")
+        parser.add_argument(
+            "--checkpoint",
+            help="File recording the paths already handled. Defaults to a file in the current directory "
+                 "named after the owner and the import directory."
+        )
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options["directory"])
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory")
+
+        try:
+            owner = get_user_model().objects.get(username=options["owner"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"User '{options['owner']}' does not exist")
+
+        tags = resolve_tags(normalize_tags(options["tags"]))
+
+        checkpoint_path = options["checkpoint"] or self.default_checkpoint(owner, directory)
+        done = self.read_checkpoint(checkpoint_path)
+        if done:
+            self.stdout.write(f"Resuming: {len(done)} files already handled according to {checkpoint_path}")
+
+        paths = (path for path in iter_image_paths(directory) if path not in done)
+        batch_size = options["batch_size"]
+        window = options["workers"] * 4
+
+        stats = {"imported": 0, "duplicates": 0, "failed": 0, "bytes": 0, "start": time.perf_counter()}
+        batch = []
+
+        # Workers are spawned rather than forked so they never inherit the parent's database connections
+        with open(checkpoint_path, "a") as checkpoint, ProcessPoolExecutor(
+            max_workers=options["workers"], mp_context=multiprocessing.get_context("spawn"), initializer=init_worker
+        ) as executor:
+            pending = set()
+            exhausted = False
+            while pending or not exhausted:
+                # Keep a bounded number of files in flight so resized images never pile up in memory
+                while not exhausted and len(pending) < window:
+                    path = next(paths, None)
+                    if path is None:
+                        exhausted = True
+                    else:
+                        pending.add(executor.submit(process_file, path))
+
+                if not pending:
+                    break
+
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    result = future.result()
+                    stats["bytes"] += result.size
+                    if result.error:
+                        stats["failed"] += 1
+                        self.stderr.write(f"Skipping {result.path}: {result.error}")
+                        checkpoint.write(result.path + "\n")
+                    else:
+                        batch.append((result.path, build_photo(owner, result)))
+
+                if len(batch) >= batch_size:
+                    self.flush(owner, batch, tags, stats, checkpoint)
+                    batch = []
+
+            if batch:
+                self.flush(owner, batch, tags, stats, checkpoint)
+
+        self.report(stats, final=True)
+
+    def flush(self, owner, batch, tags, stats, checkpoint):
+        imported, duplicates = write_batch(owner, [photo for _, photo in batch], tags)
+        stats["imported"] += imported
+        stats["duplicates"] += duplicates
+
+        # Paths are only checkpointed once their rows are committed
+        checkpoint.writelines(path + "\n" for path, _ in batch)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+        self.report(stats)
+
+    def report(self, stats, final=False):
+        elapsed = max(time.perf_counter() - stats["start"], 1e-6)
+        handled = stats["imported"] + stats["duplicates"] + stats["failed"]
+        summary = (
+            f"{handled} files in {elapsed:.1f}s ({handled / elapsed:.1f} files/s, "
+            f"{stats['bytes'] / elapsed / 1e6:.1f} MB/s): {stats['imported']} imported, "
+            f"{stats['duplicates']} duplicates, {stats['failed']} failed"
+        )
+        self.stdout.write(("Done. " if final else "") + summary)
+
+    def default_checkpoint(self, owner, directory):
+        digest = hashlib.sha1(directory.encode()).hexdigest()[:12]
+        return os.path.abspath(f".import_photos-{owner.username}-{digest}.checkpoint")
+
+    def read_checkpoint(self, path):
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
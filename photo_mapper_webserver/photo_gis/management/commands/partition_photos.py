@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from photo_gis.partitioning import (
+    NEW_SUFFIX, OLD_SUFFIX, copy_batch, create_partitioned_table, install_sync_trigger, is_partitioned,
+    partition_specs, swap,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Hash partitions the photo and photo tag tables by owner while the site stays up. Copies are created, "
+        "kept in sync by triggers while existing rows are copied in batches, then swapped in. "
+        "Safe to run again after an interruption."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partitions", type=int, default=16, help="Number of hash partitions per table.")
+        parser.add_argument("--batch-size", type=int, default=10000, help="Rows copied per transaction.")
+        parser.add_argument(
+            "--lock-timeout", type=int, default=5,
+            help="Seconds to wait for the exclusive lock the swap needs before giving up, so queries do not queue behind it."
+        )
+
+    def handle(self, *args, **options):
+        if options["partitions"] < 1:
+            raise CommandError("--partitions must be positive")
+
+        specs = partition_specs()
+        with connection.cursor() as cursor:
+            if is_partitioned(cursor, specs[0].table):
+                self.stdout.write(f"{specs[0].table} is already partitioned.")
+                return
+
+            with transaction.atomic():
+                for spec in specs:
+                    if create_partitioned_table(cursor, spec, options["partitions"], {spec.table for spec in specs}):
+                        self.stdout.write(f"Created {spec.table}{NEW_SUFFIX} with {options['partitions']} partitions.")
+
+            # Each table is in sync before the next is copied, the later ones reference its rows
+            for spec in specs:
+                with transaction.atomic():
+                    install_sync_trigger(cursor, spec)
+
+                copied = 0
+                last = None
+                while True:
+                    with transaction.atomic():
+                        count, last = copy_batch(cursor, spec, last, options["batch_size"])
+                    copied += count
+                    if count < options["batch_size"]:
+                        break
+                self.stdout.write(f"Copied {copied} rows of {spec.table}.")
+
+            try:
+                with transaction.atomic():
+                    cursor.execute("SET LOCAL lock_timeout = %s", [f"{options['lock_timeout']}s"])
+                    swap(cursor, specs)
+            except OperationalError as e:
+                raise CommandError(f"Could not swap the tables in, run the command again: {e}")
+
+        self.stdout.write(
+            f"Swapped in the partitioned tables. The old ones are kept as "
+            f"{', '.join(spec.table + OLD_SUFFIX for spec in specs)}, drop them once you no longer need them."
+        )
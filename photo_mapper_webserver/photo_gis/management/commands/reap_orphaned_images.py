@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from photo_gis.reaper import reap_orphaned_images
+
+
+class Command(BaseCommand):
+    help = "Deletes image files that are no longer referenced by any photo."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace-period", type=float, default=settings.PHOTO_REAPER_GRACE_PERIOD,
+            help="Minimum age in seconds of a file before it can be deleted."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.PHOTO_REAPER_BATCH_SIZE,
+            help="Number of files looked up in the database per query."
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Report what would be deleted without deleting anything."
+        )
+
+    def handle(self, *args, **options):
+        result = reap_orphaned_images(
+            grace_period=options["grace_period"],
+            batch_size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            f"Scanned {result.scanned} files. {verb} {result.deleted} orphaned files, "
+            f"reclaiming {result.bytes_reclaimed} bytes."
+        )
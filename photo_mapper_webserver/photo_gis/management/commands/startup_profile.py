@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.startup import profile_imports, time_by_package
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures what a cold start imports: runs django.setup() and imports the given modules "
+        "in a fresh interpreter with -X importtime, then reports the cost per package and per module."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "modules", nargs="*",
+            help="Modules a process of interest imports after setup, ROOT_URLCONF by default.",
+        )
+        parser.add_argument("--top", type=int, default=20, help="Number of packages and modules to list.")
+
+    def handle(self, *args, **options):
+        modules = options["modules"] or [settings.ROOT_URLCONF]
+        try:
+            wall, imports = profile_imports(modules, cwd=settings.BASE_DIR)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        total_us = sum(entry.self_us for entry in imports)
+        self.stdout.write(
+            f"Cold start of {', '.join(modules)}: {wall * 1000:.0f} ms wall clock, "
+            f"{total_us / 1000:.0f} ms in {len(imports)} imports"
+        )
+
+        self.stdout.write("\nSelf time by package:")
+        for package, self_us in time_by_package(imports)[:options["top"]]:
+            self.stdout.write(f"  {self_us / 1000:8.1f} ms  {package}")
+
+        self.stdout.write("\nSlowest imports, including what they import:")
+        for entry in sorted(imports, key=lambda entry: entry.cumulative_us, reverse=True)[:options["top"]]:
+            self.stdout.write(f"  {entry.cumulative_us / 1000:8.1f} ms  {'  ' * entry.depth}{entry.module}")
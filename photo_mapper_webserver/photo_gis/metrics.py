@@ -0,0 +1,130 @@
+import ipaddress
+import logging
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from kombu.exceptions import ChannelError
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# With PROMETHEUS_MULTIPROC_DIR set, prometheus_client keeps these in per-process files
+# which the metrics view aggregates, so every Daphne/Gunicorn worker is counted.
+
+REQUEST_LATENCY = Histogram(
+    "photo_gis_request_duration_seconds",
+    "Latency of photo_gis API requests.",
+    ["route", "method", "status"],
+)
+UPLOAD_BYTES = Counter(
+    "photo_gis_upload_bytes",
+    "Bytes of image data received by photo uploads.",
+)
+UPLOADED_IMAGES = Counter(
+    "photo_gis_uploaded_images",
+    "Photos successfully ingested.",
+)
+INGEST_PHASE_DURATION = Histogram(
+    "photo_gis_ingest_phase_duration_seconds",
+    "Duration of each photo ingest phase.",
+    ["phase"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+EXIF_REJECTIONS = Counter(
+    "photo_gis_exif_rejections",
+    "Uploads rejected because of missing or invalid EXIF data.",
+    ["reason"],
+)
+DUPLICATE_REJECTIONS = Counter(
+    "photo_gis_duplicate_rejections",
+    "Uploads rejected because a photo at the same time and place already exists.",
+)
+NEAR_DUPLICATE_REJECTIONS = Counter(
+    "photo_gis_near_duplicate_rejections",
+    "Uploads rejected because they look like a photo the user already has.",
+)
+ADMISSION_REJECTIONS = Counter(
+    "photo_gis_ingest_admission_rejections",
+    "Uploads refused with 429 because the ingest queue was full or the wait timed out.",
+)
+COMPRESSED_RESPONSES = Counter(
+    "photo_gis_compressed_responses",
+    "Compressed responses by encoding and whether the body came from the cache, was streamed or was not modified.",
+    ["encoding", "cache"],
+)
+
+
+def observe_phase(name, duration):
+    INGEST_PHASE_DURATION.labels(phase=name).observe(duration)
+
+
+class CeleryQueueCollector:
+    """
+    Reports the number of messages waiting in each Celery queue, read from the broker at scrape time.
+    """
+
+    def collect(self):
+        from photo_mapper_webserver.celery import app
+
+        depth = GaugeMetricFamily(
+            "photo_gis_celery_queue_depth",
+            "Messages waiting in each Celery queue.",
+            labels=["queue"],
+        )
+        if not settings.METRICS_CELERY_QUEUES:
+            yield depth
+            return
+
+        try:
+            with app.connection_for_read() as connection:
+                connection.ensure_connection(max_retries=1)
+                channel = connection.default_channel
+                for queue in settings.METRICS_CELERY_QUEUES:
+                    try:
+                        _, message_count, _ = channel.queue_declare(queue=queue, passive=True)
+                    except ChannelError as exc:
+                        # Redis deletes the list of an idle queue, which then reads as not found
+                        if str(exc.reply_code) != "404":
+                            raise
+                        message_count = 0
+                    depth.add_metric([queue], message_count)
+        except Exception:
+            # An unreachable broker must not fail the whole scrape
+            logger.warning("Could not read Celery queue depth", exc_info=True)
+        yield depth
+
+
+def metrics_view(request):
+    """
+    Exposes all metrics in the Prometheus text format to clients in METRICS_ALLOWED_NETWORKS.
+    Anyone else gets a 404, as if the endpoint did not exist.
+    """
+    if not _is_allowed_scraper(request.META.get("REMOTE_ADDR", "")):
+        raise Http404
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = CollectorRegistry()
+        registry.register(_DefaultRegistryCollector())
+    registry.register(CeleryQueueCollector())
+
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def _is_allowed_scraper(remote_addr):
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+class _DefaultRegistryCollector:
+    # Lets the per-scrape registry include the process' default metrics without registering into REGISTRY itself
+
+    def collect(self):
+        return REGISTRY.collect()
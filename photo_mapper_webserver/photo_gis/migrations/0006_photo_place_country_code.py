@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo_gis', '0005_alter_tag_name_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='country_code',
+            field=models.CharField(blank=True, default='', max_length=2),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='place',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['owner', 'place'], name='owner_place_index'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['owner', 'country_code'], name='owner_country_code_index'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:30
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo_gis', '0006_photo_place_country_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('name'), name='text_pattern_ops'), name='tag_name_prefix_index'),
+        ),
+        # The (tag_id, photo_id) index on the through table is added by 0014, once PhotoTag describes it
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:33
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently, BtreeGistExtension
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently so the photo table stays writable
+    atomic = False
+
+    dependencies = [
+        ('photo_gis', '0007_tag_name_prefix_index_photo_tags_tag_photo_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        BtreeGistExtension(),
+        AddIndexConcurrently(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['owner', 'location', 'timestamp'], name='owner_location_timestamp_gist'),
+        ),
+    ]
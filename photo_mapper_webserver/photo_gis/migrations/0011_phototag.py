@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 10000
+
+
+def backfill_owners(apps, schema_editor):
+    # In short transactions over id ranges so the through table is never locked for long
+    PhotoTag = apps.get_model("photo_gis", "PhotoTag")
+    Photo = apps.get_model("photo_gis", "Photo")
+    db = schema_editor.connection.alias
+
+    last = PhotoTag.objects.using(db).aggregate(last=models.Max("id"))["last"] or 0
+    for start in range(0, last, BATCH_SIZE):
+        with transaction.atomic(using=db):
+            PhotoTag.objects.using(db).filter(id__gt=start, id__lte=start + BATCH_SIZE, owner__isnull=True).update(
+                owner_id=models.Subquery(Photo.objects.filter(id=models.OuterRef("photo_id")).values("owner_id")[:1])
+            )
+
+
+class Migration(migrations.Migration):
+    # The backfill commits per batch
+    atomic = False
+
+    dependencies = [
+        ('photo_gis', '0010_photo_perceptual_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Photo.tags keeps its table, only the model describing it becomes explicit
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='PhotoTag',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='photo_gis.photo')),
+                        ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='photo_gis.tag')),
+                    ],
+                    options={
+                        'db_table': 'photo_gis_photo_tags',
+                        'unique_together': {('photo', 'tag')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='photo',
+                    name='tags',
+                    field=models.ManyToManyField(related_name='photos', through='photo_gis.PhotoTag', to='photo_gis.tag'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='phototag',
+            name='owner',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_owners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:05
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently so the photo table stays writable
+    atomic = False
+
+    dependencies = [
+        ('photo_gis', '0011_phototag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='exif',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        AddIndexConcurrently(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['exif'], name='exif_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
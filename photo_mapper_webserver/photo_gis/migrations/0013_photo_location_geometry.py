@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:20
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, transaction
+from django.db.models.functions import Cast
+
+BATCH_SIZE = 10000
+
+# Keeps location_geometry equal to location whenever either is written
+CREATE_TRIGGER = """
+CREATE FUNCTION photo_gis_photo_location_geometry() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.location_geometry := NEW.location::geometry;
+    RETURN NEW;
+END
+$$;
+CREATE TRIGGER photo_gis_photo_location_geometry BEFORE INSERT OR UPDATE OF location, location_geometry
+ON photo_gis_photo FOR EACH ROW EXECUTE FUNCTION photo_gis_photo_location_geometry();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER photo_gis_photo_location_geometry ON photo_gis_photo;
+DROP FUNCTION photo_gis_photo_location_geometry();
+"""
+
+
+def backfill_location_geometry(apps, schema_editor):
+    # In short transactions over primary key ranges so the photo table is never locked for long
+    Photo = apps.get_model("photo_gis", "Photo")
+    db = schema_editor.connection.alias
+    photos = Photo.objects.using(db).order_by("id")
+
+    last = None
+    while True:
+        batch = photos.filter(id__gt=last) if last is not None else photos
+        ids = list(batch.values_list("id", flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        with transaction.atomic(using=db):
+            Photo.objects.using(db).filter(id__in=ids, location_geometry__isnull=True).update(
+                location_geometry=Cast("location", django.contrib.gis.db.models.fields.PointField(srid=4326))
+            )
+        last = ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Adding the nullable column is instant, the backfill commits per batch and the index is built
+    # concurrently, so the table stays writable throughout. The old index is only dropped once the new one exists.
+    atomic = False
+
+    dependencies = [
+        ('photo_gis', '0012_photo_exif'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='location_geometry',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, null=True, spatial_index=False, srid=4326),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunPython(backfill_location_geometry, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['owner', 'location_geometry', 'timestamp'], name='owner_geometry_timestamp_gist'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='photo',
+            name='owner_location_timestamp_gist',
+        ),
+    ]
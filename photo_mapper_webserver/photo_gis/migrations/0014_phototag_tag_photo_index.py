@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:40
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The index is built concurrently so tagging stays possible
+    atomic = False
+
+    dependencies = [
+        ('photo_gis', '0013_photo_location_geometry'),
+    ]
+
+    operations = [
+        # Earlier versions of 0007 created the same index with raw SQL
+        migrations.RunSQL(
+            "DROP INDEX CONCURRENTLY IF EXISTS photo_gis_photo_tags_tag_id_photo_id_idx;",
+            migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name='phototag',
+            index=models.Index(fields=['tag', 'photo'], name='photo_tags_tag_photo_index'),
+        ),
+    ]
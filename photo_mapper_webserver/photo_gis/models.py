@@ -1,8 +1,10 @@
 import os
 import uuid
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
 from django.db.models.functions import Lower
 from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 
@@ -19,6 +21,10 @@ class Tag(models.Model):
         constraints = [
             models.UniqueConstraint(Lower('name'), name="name_case_insensitive_unique_constraint")
         ]
+        indexes = [
+            # Serves prefix (LIKE 'abc%') autocomplete on lower(name), which the unique index cannot
+            models.Index(OpClass(Lower('name'), name='text_pattern_ops'), name='tag_name_prefix_index'),
+        ]
 
     def __str__(self):
         return self.name
@@ -29,17 +35,92 @@ class Photo(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     image = models.ImageField(upload_to=photo_directory_path)
     location = models.PointField(geography=True)
+    # Planar copy of location, set by a trigger on every insert and location update (see migration 0013),
+    # so it is only current after refresh_from_db. Bbox queries are cheaper on it than on geography,
+    # which stays for exact distances
+    location_geometry = models.PointField(srid=4326, null=True, blank=True, editable=False, spatial_index=False)
     timestamp = models.DateTimeField()
-    tags = models.ManyToManyField(Tag, related_name='photos')
+    tags = models.ManyToManyField(Tag, related_name='photos', through='PhotoTag')
+    # Nearest gazetteer place to location, filled in at ingest. Blank when no place is known
+    place = models.CharField(max_length=200, blank=True, default="")
+    country_code = models.CharField(max_length=2, blank=True, default="")
+    # Bumped on every save and by bulk tag changes, so sync clients can ask for what changed since they last looked
+    updated_at = models.DateTimeField(auto_now=True)
+    # dHash of the resized image, see utils.resize_photo.perceptual_hash. Null for photos not hashed yet
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Camera, lens, focal length, altitude and heading read at ingest, see utils.exif_reader.get_camera_info
+    exif = models.JSONField(default=dict, blank=True, editable=False)
 
     class Meta:
         indexes = [
             models.Index(fields=['timestamp'], name='timestamp_index'),
+            models.Index(fields=['owner', 'place'], name='owner_place_index'),
+            models.Index(fields=['owner', 'country_code'], name='owner_country_code_index'),
+            # Answers owner + bbox + time range filters from one index (needs btree_gist for owner and timestamp)
+            GistIndex(fields=['owner', 'location_geometry', 'timestamp'], name='owner_geometry_timestamp_gist'),
+            models.Index(fields=['owner', 'updated_at'], name='owner_updated_at_index'),
+            # Serves exif.<field>= filters, which are turned into a single jsonb containment (@>)
+            GinIndex(fields=['exif'], name='exif_gin', opclasses=['jsonb_path_ops']),
         ]
 
+        # Unique constraints must include owner, the table can be hash partitioned by it (see partition_photos)
         constraints = [
             models.UniqueConstraint(fields=["location", "timestamp", "owner"], name="unique_time_and_place")
         ]
     
     def __str__(self):
-        return f"{self.location.wkt}:{self.timestamp}"
\ No newline at end of file
+        return f"{self.location.wkt}:{self.timestamp}"
+
+class PhotoTagQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Photo.tags.add() and set() create links without an owner, copy it from their photos
+        objs = list(objs)
+        photo_ids = {obj.photo_id for obj in objs if obj.owner_id is None}
+        if photo_ids:
+            owners = dict(Photo.objects.using(self.db).filter(id__in=photo_ids).values_list("id", "owner_id"))
+            for obj in objs:
+                if obj.owner_id is None:
+                    obj.owner_id = owners.get(obj.photo_id)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class PhotoTag(models.Model):
+    """
+    Link between a photo and a tag. It repeats the photo's owner so that, like Photo,
+    it can be partitioned by owner, see the partition_photos command.
+    """
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    # Null only for links made before the column was added and not backfilled yet
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+
+    objects = PhotoTagQuerySet.as_manager()
+
+    class Meta:
+        # The table Django created for Photo.tags before this model replaced it
+        db_table = "photo_gis_photo_tags"
+        unique_together = [("photo", "tag")]
+        indexes = [
+            # The unique index serves lookups by photo, tag filters look up photos by tag
+            models.Index(fields=['tag', 'photo'], name='photo_tags_tag_photo_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.photo_id}:{self.tag_id}"
+
+
+class PhotoTombstone(models.Model):
+    """
+    Left behind by a deleted photo so sync clients learn about the deletion from the changes feed.
+    """
+    photo_id = models.UUIDField()
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'deleted_at'], name='owner_deleted_at_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.photo_id}:{self.deleted_at}"
@@ -1,7 +1,30 @@
+from django.core.paginator import InvalidPage
+from rest_framework.exceptions import NotFound
 from rest_framework_gis.pagination import GeoJsonPagination
 
 class PhotoGeoJsonPagination(GeoJsonPagination):
     # Standard DRF attributes still apply
     page_size = 10
     page_size_query_param = 'page_size' # Allow frontend to request ?page_size=50
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+
+    def paginate_queryset_lazily(self, queryset, request, view=None):
+        """
+        Same as paginate_queryset, but returns the page as an unevaluated queryset
+        so it can be used in a query of its own. The next and previous links work as usual.
+        """
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = self.get_page_number(request, paginator)
+
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        return self.page.object_list
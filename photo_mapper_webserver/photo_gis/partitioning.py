@@ -0,0 +1,308 @@
+import re
+from collections import namedtuple
+
+from django.db import connection
+
+from photo_gis.models import Photo, PhotoTag
+
+NEW_SUFFIX = "_partitioned"
+OLD_SUFFIX = "_unpartitioned"
+
+# table: name of the table, key: its owner column, owner_sql: SQL for a row's owner with {row} the row alias
+PartitionSpec = namedtuple("PartitionSpec", ["table", "key", "owner_sql"])
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def suffixed(name: str, suffix: str):
+    # Postgres truncates identifiers to 63 bytes
+    return name[:63 - len(suffix)] + suffix
+
+
+def partition_specs():
+    """
+    Returns the tables partitioned by owner, in the order they must be copied:
+    the tags' through table references photos by (photo id, owner).
+    """
+    photo_table = Photo._meta.db_table
+    owner = Photo._meta.get_field("owner").column
+    tag_owner = PhotoTag._meta.get_field("owner").column
+    photo = PhotoTag._meta.get_field("photo").column
+    return [
+        PartitionSpec(photo_table, owner, f"{{row}}.{quote(owner)}"),
+        PartitionSpec(
+            PhotoTag._meta.db_table,
+            tag_owner,
+            # Links made before the owner column existed may still lack it
+            f"coalesce({{row}}.{quote(tag_owner)}, "
+            f"(SELECT {quote(owner)} FROM {quote(photo_table)} WHERE id = {{row}}.{quote(photo)}))",
+        ),
+    ]
+
+
+def is_partitioned(cursor, table: str):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def table_exists(cursor, table: str):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [table])
+    return cursor.fetchone()[0]
+
+
+def columns(cursor, table: str):
+    """
+    Returns:
+        List of (name, whether values come from a sequence) in table order, without generated columns,
+        which cannot be written
+    """
+    cursor.execute(
+        "SELECT attname, attidentity <> '' OR coalesce(pg_get_expr(adbin, adrelid) LIKE 'nextval(%%', false) "
+        "FROM pg_attribute LEFT JOIN pg_attrdef ON adrelid = attrelid AND adnum = attnum "
+        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '' ORDER BY attnum",
+        [table]
+    )
+    return cursor.fetchall()
+
+
+def primary_key(cursor, table: str):
+    cursor.execute(
+        "SELECT a.attname FROM pg_index i "
+        "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+        "WHERE i.indrelid = %s::regclass AND i.indisprimary",
+        [table]
+    )
+    names = [name for name, in cursor.fetchall()]
+    if len(names) != 1:
+        raise ValueError(f"{table} must have a single column primary key to be partitioned")
+    return names[0]
+
+
+def constraints(cursor, table: str):
+    """
+    Returns:
+        List of (name, type, definition, column names, referenced table, referenced column names)
+    """
+    cursor.execute(
+        "SELECT c.conname, c.contype, pg_get_constraintdef(c.oid), "
+        "array(SELECT attname FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, i) "
+        "    JOIN pg_attribute ON attrelid = c.conrelid AND pg_attribute.attnum = k.attnum ORDER BY i), "
+        "c.confrelid::regclass::text, "
+        "array(SELECT attname FROM unnest(c.confkey) WITH ORDINALITY AS k(attnum, i) "
+        "    JOIN pg_attribute ON attrelid = c.confrelid AND pg_attribute.attnum = k.attnum ORDER BY i) "
+        # Not the constraints Postgres derives for each partition of a referenced partitioned table
+        "FROM pg_constraint c WHERE c.conrelid = %s::regclass AND c.conparentid = 0 ORDER BY c.conname",
+        [table]
+    )
+    return cursor.fetchall()
+
+
+def indexes(cursor, table: str):
+    """
+    Returns:
+        List of (name, definition) of the indexes that do not back a constraint
+    """
+    cursor.execute(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = %s::regclass "
+        "AND NOT EXISTS (SELECT FROM pg_constraint WHERE conindid = i.indexrelid AND conrelid = i.indrelid) "
+        "ORDER BY c.relname",
+        [table]
+    )
+    return cursor.fetchall()
+
+
+def triggers(cursor, table: str):
+    """
+    Returns:
+        List of (name, definition) of the user defined triggers, other than the partition sync trigger
+    """
+    cursor.execute(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger "
+        "WHERE tgrelid = %s::regclass AND NOT tgisinternal AND tgname <> %s ORDER BY tgname",
+        [table, suffixed(table, "_partition_sync")]
+    )
+    return cursor.fetchall()
+
+
+def column_list(names):
+    return ", ".join(quote(name) for name in names)
+
+
+def create_partitioned_table(cursor, spec: PartitionSpec, partitions: int, partitioned_tables):
+    """
+    Creates an empty copy of spec.table hash partitioned by owner, named with NEW_SUFFIX, with the same
+    columns, constraints, indexes and triggers, the constraints and indexes under temporary names.
+    Unique constraints get the owner column added, Postgres requires it, and foreign keys to other
+    tables being partitioned reference their copies.
+
+    Args:
+        partitioned_tables: Names of all the tables being partitioned
+    Returns:
+        False if the copy already exists
+    """
+    new = spec.table + NEW_SUFFIX
+    if table_exists(cursor, new):
+        return False
+
+    cursor.execute(
+        f"CREATE TABLE {quote(new)} (LIKE {quote(spec.table)} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) "
+        f"PARTITION BY HASH ({quote(spec.key)})"
+    )
+    cursor.execute(f"ALTER TABLE {quote(new)} ALTER {quote(spec.key)} SET NOT NULL")
+    for remainder in range(partitions):
+        cursor.execute(
+            f"CREATE TABLE {quote(suffixed(spec.table, f'_p{remainder}'))} PARTITION OF {quote(new)} "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        )
+
+    # Identity columns are not copied, give them a sequence of their own, advanced past the copied rows on swap
+    for name, sequenced in columns(cursor, spec.table):
+        if sequenced:
+            sequence = suffixed(f"{new}_{name}", "_seq")
+            cursor.execute(f"CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(new)}.{quote(name)}")
+            cursor.execute(f"ALTER TABLE {quote(new)} ALTER {quote(name)} SET DEFAULT nextval('{sequence}')")
+
+    for name, kind, definition, keys, referenced, referenced_keys in constraints(cursor, spec.table):
+        if kind in ("p", "u"):
+            keys = keys if spec.key in keys else [*keys, spec.key]
+            definition = f"{'PRIMARY KEY' if kind == 'p' else 'UNIQUE'} ({column_list(keys)})"
+        elif kind == "f" and referenced in partitioned_tables:
+            # Partitioned tables are only unique on (id, owner), the owner must match the referenced row's
+            options = definition.split(")", 2)[-1]
+            definition = (
+                f"FOREIGN KEY ({column_list([*keys, spec.key])}) "
+                f"REFERENCES {quote(referenced + NEW_SUFFIX)} ({column_list([*referenced_keys, spec.key])}){options}"
+            )
+        elif kind == "n":
+            continue
+        cursor.execute(f"ALTER TABLE {quote(new)} ADD CONSTRAINT {quote(suffixed(name, NEW_SUFFIX))} {definition}")
+
+    for name, definition in indexes(cursor, spec.table):
+        definition = re.sub(
+            r"^CREATE (UNIQUE )?INDEX \S+ ON (ONLY )?\S+ ",
+            lambda match: f"CREATE {match.group(1) or ''}INDEX {quote(suffixed(name, NEW_SUFFIX))} ON {quote(new)} ",
+            definition,
+        )
+        cursor.execute(definition)
+
+    # Like the one maintaining photo_gis_photo.location_geometry. Needs Postgres 13+ for BEFORE triggers
+    for name, definition in triggers(cursor, spec.table):
+        cursor.execute(re.sub(r" ON \S+ ", f" ON {quote(new)} ", definition, count=1))
+
+    return True
+
+
+def install_sync_trigger(cursor, spec: PartitionSpec):
+    """
+    Makes every later write to spec.table also apply to its partitioned copy, so that the copy stays
+    current while existing rows are copied in batches. An update is applied as a delete and an insert.
+    """
+    new = spec.table + NEW_SUFFIX
+    key = primary_key(cursor, spec.table)
+    names = [name for name, _ in columns(cursor, spec.table)]
+    values = [spec.owner_sql.format(row="NEW") if name == spec.key else f"NEW.{quote(name)}" for name in names]
+    function = suffixed(spec.table, "_partition_sync")
+
+    cursor.execute(f"""
+        CREATE OR REPLACE FUNCTION {quote(function)}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM {quote(new)} WHERE {quote(key)} = OLD.{quote(key)};
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO {quote(new)} ({column_list(names)}) VALUES ({", ".join(values)});
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    cursor.execute(f"DROP TRIGGER IF EXISTS {quote(function)} ON {quote(spec.table)}")
+    cursor.execute(
+        f"CREATE TRIGGER {quote(function)} AFTER INSERT OR UPDATE OR DELETE ON {quote(spec.table)} "
+        f"FOR EACH ROW EXECUTE FUNCTION {quote(function)}()"
+    )
+
+
+def copy_batch(cursor, spec: PartitionSpec, after, batch_size: int):
+    """
+    Copies the batch_size rows of spec.table following primary key after into its partitioned copy.
+    The rows are share locked until the transaction ends, so one deleted meanwhile is either not copied
+    or deleted again by the sync trigger.
+
+    Returns:
+        (number of rows read, primary key of the last one or None)
+    """
+    new = spec.table + NEW_SUFFIX
+    key = quote(primary_key(cursor, spec.table))
+    names = [name for name, _ in columns(cursor, spec.table)]
+    values = [spec.owner_sql.format(row="s") if name == spec.key else f"s.{quote(name)}" for name in names]
+
+    where, params = ("WHERE s.{key} > %s", [after]) if after is not None else ("", [])
+    cursor.execute(
+        f"WITH batch AS ("
+        f"    SELECT * FROM {quote(spec.table)} AS s {where.format(key=key)} ORDER BY s.{key} LIMIT %s FOR SHARE"
+        f"), copied AS ("
+        f"    INSERT INTO {quote(new)} ({column_list(names)}) SELECT {', '.join(values)} FROM batch AS s "
+        f"    ON CONFLICT DO NOTHING"
+        f") "
+        f"SELECT count(*), (SELECT {key} FROM batch ORDER BY {key} DESC LIMIT 1) FROM batch",
+        [*params, batch_size]
+    )
+    return cursor.fetchone()
+
+
+def swap(cursor, specs):
+    """
+    Puts the partitioned copies in place of the tables, which are kept with OLD_SUFFIX and without
+    their foreign keys. Constraints and indexes swap names too, so later migrations find them under the
+    names Django gave them. Takes an exclusive lock on the tables, only for catalog changes.
+    """
+    cursor.execute(f"LOCK TABLE {', '.join(quote(spec.table) for spec in specs)} IN ACCESS EXCLUSIVE MODE")
+
+    for spec in specs:
+        function = suffixed(spec.table, "_partition_sync")
+        cursor.execute(f"DROP TRIGGER {quote(function)} ON {quote(spec.table)}")
+        cursor.execute(f"DROP FUNCTION {quote(function)}()")
+
+    renames = []
+    for spec in specs:
+        names = (
+            [(name, True) for name, kind, *_ in constraints(cursor, spec.table) if kind != "n"]
+            + [(name, False) for name, _ in indexes(cursor, spec.table)]
+        )
+        renames.append((spec, names))
+
+    for spec, names in renames:
+        old = spec.table + OLD_SUFFIX
+        cursor.execute(f"ALTER TABLE {quote(spec.table)} RENAME TO {quote(old)}")
+        for name, is_constraint in names:
+            rename_object(cursor, old, name, suffixed(name, OLD_SUFFIX), is_constraint)
+        # Django only cascades deletes of users and tags to the new tables, rows left referencing them
+        # in the old ones would fail the deferred foreign keys on commit
+        for name, kind, *_ in constraints(cursor, old):
+            if kind == "f":
+                cursor.execute(f"ALTER TABLE {quote(old)} DROP CONSTRAINT {quote(name)}")
+
+    for spec, names in renames:
+        cursor.execute(f"ALTER TABLE {quote(spec.table + NEW_SUFFIX)} RENAME TO {quote(spec.table)}")
+        for name, is_constraint in names:
+            rename_object(cursor, spec.table, suffixed(name, NEW_SUFFIX), name, is_constraint)
+
+        for name, sequenced in columns(cursor, spec.table):
+            if sequenced:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, %s), "
+                    f"coalesce((SELECT max({quote(name)}) FROM {quote(spec.table)}), 0) + 1, false)",
+                    [spec.table, name]
+                )
+
+
+def rename_object(cursor, table, name, new_name, is_constraint):
+    if is_constraint:
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME CONSTRAINT {quote(name)} TO {quote(new_name)}")
+    else:
+        cursor.execute(f"ALTER INDEX {quote(name)} RENAME TO {quote(new_name)}")
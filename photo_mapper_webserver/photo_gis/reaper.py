@@ -0,0 +1,83 @@
+import os
+import time
+from dataclasses import dataclass
+
+from photo_gis.models import Photo
+
+IMAGE_ROOT = "images"
+
+
+@dataclass
+class ReapResult:
+    scanned: int = 0
+    deleted: int = 0
+    bytes_reclaimed: int = 0
+
+
+def iter_image_files(storage):
+    """
+    Lazily walks the image directory of a file system storage.
+
+    Yields:
+        (name, size, mtime) for every file, where name is relative to the storage root as stored in Photo.image
+    """
+    root = storage.path(IMAGE_ROOT)
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            name = os.path.relpath(path, storage.path("")).replace("\\", "/")
+            yield name, stat.st_size, stat.st_mtime
+
+
+def reap_orphaned_images(grace_period: float, batch_size: int = 500, dry_run: bool = False):
+    """
+    Deletes image files that no Photo row references.
+
+    Files are checked against the database in batches so memory stays bounded however large the media tree is.
+    Files younger than the grace period are skipped, which protects uploads whose row is not committed yet.
+
+    Args:
+        grace_period: Minimum age in seconds of a file before it can be deleted
+        batch_size: Number of files looked up per query
+        dry_run: Count what would be deleted without deleting anything
+    Returns:
+        ReapResult with the number of files scanned and deleted and the bytes reclaimed
+    """
+    storage = Photo._meta.get_field("image").storage
+    cutoff = time.time() - grace_period
+    result = ReapResult()
+
+    batch = []
+    for file_info in iter_image_files(storage):
+        batch.append(file_info)
+        if len(batch) >= batch_size:
+            _reap_batch(storage, batch, cutoff, dry_run, result)
+            batch = []
+    if batch:
+        _reap_batch(storage, batch, cutoff, dry_run, result)
+
+    return result
+
+
+def _reap_batch(storage, batch, cutoff, dry_run, result):
+    result.scanned += len(batch)
+
+    candidates = {name: size for name, size, mtime in batch if mtime < cutoff}
+    if not candidates:
+        return
+
+    referenced = set(Photo.objects.filter(image__in=candidates).values_list("image", flat=True))
+    for name, size in candidates.items():
+        if name in referenced:
+            continue
+        if not dry_run:
+            try:
+                os.remove(storage.path(name))
+            except FileNotFoundError:
+                continue
+        result.deleted += 1
+        result.bytes_reclaimed += size
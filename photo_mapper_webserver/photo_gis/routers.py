@@ -0,0 +1,73 @@
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+ROUTED_APP_LABELS = {"photo_gis"}
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+@contextmanager
+def routing_request(request):
+    """
+    Makes request the one database routing decisions are based on for the duration of the block.
+    """
+    token = _current_request.set(request)
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+def sticky_key(user_id):
+    return f"replica-sticky:{user_id}"
+
+
+def mark_sticky(user_id):
+    """
+    Sends the user's reads to the primary for settings.REPLICA_STICKY_SECONDS,
+    long enough for the replicas to catch up with the user's own writes.
+    """
+    cache.set(sticky_key(user_id), True, timeout=settings.REPLICA_STICKY_SECONDS)
+
+
+def is_sticky(request):
+    # Looked up once per request, not once per query
+    if not hasattr(request, "_replica_sticky"):
+        user = getattr(request, "user", None)
+        if user is None or not user.is_authenticated:
+            request._replica_sticky = False
+        else:
+            request._replica_sticky = bool(cache.get(sticky_key(user.pk)))
+    return request._replica_sticky
+
+
+class PrimaryReplicaRouter:
+    """
+    Sends photo_gis reads made while handling a safe (GET/HEAD/OPTIONS) request to a random replica.
+    Everything else, including reads of a user who wrote recently, goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in ROUTED_APP_LABELS or not settings.DATABASE_REPLICAS:
+            return None
+
+        request = _current_request.get()
+        if request is None or request.method not in SAFE_METHODS or is_sticky(request):
+            return "default"
+
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
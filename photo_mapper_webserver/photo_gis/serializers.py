@@ -1,9 +1,19 @@
-from rest_framework.serializers import HyperlinkedIdentityField, ModelSerializer, HyperlinkedModelSerializer, ReadOnlyField, ListField, CharField,  StringRelatedField
+from rest_framework.serializers import HyperlinkedIdentityField, ModelSerializer, HyperlinkedModelSerializer, ReadOnlyField, ListField, CharField,  StringRelatedField, Serializer, ChoiceField, UUIDField, DictField, ValidationError
+from django.conf import settings
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
 from utils.exif_reader import read_photo_metadata
 from utils.resize_photo import resize_image
+from utils.profiling import phase
+from utils.geocoder import reverse_geocode
 
 from photo_gis.models import Photo, Tag
+from photo_gis.bulk import resolve_tags
+from photo_gis.similarity import NearDuplicateException, find_similar
+
+
+def normalize_tags(value):
+    return list({tag.lower().strip() for tag in value if tag.strip()})
+
 
 class TagSerializer(ModelSerializer):
     class Meta:
@@ -11,6 +21,31 @@ class TagSerializer(ModelSerializer):
         fields = ["name"]
 
 
+class PrefixedIdentityField(HyperlinkedIdentityField):
+    """
+    HyperlinkedIdentityField that calls reverse() once per serializer and substitutes each object's
+    lookup value into the result, instead of reversing the URL for every object.
+    """
+    PLACEHOLDER = "__lookup_value__"
+
+    def __init__(self, *args, query_string="", **kwargs):
+        self.query_string = query_string
+        super().__init__(*args, **kwargs)
+
+    def get_url(self, obj, view_name, request, format):
+        if obj.pk is None:
+            return None
+
+        template = getattr(self, "_url_template", None)
+        if template is None:
+            template = self.reverse(
+                view_name, kwargs={self.lookup_url_kwarg: self.PLACEHOLDER}, request=request, format=format
+            ) + self.query_string
+            self._url_template = template
+
+        return template.replace(self.PLACEHOLDER, str(getattr(obj, self.lookup_field)))
+
+
 class PhotoSerializer(GeoFeatureModelSerializer):
     owner = ReadOnlyField(source="owner.username")
     tags = ListField(
@@ -21,33 +56,66 @@ class PhotoSerializer(GeoFeatureModelSerializer):
 
     tag_names = StringRelatedField(many=True, source="tags", read_only=True)
 
-    url = HyperlinkedIdentityField(
+    url = PrefixedIdentityField(
         view_name="photo-detail",
         lookup_field="id"
     )
 
+    # Fields that can be requested with ?fields=, the geometry is always included
+    SPARSE_FIELDS = ["url", "owner", "image", "timestamp", "place", "country_code", "tag_names"]
+
     class Meta:
         model = Photo
-        fields = ["url", "owner", "image", "location", "timestamp", "tags", "tag_names"]
-        read_only_fields = ["owner", "location", "timestamp"]
+        fields = ["url", "owner", "image", "location", "timestamp", "place", "country_code", "tags", "tag_names"]
+        read_only_fields = ["owner", "location", "timestamp", "place", "country_code"]
         geo_field = "location"
 
+    def __init__(self, *args, fields=None, **kwargs):
+        """
+        Args:
+            fields: Optional names of the fields to output. The geometry is always included.
+        """
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for name in set(self.fields) - set(fields) - {self.Meta.geo_field}:
+                self.fields.pop(name)
+
     def create(self, validated_data):
         owner = self.context.get("owner")
 
         image_file = validated_data.pop("image")
-        timestamp, loc = read_photo_metadata(image_file)
+        timestamp, loc, camera = read_photo_metadata(image_file)
         resized_image = resize_image(image_file)
 
         validated_data["timestamp"] = timestamp
         validated_data["location"] = loc
-        validated_data["owner"] = owner
-        validated_data["image"] = resized_image
+        validated_data["owner_id"] = owner.id
+        validated_data["perceptual_hash"] = resized_image.perceptual_hash
+        validated_data["exif"] = camera
+
+        if settings.PHOTO_REJECT_NEAR_DUPLICATES:
+            with phase("similarity"):
+                matches = find_similar(owner.id, resized_image.perceptual_hash, settings.PHOTO_NEAR_DUPLICATE_DISTANCE)
+            if matches:
+                raise NearDuplicateException(min(matches, key=matches.get))
+
+        with phase("geocode"):
+            place = reverse_geocode(loc)
+        if place is not None:
+            validated_data["place"] = place.name
+            validated_data["country_code"] = place.country_code
 
-        tags = [Tag.objects.get_or_create(name=tag)[0] for tag in validated_data.pop("tags")]
+        photo = Photo(**{key: value for key, value in validated_data.items() if key != "tags"})
 
-        photo = Photo.objects.create(**validated_data)
-        photo.tags.set(tags)
+        # Write the file separately from the insert so each shows up as its own phase
+        with phase("storage"):
+            photo.image.save(resized_image.name, resized_image, save=False)
+
+        with phase("db"):
+            tags = resolve_tags(validated_data["tags"])
+            photo.save(force_insert=True)
+            photo.tags.set(tags, through_defaults={"owner_id": photo.owner_id})
 
         return photo
     
@@ -57,10 +125,49 @@ class PhotoSerializer(GeoFeatureModelSerializer):
         instance = super().update(instance, validated_data)
 
         if tag_data is not None:
-            tags = [Tag.objects.get_or_create(name=name)[0] for name in tag_data]
-            instance.tags.set(tags)
+            tags = resolve_tags(tag_data)
+            instance.tags.set(tags, through_defaults={"owner_id": instance.owner_id})
 
         return instance
     
     def validate_tags(self, value):
-        return list({tag.lower().strip() for tag in value if tag.strip()})
\ No newline at end of file
+        return normalize_tags(value)
+
+
+class CompactPhotoSerializer(GeoFeatureModelSerializer):
+    """
+    Minimal map marker representation: the id, the point and a square thumbnail URL.
+    """
+    thumbnail = PrefixedIdentityField(
+        view_name="photo-image",
+        lookup_field="id",
+        query_string="?w=128&h=128&fit=cover",
+    )
+
+    class Meta:
+        model = Photo
+        fields = ["id", "location", "thumbnail"]
+        geo_field = "location"
+
+
+class BulkPhotoSerializer(Serializer):
+    """
+    Validates a bulk operation over the photos selected either by 'ids' or by 'filter'.
+    'filter' accepts the same keys as the photo list query parameters.
+    """
+    TAG_ACTIONS = ["add_tags", "remove_tags", "set_tags"]
+
+    action = ChoiceField(choices=TAG_ACTIONS + ["delete"])
+    ids = ListField(child=UUIDField(), required=False, allow_empty=False, max_length=10000)
+    filter = DictField(required=False)
+    tags = ListField(child=CharField(max_length=50), required=False)
+
+    def validate_tags(self, value):
+        return normalize_tags(value)
+
+    def validate(self, data):
+        if ("ids" in data) == ("filter" in data):
+            raise ValidationError("Exactly one of 'ids' or 'filter' is required.")
+        if data["action"] in self.TAG_ACTIONS and "tags" not in data:
+            raise ValidationError(f"'tags' is required for '{data['action']}'.")
+        return data
\ No newline at end of file
@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+
+from photo_gis.models import Photo
+from utils.bktree import BKTree
+
+
+class NearDuplicateException(Exception):
+    """
+    Raised when an upload is a near duplicate of a photo the owner already has.
+    """
+
+    def __init__(self, photo_id):
+        super().__init__(f"Near duplicate of photo {photo_id}")
+        self.photo_id = photo_id
+
+
+class SimilarityIndex:
+    """
+    BK-tree of one owner's perceptual hashes.
+
+    It is loaded once and then kept current from Photo.updated_at: every search first adds the photos
+    saved since the last one, an index range scan that is usually empty. Deleted photos stay in the tree,
+    so callers must check that the photos found still exist.
+    """
+
+    def __init__(self, owner_id):
+        self.owner_id = owner_id
+        self.tree = BKTree()
+        self._ids = set()
+        self._loaded_through = None # Latest updated_at seen
+        self._lock = threading.Lock()
+
+    def search(self, perceptual_hash: int, max_distance: int):
+        """
+        Returns:
+            List of (distance, photo id), closest first
+        """
+        with self._lock:
+            self._refresh()
+            return self.tree.search(perceptual_hash, max_distance)
+
+    def _refresh(self):
+        # From the primary, a photo a lagging replica hides would otherwise never be added
+        photos = Photo.objects.using("default").filter(owner_id=self.owner_id, perceptual_hash__isnull=False)
+        if self._loaded_through is not None:
+            # Photos committed late can carry an updated_at older than ones already seen, see changes_since
+            window = timedelta(seconds=settings.PHOTO_CHANGES_SAFETY_WINDOW_SECONDS)
+            photos = photos.filter(updated_at__gte=self._loaded_through - window)
+
+        for id, perceptual_hash, updated_at in photos.values_list("id", "perceptual_hash", "updated_at"):
+            if id not in self._ids:
+                self._ids.add(id)
+                self.tree.add(perceptual_hash, id)
+            if self._loaded_through is None or updated_at > self._loaded_through:
+                self._loaded_through = updated_at
+
+
+_indexes = OrderedDict() # owner id -> SimilarityIndex, least recently used first
+_indexes_lock = threading.Lock()
+
+
+def get_similarity_index(owner_id):
+    """
+    Returns the process wide index of the owner's photos, keeping those of the
+    settings.SIMILARITY_INDEX_MAX_OWNERS most recently searched owners in memory.
+    """
+    with _indexes_lock:
+        index = _indexes.pop(owner_id, None) or SimilarityIndex(owner_id)
+        _indexes[owner_id] = index
+        while len(_indexes) > settings.SIMILARITY_INDEX_MAX_OWNERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def find_similar(owner_id, perceptual_hash: int, max_distance: int):
+    """
+    Finds the owner's photos whose perceptual hash is within max_distance bits of perceptual_hash.
+
+    Returns:
+        dict of photo id -> distance for the photos that still exist
+    """
+    matches = get_similarity_index(owner_id).search(perceptual_hash, max_distance)
+    if not matches:
+        return {}
+
+    distances = {id: distance for distance, id in matches}
+    existing = Photo.objects.filter(owner_id=owner_id, id__in=list(distances)).values_list("id", flat=True)
+    return {id: distances[id] for id in existing}
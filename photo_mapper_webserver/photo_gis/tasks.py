@@ -0,0 +1,20 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from photo_gis.reaper import reap_orphaned_images
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def reap_orphaned_images_task():
+    result = reap_orphaned_images(
+        grace_period=settings.PHOTO_REAPER_GRACE_PERIOD,
+        batch_size=settings.PHOTO_REAPER_BATCH_SIZE,
+    )
+    logger.info(
+        "Reaped %d orphaned image files (%d bytes) out of %d scanned",
+        result.deleted, result.bytes_reclaimed, result.scanned
+    )
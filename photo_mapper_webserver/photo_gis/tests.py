@@ -1,20 +1,45 @@
+import gzip
+import io
+import json
+import os
+import re
 import shutil
+import time
 import uuid
+import zipfile
 import tempfile
+from importlib import import_module
 from datetime import datetime, timedelta, timezone
-from unittest.mock import MagicMock
-from django.test import TestCase
+from unittest.mock import MagicMock, patch
+from django.test import TestCase, SimpleTestCase, TransactionTestCase, AsyncRequestFactory, RequestFactory, override_settings
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import resolve
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.contrib.gis.geos import Point
+from django.db import connection
+from asgiref.sync import async_to_sync
+from kombu import Connection
 from django.db.utils import IntegrityError, DataError
 from rest_framework.test import APIRequestFactory, force_authenticate
 from rest_framework import status
 
 from PIL import Image, ExifTags
 
-from .models import Tag, Photo, photo_directory_path
-from .views import PhotoList
+from .models import Tag, Photo, PhotoTag, photo_directory_path
+from .filters import filter_photos
+from .bulk import add_tags, set_tags
+from .reaper import reap_orphaned_images
+from .archive import archive_entries
+from photo_mapper_webserver.middleware import CompressionMiddleware, ProfilingMiddleware, ReplicaRoutingMiddleware
+from .routers import PrimaryReplicaRouter, routing_request
+from .checks import check_shared_cache
+from utils.profiling import phase
+from utils.geocoder import get_reverse_geocoder
+from utils.admission import IngestAdmission
+from .views import PhotoList, PhotoBulk, PhotoChanges, PhotoArchive, PhotoFacets, PhotoImage, PhotoSimilar, TagList, get_variant_cache
 
 # Create your tests here.
 
@@ -161,6 +186,97 @@ class PhotoTests(TestCase):
         self.assertEqual(Photo.objects.all().count(), 3)
         tmpfile.close()
     
+    def test_photo_post_is_refused_when_ingest_is_overloaded_or_image_too_large(self):
+        image = Image.new('RGB', (100, 100))
+        exif = self._write_exif_data(image.getexif(), timestamp=self.timestamp, point=Point(1,1))
+        factory = APIRequestFactory()
+
+        def post():
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", exif=exif)
+            request = factory.post(
+                '/collections/photos/',
+                {"image": SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")},
+                format='multipart'
+            )
+            force_authenticate(request, self.owner)
+            return PhotoList.as_view()(request)
+
+        # Every decode slot taken and no room to queue
+        admission = IngestAdmission(budget_bytes=1, max_queued=0, queue_timeout=0)
+        with patch("photo_gis.views.get_ingest_admission", return_value=admission), admission.admit(1):
+            response = post()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+        with override_settings(INGEST_MAX_IMAGE_PIXELS=100 * 100 - 1):
+            self.assertEqual(post().status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertEqual(Photo.objects.count(), 2)
+
+    def test_photo_post_rejects_near_duplicates_when_enabled(self):
+        factory = APIRequestFactory()
+        image = Image.new('RGB', (100, 100))
+        image.paste((255, 255, 255), (0, 0, 50, 100))
+
+        def post(minutes):
+            exif = self._write_exif_data(image.getexif(), timestamp=self.timestamp + timedelta(days=1, minutes=minutes), point=Point(1,1))
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", exif=exif)
+            request = factory.post(
+                '/collections/photos/',
+                {"image": SimpleUploadedFile("photo.jpg", buffer.getvalue(), content_type="image/jpeg")},
+                format='multipart'
+            )
+            force_authenticate(request, self.owner)
+            return PhotoList.as_view()(request)
+
+        with override_settings(PHOTO_REJECT_NEAR_DUPLICATES=True):
+            self.assertEqual(post(0).status_code, status.HTTP_201_CREATED)
+            # Same picture taken a minute later
+            response = post(1)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("near duplicate", str(response.data["detail"]))
+
+        self.assertEqual(post(2).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Photo.objects.filter(perceptual_hash__isnull=False).count(), 2)
+
+    def test_photo_post_labels_place_and_filters_by_place(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        gazetteer = os.path.join(directory, "cities.txt")
+        with open(gazetteer, "w", encoding="utf-8") as f:
+            f.write("1\tTestville\tTestville\t\t1.01\t1.01\tP\tPPL\tGH\t\t\t\t\t\t1000\t\t10\tAfrica/Accra\t2020-01-01\n")
+
+        image = Image.new('RGB', (100, 100))
+        exif = self._write_exif_data(image.getexif(), timestamp=self.timestamp, point=Point(1, 1))
+        tmpfile = tempfile.NamedTemporaryFile(suffix='.jpg')
+        image.save(tmpfile, exif=exif)
+        tmpfile.seek(0)
+
+        factory = APIRequestFactory()
+        view = PhotoList.as_view()
+        request = factory.post('/collections/photos/', {"image": tmpfile}, format='multipart')
+        force_authenticate(request, self.owner)
+
+        get_reverse_geocoder.cache_clear()
+        self.addCleanup(get_reverse_geocoder.cache_clear)
+        with override_settings(GAZETTEER_PATH=gazetteer):
+            response = view(request)
+        tmpfile.close()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        photo = Photo.objects.get(owner=self.owner, location=Point(1, 1, srid=4326))
+        self.assertEqual((photo.place, photo.country_code), ("Testville", "GH"))
+
+        request = factory.get('/collections/photos/', {"place": "Testville", "country": "gh"})
+        force_authenticate(request, self.owner)
+        response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["features"]), 1)
+        self.assertEqual(response.data["features"][0]["properties"]["place"], "Testville")
+
     def test_photo_post_returns_error_for_identical_time_and_place(self):
         image = Image.new('RGB', (100, 100))
         exif = self._write_exif_data(image.getexif(), timestamp=self.timestamp, point=Point(0, 0))
@@ -230,6 +346,506 @@ class PhotoTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         tmpfile.close()
 
+    def test_photo_list_filters_by_tags(self):
+        self.photos[0].tags.add(*self.tags)
+        self.photos[1].tags.add(self.tags[0])
+        factory = APIRequestFactory()
+
+        def listed_ids(params):
+            request = factory.get('/collections/photos/', params)
+            force_authenticate(request, self.owner)
+            response = PhotoList.as_view()(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return {feature["properties"]["url"].rstrip("/").split("/")[-1] for feature in response.data["features"]}
+
+        self.assertEqual(listed_ids({"tags": "Urban,nature"}), {str(self.photos[0].id)})
+        self.assertEqual(listed_ids({"tags": "urban,nature", "match": "any"}), {str(photo.id) for photo in self.photos})
+        self.assertEqual(listed_ids({"tags": "urban,unknown"}), set())
+
+        request = factory.get('/collections/photos/', {"tags": "urban", "match": "some"})
+        force_authenticate(request, self.owner)
+        self.assertEqual(PhotoList.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_photo_list_filters_by_exif_with_the_gin_index(self):
+        Photo.objects.filter(id=self.photos[0].id).update(exif={"Make": "FUJIFILM", "Model": "X-T5", "FocalLength": 56.0})
+        Photo.objects.filter(id=self.photos[1].id).update(exif={"Make": "FUJIFILM", "Model": "X-T5", "FocalLength": 23.0})
+        factory = APIRequestFactory()
+
+        def listed_ids(params):
+            request = factory.get('/collections/photos/', params)
+            force_authenticate(request, self.owner)
+            response = PhotoList.as_view()(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return {feature["properties"]["url"].rstrip("/").split("/")[-1] for feature in response.data["features"]}
+
+        self.assertEqual(listed_ids({"exif.Model": "X-T5"}), {str(photo.id) for photo in self.photos})
+        self.assertEqual(listed_ids({"exif.Model": "X-T5", "exif.FocalLength__gte": "50"}), {str(self.photos[0].id)})
+        self.assertEqual(listed_ids({"exif.FocalLength": "23"}), {str(self.photos[1].id)})
+        self.assertEqual(listed_ids({"exif.Model": "X-T4"}), set())
+
+        for params in ({"exif.Model__gte": "X"}, {"exif.Shutter": "1"}, {"exif.FocalLength__gte": "long"}):
+            request = factory.get('/collections/photos/', params)
+            force_authenticate(request, self.owner)
+            self.assertEqual(PhotoList.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+        with connection.cursor() as cursor:
+            # The table is tiny, so rule out sequential scans to see which index the planner prefers
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = filter_photos(Photo.objects.all(), {"exif.Make": "FUJIFILM", "exif.Model": "X-T5"}).explain()
+        self.assertIn("exif_gin", plan)
+
+    def test_photo_list_sparse_fields_and_compact_view(self):
+        self.photos[0].tags.add(*self.tags)
+        factory = APIRequestFactory()
+
+        def get(params):
+            request = factory.get('/collections/photos/', params)
+            force_authenticate(request, self.owner)
+            return PhotoList.as_view()(request)
+
+        # Count, then one query rendering the photos with their owner and tags, however many photos there are
+        with self.assertNumQueries(2):
+            response = get({})
+        feature = next(f for f in response.data["features"] if f["properties"]["tag_names"])
+        self.assertEqual(feature["properties"]["tag_names"], ["nature", "urban"])
+        self.assertEqual(feature["properties"]["owner"], "fakeuser")
+
+        with self.assertNumQueries(2):
+            response = get({"fields": "timestamp,url"})
+        properties = response.data["features"][0]["properties"]
+        self.assertEqual(set(properties), {"timestamp", "url"})
+        self.assertRegex(properties["url"], r"/collections/photos/[0-9a-f-]{36}/$")
+
+        response = get({"view": "compact"})
+        feature = response.data["features"][0]
+        self.assertEqual(set(feature["properties"]), {"thumbnail"})
+        self.assertIn(str(feature["id"]), {str(photo.id) for photo in self.photos})
+        self.assertTrue(feature["properties"]["thumbnail"].endswith(f"/collections/photos/{feature['id']}/image/?w=128&h=128&fit=cover"))
+
+        self.assertEqual(get({"fields": "timestamp,secret"}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(get({"view": "compact", "fields": "url"}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_photo_list_sql_rendering_matches_the_serializer(self):
+        self.photos[0].tags.add(*self.tags)
+        Tag.objects.create(name='quote" and \\ \u2028')
+        coordinates = [
+            (0.1 + 0.2, 1e-05), (123.456789012345678, -45.0), (-180, 90), (1.2345678901234567, 66.66666666666666),
+            (0.00012, 10),
+        ]
+        for i, (lon, lat) in enumerate(coordinates):
+            photo = Photo.objects.create(
+                owner = self.owner,
+                image = f"images/{self.owner.id}/ä b%{i}.jpg",
+                location = Point(lon, lat, srid=4326),
+                timestamp = self.timestamp + timedelta(days=1, microseconds=120 * i),
+                place = "Ĉity\t",
+                country_code = "GH",
+            )
+            photo.tags.add(*Tag.objects.all()[:i])
+
+        factory = APIRequestFactory()
+
+        def get(params, sql):
+            request = factory.get('/collections/photos/', params)
+            force_authenticate(request, self.owner)
+            with override_settings(PHOTO_LIST_SQL_GEOJSON=sql):
+                response = PhotoList.as_view()(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.render().content if hasattr(response, "render") else response.content
+
+        for params in (
+            {}, {"page_size": 4, "page": 2}, {"page_size": 2, "page": 2}, {"tags": "nature"}, {"bbox": "170,80,180,90"},
+            {"tags": "unknown"},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(get(params, sql=True), get(params, sql=False))
+
+    def test_photo_list_of_a_user_without_photos_is_empty(self):
+        request = APIRequestFactory().get('/collections/photos/')
+        force_authenticate(request, User.objects.create(username="newuser", password="fakepwd"))
+
+        with override_settings(PHOTO_LIST_SQL_GEOJSON=True):
+            response = PhotoList.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data, {"type": "FeatureCollection", "count": 0, "next": None, "previous": None, "features": []}
+        )
+
+    def test_photo_similar_lists_photos_by_hash_distance(self):
+        base = 0x0F0F_0F0F_0F0F_0F0F
+        Photo.objects.filter(id=self.photos[0].id).update(perceptual_hash=base)
+        Photo.objects.filter(id=self.photos[1].id).update(perceptual_hash=base ^ 0b111)
+        far = Photo.objects.create(
+            owner = self.owner,
+            image = "images/far.jpg",
+            location = self.location,
+            timestamp = self.timestamp + timedelta(days=1),
+            perceptual_hash = ~base,
+        )
+        factory = APIRequestFactory()
+
+        def similar(photo, params=None):
+            request = factory.get(f'/collections/photos/{photo.id}/similar/', params or {})
+            force_authenticate(request, self.owner)
+            return PhotoSimilar.as_view()(request, id=str(photo.id))
+
+        response = similar(self.photos[0])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        features = response.data["features"]
+        self.assertEqual(len(features), 1)
+        self.assertTrue(features[0]["properties"]["url"].endswith(f"/{self.photos[1].id}/"))
+        self.assertEqual(features[0]["properties"]["distance"], 3)
+
+        self.assertEqual(similar(self.photos[0], {"max_distance": 2}).data["features"], [])
+        self.assertEqual(len(similar(far, {"max_distance": 32}).data["features"]), 0)
+
+        # Deleted photos drop out of the results
+        self._bulk({"action": "delete", "ids": [str(self.photos[1].id)]})
+        self.assertEqual(similar(self.photos[0]).data["features"], [])
+
+        self.assertEqual(similar(self.photos[0], {"max_distance": 65}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bbox_and_time_filters_use_the_spatio_temporal_index(self):
+        photos = filter_photos(Photo.objects.filter(owner_id=self.owner.id), {
+            "bbox": "-1,-1,1,1",
+            "taken_after": "2205-01-01T00:00:00Z",
+            "taken_before": "2205-01-02T00:00:00Z",
+        })
+        with connection.cursor() as cursor:
+            # The table is tiny, so rule out sequential scans to see which index the planner prefers
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        plan = photos.explain()
+
+        self.assertIn("owner_geometry_timestamp_gist", plan)
+        index_condition = next(line for line in plan.splitlines() if "Index Cond" in line)
+        for column in ("owner_id", "location_geometry", "timestamp"):
+            self.assertIn(column, index_condition)
+        self.assertEqual(photos.count(), 2)
+
+    def test_location_geometry_follows_location(self):
+        photo = self.photos[0]
+        self.assertEqual(Photo.objects.get(id=photo.id).location_geometry, self.location)
+
+        photo.location = Point(10.5, 20.25, srid=4326)
+        photo.save()
+        photo.refresh_from_db()
+
+        self.assertEqual(photo.location_geometry.coords, (10.5, 20.25))
+        self.assertEqual(photo.location_geometry.srid, 4326)
+        photos = filter_photos(Photo.objects.filter(owner_id=self.owner.id), {"bbox": "10,20,11,21"})
+        self.assertEqual(list(photos), [photo])
+
+    def test_partition_photos_prunes_partitions_by_owner(self):
+        second_user = User.objects.create(username="Second User", password="123456789")
+        self.photos[0].tags.add(*self.tags)
+        call_command("partition_photos", partitions=4, batch_size=1, stdout=io.StringIO())
+
+        def partitions(queryset, table):
+            return set(re.findall(rf"\b{table}_p\d+\b", queryset.explain()))
+
+        # Each owner's rows are in one partition, and only that one is read
+        self.assertEqual(len(partitions(Photo.objects.filter(owner_id=self.owner.id), "photo_gis_photo")), 1)
+        self.assertEqual(len(partitions(PhotoTag.objects.filter(owner_id=self.owner.id), "photo_gis_photo_tags")), 1)
+        detail = Photo.objects.filter(owner_id=self.owner.id, id=self.photos[0].id)
+        self.assertEqual(len(partitions(detail, "photo_gis_photo")), 1)
+        self.assertEqual(len(partitions(Photo.objects.all(), "photo_gis_photo")), 4)
+
+        # Existing rows were copied and the ORM keeps working on the partitioned tables
+        self.assertEqual(set(self.photos[0].tags.values_list("name", flat=True)), {"urban", "nature"})
+        self.assertEqual(set(PhotoTag.objects.values_list("owner_id", flat=True)), {self.owner.id})
+        other = Photo.objects.create(
+            owner=second_user, image=self.image_files[0], location=self.location, timestamp=self.timestamp
+        )
+        other.tags.add(self.tags[0])
+        self.assertEqual(PhotoTag.objects.get(photo=other).owner_id, second_user.id)
+        self.photos[0].delete()
+        self.assertFalse(PhotoTag.objects.filter(photo_id=self.photos[0].id).exists())
+
+        out = io.StringIO()
+        call_command("partition_photos", stdout=out)
+        self.assertIn("already partitioned", out.getvalue())
+
+    def test_photo_facets_are_cached_until_the_collection_changes(self):
+        cache.clear()
+        self.photos[0].tags.add(*self.tags)
+        factory = APIRequestFactory()
+
+        def facets():
+            request = factory.get('/collections/photos/facets/', {"bbox": "-1,-1,1,1"})
+            force_authenticate(request, self.owner)
+            response = PhotoFacets.as_view()(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.data
+
+        self.assertEqual(facets(), {
+            "total": 2,
+            "untagged": 1,
+            "tags": [{"name": "nature", "count": 1}, {"name": "urban", "count": 1}],
+        })
+        with self.assertNumQueries(0):
+            facets()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self._bulk({"action": "add_tags", "ids": [str(self.photos[1].id)], "tags": ["urban"]})
+
+        self.assertEqual(facets(), {
+            "total": 2,
+            "untagged": 0,
+            "tags": [{"name": "urban", "count": 2}, {"name": "nature", "count": 1}],
+        })
+
+    def test_photo_image_renders_quantized_variant(self):
+        image = Image.new('RGB', (400, 200))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG")
+        photo = Photo.objects.create(
+            owner = self.owner,
+            image = SimpleUploadedFile(name="DSCF0005.jpg", content=buffer.getvalue(), content_type="image/jpeg"),
+            location = self.location,
+            timestamp = self.timestamp + timedelta(hours=1)
+        )
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        get_variant_cache.cache_clear()
+        self.addCleanup(get_variant_cache.cache_clear)
+
+        factory = APIRequestFactory()
+        view = PhotoImage.as_view()
+        with override_settings(PHOTO_VARIANT_CACHE_DIR=cache_dir, PHOTO_VARIANT_SIZES=[64, 128]):
+            request = factory.get(f'/collections/photos/{photo.id}/image/', {"w": 100, "fit": "cover"})
+            force_authenticate(request, self.owner)
+            response = view(request, id=str(photo.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        with Image.open(io.BytesIO(response.content)) as variant:
+            self.assertEqual(variant.size, (128, 128))
+
+    def test_photo_image_requires_a_size(self):
+        factory = APIRequestFactory()
+        view = PhotoImage.as_view()
+        request = factory.get(f'/collections/photos/{self.photos[0].id}/image/')
+        force_authenticate(request, self.owner)
+        response = view(request, id=str(self.photos[0].id))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_photo_bulk_tag_actions(self):
+        self.photos[0].tags.add(self.tags[0])
+        ids = [str(photo.id) for photo in self.photos]
+
+        response = self._bulk({"action": "add_tags", "ids": ids, "tags": ["Nature", "sunset"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(set(self.photos[1].tags.values_list("name", flat=True)), {"nature", "sunset"})
+
+        response = self._bulk({"action": "remove_tags", "ids": ids, "tags": ["nature"]})
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(set(self.photos[0].tags.values_list("name", flat=True)), {"urban", "sunset"})
+
+        response = self._bulk({"action": "set_tags", "ids": ids[:1], "tags": ["sunset"]})
+        self.assertEqual(set(self.photos[0].tags.values_list("name", flat=True)), {"sunset"})
+        self.assertEqual(set(self.photos[1].tags.values_list("name", flat=True)), {"sunset"})
+
+    def test_photo_bulk_delete_by_filter_removes_files_after_commit(self):
+        paths = [photo.image.path for photo in self.photos]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self._bulk({
+                "action": "delete",
+                "filter": {"taken_after": (self.timestamp + timedelta(seconds=30)).isoformat()}
+            })
+
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(list(Photo.objects.values_list("id", flat=True)), [self.photos[0].id])
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertFalse(os.path.exists(paths[1]))
+
+    def test_photo_bulk_filter_accepts_a_list_of_tags(self):
+        self.photos[1].tags.add(self.tags[0], self.tags[1])
+
+        response = self._bulk({"action": "delete", "filter": {"tags": ["urban", "Nature"]}})
+
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(list(Photo.objects.values_list("id", flat=True)), [self.photos[0].id])
+
+    @override_settings(PHOTO_CHANGES_SAFETY_WINDOW_SECONDS=0)
+    def test_photo_changes_feed(self):
+        factory = APIRequestFactory()
+
+        def changes(since=None, **params):
+            request = factory.get('/collections/photos/changes/', {"since": since, **params} if since else params)
+            force_authenticate(request, self.owner)
+            response = PhotoChanges.as_view()(request)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids = [feature["properties"]["url"].rstrip("/").split("/")[-1] for feature in response.data["features"]]
+            return ids, [str(id) for id in response.data["deleted"]], response.data["token"], response.data["more"]
+
+        with override_settings(PHOTO_CHANGES_PAGE_SIZE=1):
+            first, _, token, more = changes()
+            self.assertTrue(more)
+            second, _, token, more = changes(token)
+            self.assertFalse(more)
+        self.assertEqual(set(first + second), {str(photo.id) for photo in self.photos})
+
+        # Nothing changed since
+        self.assertEqual(changes(token)[:2], ([], []))
+
+        self._bulk({"action": "add_tags", "ids": [str(self.photos[0].id)], "tags": ["sunset"]})
+        self._bulk({"action": "delete", "ids": [str(self.photos[1].id)]})
+        updated, deleted, token, _ = changes(token)
+        self.assertEqual((updated, deleted), ([str(self.photos[0].id)], [str(self.photos[1].id)]))
+
+        self.assertEqual(changes(token)[:2], ([], []))
+
+        request = factory.get('/collections/photos/changes/', {"since": "forged"})
+        force_authenticate(request, self.owner)
+        self.assertEqual(PhotoChanges.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_photo_archive_streams_filtered_photos_with_manifest(self):
+        self.photos[1].tags.add(self.tags[1])
+        factory = APIRequestFactory()
+
+        async def read(response):
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        request = AsyncRequestFactory().get('/collections/photos/archive.zip', {"tags": "nature"})
+        force_authenticate(request, self.owner)
+        response = PhotoArchive.as_view()(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn("attachment", response["Content-Disposition"])
+
+        with zipfile.ZipFile(io.BytesIO(async_to_sync(read)(response))) as archive:
+            self.assertIsNone(archive.testzip())
+            manifest = json.loads(archive.read("manifest.geojson"))
+            self.assertEqual(len(manifest["features"]), 1)
+            properties = manifest["features"][0]["properties"]
+            self.assertEqual(properties["tag_names"], ["nature"])
+
+            self.assertEqual(archive.namelist(), ["manifest.geojson", properties["file"]])
+            self.assertEqual(archive.read(properties["file"]), b"imagedata")
+            self.assertEqual(archive.getinfo(properties["file"]).compress_type, zipfile.ZIP_STORED)
+
+        request = factory.get('/collections/photos/archive.zip', {"taken_after": "yesterday"})
+        force_authenticate(request, self.owner)
+        self.assertEqual(PhotoArchive.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_photo_archive_streams_under_wsgi(self):
+        entries = []
+
+        def recorded_entries(photos, request):
+            for entry in archive_entries(photos, request):
+                entries.append(entry.name)
+                yield entry
+
+        request = APIRequestFactory().get('/collections/photos/archive.zip')
+        force_authenticate(request, self.owner)
+        with patch("photo_gis.views.archive_entries", recorded_entries):
+            response = PhotoArchive.as_view()(request)
+            self.assertFalse(response.is_async)
+
+            # The WSGI handler iterates the response as is, so the first chunk goes out before the photos are read
+            chunks = iter(response.streaming_content)
+            first = next(chunks)
+            self.assertEqual(entries, ["manifest.geojson"])
+            content = first + b"".join(chunks)
+
+        self.assertEqual(len(entries), 3)
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            self.assertIsNone(archive.testzip())
+
+    def test_photo_bulk_only_touches_own_photos(self):
+        second_user = User.objects.create(username="Second User", password="123456789")
+        request_ids = [str(photo.id) for photo in self.photos]
+
+        response = self._bulk({"action": "delete", "ids": request_ids}, user=second_user)
+
+        self.assertEqual(response.data["count"], 0)
+        self.assertEqual(Photo.objects.count(), 2)
+
+    def test_photo_bulk_requires_ids_or_filter(self):
+        response = self._bulk({"action": "delete"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self._bulk({"action": "add_tags", "ids": [str(self.photos[0].id)]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self._bulk({"action": "add_tags", "ids": [], "tags": ["x"]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_photo_bulk_tag_actions_on_no_photos(self):
+        photos = Photo.objects.filter(id__in=[])
+
+        self.assertEqual(add_tags(photos, ["x"]), 0)
+        self.assertEqual(set_tags(photos, ["x"]), 0)
+        self.assertFalse(PhotoTag.objects.exists())
+
+    def test_reap_orphaned_images(self):
+        owner_dir = os.path.dirname(self.photos[0].image.path)
+        old_orphan = os.path.join(owner_dir, "old_orphan.jpg")
+        new_orphan = os.path.join(owner_dir, "new_orphan.jpg")
+        for path in (old_orphan, new_orphan):
+            with open(path, "wb") as f:
+                f.write(b"0123456789")
+        two_days_ago = time.time() - 2 * 24 * 60 * 60
+        os.utime(old_orphan, (two_days_ago, two_days_ago))
+        os.utime(self.photos[0].image.path, (two_days_ago, two_days_ago))
+
+        result = reap_orphaned_images(grace_period=24 * 60 * 60, batch_size=1)
+
+        self.assertEqual(result.scanned, 4)
+        self.assertEqual(result.deleted, 1)
+        self.assertEqual(result.bytes_reclaimed, 10)
+        self.assertFalse(os.path.exists(old_orphan))
+        self.assertTrue(os.path.exists(new_orphan))
+        self.assertTrue(os.path.exists(self.photos[0].image.path))
+
+    def test_import_photos_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint = os.path.join(directory, "import.checkpoint")
+
+        for name, exif_point in [("new.jpg", Point(1, 1)), ("duplicate.jpg", Point(0, 0)), ("no_gps.jpg", None)]:
+            image = Image.new('RGB', (100, 100))
+            if exif_point is None:
+                exif = self._write_timestamp(image.getexif(), timestamp=self.timestamp)
+            else:
+                exif = self._write_exif_data(image.getexif(), timestamp=self.timestamp, point=exif_point)
+            image.save(os.path.join(directory, name), format="JPEG", exif=exif)
+
+        out = io.StringIO()
+        call_command(
+            "import_photos", directory, owner=self.owner.username, tags=["Urban"],
+            workers=1, checkpoint=checkpoint, stdout=out, stderr=io.StringIO()
+        )
+
+        self.assertIn("1 imported, 1 duplicates, 1 failed", out.getvalue())
+        imported = Photo.objects.get(owner=self.owner, location=Point(1, 1, srid=4326))
+        self.assertEqual(list(imported.tags.values_list("name", flat=True)), ["urban"])
+        self.assertTrue(os.path.exists(imported.image.path))
+        self.assertEqual(len(os.listdir(os.path.dirname(imported.image.path))), 3)
+
+        # Every file is checkpointed, so a second run has nothing left to do
+        out = io.StringIO()
+        call_command(
+            "import_photos", directory, owner=self.owner.username,
+            workers=1, checkpoint=checkpoint, stdout=out, stderr=io.StringIO()
+        )
+        self.assertIn("Resuming: 3 files", out.getvalue())
+        self.assertIn("0 files", out.getvalue())
+        self.assertEqual(Photo.objects.filter(owner=self.owner).count(), 3)
+
+    def _bulk(self, data, user=None):
+        factory = APIRequestFactory()
+        request = factory.post('/collections/photos/bulk/', data, format='json')
+        force_authenticate(request, user or self.owner)
+        return PhotoBulk.as_view()(request)
+
     def _write_exif_data(self, exif, timestamp:datetime, point:Point):
         exif = self._write_timestamp(exif, timestamp)
         exif = self._write_gps_info(exif, point)
@@ -255,6 +871,44 @@ class PhotoTests(TestCase):
 
         shutil.rmtree('images')
 
+
+class PartitionTests(TransactionTestCase):
+    # Deferred foreign keys are only checked on commit, which a TestCase never reaches
+    def setUp(self):
+        self.owner = User.objects.create(username="fakeuser", password="fakepwd")
+        self.tag = Tag.objects.create(name="urban")
+        photo = Photo.objects.create(
+            owner=self.owner,
+            image="images/DSCF0001.jpg",
+            location=Point(0.0, 0.0, srid=4326),
+            timestamp=datetime(2205, 1, 1, 12, 0, 0, tzinfo=timezone.utc),
+        )
+        photo.tags.add(self.tag)
+
+        call_command("partition_photos", partitions=4, stdout=io.StringIO())
+        self.addCleanup(self._unpartition)
+
+    def _unpartition(self):
+        # The swap was committed, put plain tables back for the tests that follow
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DROP TABLE photo_gis_photo_tags, photo_gis_photo_tags_unpartitioned, "
+                "photo_gis_photo, photo_gis_photo_unpartitioned"
+            )
+            cursor.execute("DROP FUNCTION photo_gis_photo_location_geometry()")
+        with connection.schema_editor() as editor:
+            editor.create_model(Photo)
+            editor.create_model(PhotoTag)
+            editor.execute(import_module("photo_gis.migrations.0013_photo_location_geometry").CREATE_TRIGGER)
+
+    def test_users_and_tags_can_be_deleted_after_partitioning(self):
+        self.tag.delete()
+        self.owner.delete()
+
+        self.assertFalse(Photo.objects.exists())
+        self.assertFalse(PhotoTag.objects.exists())
+
+
 class TagTests(TestCase):
     def setUp(self):
         self.tag = Tag.objects.create(name="urban")
@@ -278,9 +932,194 @@ class TagTests(TestCase):
         with self.assertRaises(DataError):
             Tag.objects.create(**long_tag)
     
+    def test_tag_view_prefix_autocomplete(self):
+        Tag.objects.bulk_create([Tag(name=name) for name in ["Urbex", "underwater", "nature", "ur_100%"]])
+        user = User.objects.create(username="fakeuser", password="fakepwd")
+
+        factory = APIRequestFactory()
+        request = factory.get('/collections/tags/', {"prefix": "UR"})
+        force_authenticate(request, user)
+        response = TagList.as_view()(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([tag["name"] for tag in response.data], ["ur_100%", "urban", "Urbex"])
+
+        request = factory.get('/collections/tags/', {"prefix": "ur_", "limit": 1})
+        force_authenticate(request, user)
+        response = TagList.as_view()(request)
+        self.assertEqual([tag["name"] for tag in response.data], ["ur_100%"])
+
     def test_tag_view_does_not_allow_unauthenticated_users(self):
         factory = APIRequestFactory()
         view = PhotoList.as_view()
         request = factory.get('/collections/tags/')
         response = view(request)
-        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def test_adds_server_timing_header(self):
+        def view(request):
+            with phase("resize"):
+                pass
+            return HttpResponse()
+
+        request = RequestFactory().get('/collections/photos/')
+        response = ProfilingMiddleware(view)(request)
+
+        self.assertIn("resize;dur=", response["Server-Timing"])
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0, PROFILING_SLOW_REQUEST_SAMPLE_RATE=1.0)
+    def test_logs_slow_requests(self):
+        request = RequestFactory().get('/collections/photos/')
+
+        with self.assertLogs("photo_mapper_webserver.middleware", level="WARNING") as logs:
+            ProfilingMiddleware(lambda request: HttpResponse())(request)
+
+        self.assertIn('"event": "slow_request"', logs.output[0])
+
+
+@override_settings(COMPRESSION_MIN_BYTES=100)
+class CompressionMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.features = {"type": "FeatureCollection", "features": [{"type": "Feature", "id": i} for i in range(100)]}
+
+    def get(self, view, **headers):
+        request = RequestFactory().get('/collections/photos/', headers=headers)
+        request.resolver_match = resolve('/collections/photos/')
+        return CompressionMiddleware(lambda request: view())(request)
+
+    def test_repeated_requests_are_served_from_cache_or_not_modified(self):
+        calls = []
+
+        def view():
+            calls.append(1)
+            return JsonResponse(self.features)
+
+        with patch("utils.compression.gzip.compress", wraps=gzip.compress) as compress:
+            first = self.get(view, accept_encoding="gzip")
+            second = self.get(view, accept_encoding="gzip")
+            not_modified = self.get(view, accept_encoding="gzip", if_none_match=first["ETag"])
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first["Content-Encoding"], "gzip")
+        self.assertEqual(first["Vary"], "Accept-Encoding")
+        self.assertEqual(json.loads(gzip.decompress(second.content)), self.features)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_uncompressed_when_not_accepted_or_not_json(self):
+        self.assertFalse(self.get(lambda: JsonResponse(self.features)).has_header("Content-Encoding"))
+        response = self.get(lambda: HttpResponse(b"x" * 1000, content_type="image/jpeg"), accept_encoding="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_streaming_responses_are_compressed_incrementally(self):
+        chunks = [json.dumps(feature).encode() for feature in self.features["features"]]
+
+        response = self.get(
+            lambda: StreamingHttpResponse(iter(chunks), content_type="application/json"), accept_encoding="gzip"
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), b"".join(chunks))
+
+
+@override_settings(METRICS_CELERY_QUEUES=[])
+class MetricsTests(SimpleTestCase):
+    def test_metrics_endpoint_reports_photo_gis_request_latency(self):
+        self.client.get('/collections/')
+
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(
+            'photo_gis_request_duration_seconds_count{method="GET",route="collections/",status="200"}',
+            response.content.decode()
+        )
+
+    def test_ingest_phases_are_observed(self):
+        with phase("resize"):
+            pass
+
+        response = self.client.get('/metrics')
+
+        self.assertIn('photo_gis_ingest_phase_duration_seconds_count{phase="resize"}', response.content.decode())
+
+    @override_settings(METRICS_CELERY_QUEUES=["busy", "idle"])
+    def test_idle_celery_queues_have_no_depth(self):
+        with Connection("memory://") as connection:
+            connection.SimpleQueue("busy").put({"task": "ingest"})
+
+        with patch("photo_mapper_webserver.celery.app.connection_for_read", lambda: Connection("memory://")):
+            response = self.client.get('/metrics')
+
+        self.assertIn('photo_gis_celery_queue_depth{queue="busy"} 1.0', response.content.decode())
+        self.assertIn('photo_gis_celery_queue_depth{queue="idle"} 0.0', response.content.decode())
+
+    def test_metrics_are_hidden_from_other_networks(self):
+        response = self.client.get('/metrics', REMOTE_ADDR="203.0.113.7")
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with self.settings(METRICS_ALLOWED_NETWORKS=["203.0.113.0/24"]):
+            response = self.client.get('/metrics', REMOTE_ADDR="203.0.113.7")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0"], REPLICA_STICKY_SECONDS=10)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = PrimaryReplicaRouter()
+        self.user = MagicMock(pk=1, is_authenticated=True)
+
+    def _request(self, method="get"):
+        request = getattr(RequestFactory(), method)('/collections/photos/')
+        request.user = self.user
+        return request
+
+    def test_reads_of_safe_requests_go_to_a_replica(self):
+        with routing_request(self._request()):
+            self.assertEqual(self.router.db_for_read(Photo), "replica_0")
+            self.assertEqual(self.router.db_for_read(Tag), "replica_0")
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertEqual(self.router.db_for_write(Photo), "default")
+
+    def test_reads_outside_requests_or_of_writes_go_to_the_primary(self):
+        self.assertEqual(self.router.db_for_read(Photo), "default")
+
+        with routing_request(self._request("post")):
+            self.assertEqual(self.router.db_for_read(Photo), "default")
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        ReplicaRoutingMiddleware(lambda request: HttpResponse(status=201))(self._request("post"))
+
+        with routing_request(self._request()):
+            self.assertEqual(self.router.db_for_read(Photo), "default")
+
+        other_user_request = self._request()
+        other_user_request.user = MagicMock(pk=2, is_authenticated=True)
+        with routing_request(other_user_request):
+            self.assertEqual(self.router.db_for_read(Photo), "replica_0")
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_routing_is_left_to_django(self):
+        with routing_request(self._request()):
+            self.assertIsNone(self.router.db_for_read(Photo))
+
+    def test_migrations_only_run_on_the_primary(self):
+        self.assertTrue(self.router.allow_migrate("default", "photo_gis"))
+        self.assertFalse(self.router.allow_migrate("replica_0", "photo_gis"))
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ["photo_gis.E001"])
+
+        with override_settings(CACHES={"default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://localhost:6379/1",
+        }}):
+            self.assertEqual(check_shared_cache(None), [])
@@ -1,9 +1,15 @@
 from django.urls import path
-from photo_gis.views import api_root, PhotoList, PhotoDetail, TagList
+from photo_gis.views import api_root, PhotoList, PhotoBulk, PhotoFacets, PhotoChanges, PhotoArchive, PhotoDetail, PhotoImage, PhotoSimilar, TagList
 
 urlpatterns = [
     path("", api_root ),
     path("photos/", PhotoList.as_view(), name="photo-list"),
+    path("photos/bulk/", PhotoBulk.as_view(), name="photo-bulk"),
+    path("photos/facets/", PhotoFacets.as_view(), name="photo-facets"),
+    path("photos/changes/", PhotoChanges.as_view(), name="photo-changes"),
+    path("photos/archive.zip", PhotoArchive.as_view(), name="photo-archive"),
     path("photos/<str:id>/", PhotoDetail.as_view(), name="photo-detail"),
+    path("photos/<str:id>/image/", PhotoImage.as_view(), name="photo-image"),
+    path("photos/<str:id>/similar/", PhotoSimilar.as_view(), name="photo-similar"),
     path("tags/", TagList.as_view(), name="tag-list"),
 ]
\ No newline at end of file
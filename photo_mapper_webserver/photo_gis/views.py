@@ -1,4 +1,17 @@
+import hashlib
+import json
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Prefetch
+from django.db.models.functions import Lower
 from django.db.utils import IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.generics import GenericAPIView
@@ -9,11 +22,22 @@ import rest_framework.status as status
 import rest_framework.exceptions as exceptions
 from rest_framework_gis.pagination import GeoJsonPagination
 
-from photo_gis.models import Photo, Tag
-from photo_gis.serializers import PhotoSerializer, TagSerializer
+from photo_gis.models import Photo, PhotoTombstone, Tag
+from photo_gis.serializers import PhotoSerializer, CompactPhotoSerializer, TagSerializer, BulkPhotoSerializer
+from photo_gis.filters import filter_params, filter_photos
+from photo_gis import bulk, geojson, metrics
+from photo_gis.archive import archive_entries
+from photo_gis.collection import bump_collection_version, get_collection_version
+from photo_gis.facets import tag_facets
+from photo_gis.changes import changes_since, read_token
+from photo_gis.similarity import NearDuplicateException, find_similar
 from photo_gis.pagination import PhotoGeoJsonPagination
 
+from utils.admission import AdmissionRefused, ImageTooLarge, decode_cost, get_ingest_admission
 from utils.exif_exception import ExifException
+from utils.resize_photo import FIT_MODES, quantize_size, render_variant
+from utils.variant_cache import VariantCache
+from utils.zipstream import iterate_async, stream_zip
 
 # Create your views here.
 
@@ -36,20 +60,86 @@ class PhotoList(GenericAPIView):
     pagination_class = PhotoGeoJsonPagination
 
     def get_queryset(self):
-        return Photo.objects.filter(owner=self.request.user)
+        # Newest first, the id keeps pages stable between photos with the same timestamp
+        photos = Photo.objects.filter(owner_id=self.request.user.id).order_by("-timestamp", "id")
+        return filter_photos(photos, self.request.query_params)
 
     def get(self, request: Request):
+        """
+        Lists the user's photos as GeoJSON features.
+        Query parameter 'view' is 'full' (default) or 'compact', which outputs only the id, point and a thumbnail URL.
+        Query parameter 'fields' is a comma separated subset of the full representation's properties.
+        """
+        serializer_class, serializer_kwargs = self.get_representation(request)
+        fields = serializer_kwargs.get("fields")
+
+        if self.can_render_in_sql(request, serializer_class, fields):
+            page = self.paginator.paginate_queryset_lazily(self.get_queryset(), request, view=self)
+            if page is not None:
+                return geojson.GeoJsonResponse(
+                    geojson.render_photo_page(page, self.paginator, request),
+                    content_type=request.accepted_renderer.media_type,
+                )
+
+        # Only join and prefetch what the representation outputs
         queryset = self.get_queryset()
-        print(f"DEBUG: Found {queryset.count()} photos in DB")
+        if serializer_class is CompactPhotoSerializer:
+            queryset = queryset.only("id", "location")
+        else:
+            if fields is None or "owner" in fields:
+                queryset = queryset.select_related("owner")
+            if fields is None or "tag_names" in fields:
+                queryset = queryset.prefetch_related(Prefetch("tags", queryset=Tag.objects.order_by("name")))
+
         page = self.paginate_queryset(queryset)
 
         if page is not None:
-            print(f"DEBUG: Are we here?")
-            serializer = PhotoSerializer(page, many=True, context = {"request" : request})
+            serializer = serializer_class(page, many=True, context = {"request" : request}, **serializer_kwargs)
             return self.get_paginated_response(serializer.data)
         
-        serializer = PhotoSerializer(queryset, many=True, context = {"request" : request})
+        serializer = serializer_class(queryset, many=True, context = {"request" : request}, **serializer_kwargs)
         return Response(serializer.data)
+
+    def can_render_in_sql(self, request: Request, serializer_class, fields):
+        """
+        Whether the page can be rendered by geojson.render_photo_page: the full representation
+        as plain JSON, with timestamps in UTC like the SQL writes them.
+        """
+        return (
+            settings.PHOTO_LIST_SQL_GEOJSON
+            and serializer_class is PhotoSerializer
+            and fields is None
+            and timezone.get_current_timezone_name() == "UTC"
+            and geojson.can_render(request)
+        )
+
+    def get_representation(self, request: Request):
+        """
+        Returns:
+            (serializer class, serializer keyword arguments) for the 'view' and 'fields' query parameters
+        Raises:
+            ParseError if either is invalid
+        """
+        view = request.query_params.get("view", "full")
+        fields = request.query_params.get("fields")
+
+        if view == "compact":
+            if fields:
+                raise exceptions.ParseError("'fields' cannot be combined with 'view=compact'.")
+            return CompactPhotoSerializer, {}
+        if view != "full":
+            raise exceptions.ParseError("'view' must be 'full' or 'compact'.")
+
+        if not fields:
+            return PhotoSerializer, {}
+
+        fields = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = set(fields) - set(PhotoSerializer.SPARSE_FIELDS)
+        if unknown:
+            raise exceptions.ParseError(
+                f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(PhotoSerializer.SPARSE_FIELDS)}."
+            )
+        return PhotoSerializer, {"fields": fields}
         
     
     def post(self, request: Request):
@@ -72,23 +162,153 @@ class PhotoList(GenericAPIView):
         serializer = PhotoSerializer(data=data, context = {"owner": request.user, "request" : request})
         serializer.is_valid(raise_exception=True)
 
+        metrics.UPLOAD_BYTES.inc(images[0].size)
+
+        try:
+            cost = decode_cost(images[0], settings.INGEST_MAX_IMAGE_PIXELS)
+        except ImageTooLarge:
+            raise exceptions.ParseError(f"Photo has more than {settings.INGEST_MAX_IMAGE_PIXELS} pixels.")
+
         try:
-            serializer.save()
+            with get_ingest_admission().admit(cost):
+                serializer.save()
+        except AdmissionRefused as e:
+            metrics.ADMISSION_REJECTIONS.inc()
+            raise exceptions.Throttled(wait=e.retry_after, detail="Too many photos are being processed, try again later.")
         except IntegrityError:
+            metrics.DUPLICATE_REJECTIONS.inc()
             raise exceptions.ParseError("A photo at the same time and location already exists")
-        except ExifException:
+        except NearDuplicateException as e:
+            metrics.NEAR_DUPLICATE_REJECTIONS.inc()
+            raise exceptions.ParseError(
+                f"A near duplicate of this photo already exists: {reverse('photo-detail', kwargs={'id': e.photo_id}, request=request)}"
+            )
+        except ExifException as e:
+            metrics.EXIF_REJECTIONS.labels(reason=type(e).__name__).inc()
             raise exceptions.ParseError("Photo is missing datetime or GPS information.")
         except Exception:
             raise exceptions.APIException("An unknown error occured.")
 
+        metrics.UPLOADED_IMAGES.inc()
+        bump_collection_version(request.user.id)
+
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+class PhotoBulk(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request: Request):
+        """
+        Applies one operation to many photos in a single transaction.
+        Request body must have the key 'action': one of 'add_tags', 'remove_tags', 'set_tags' or 'delete'
+        Request body must have exactly one of
+            'ids': list of photo ids
+            'filter': object with the same keys as the photo list query parameters (bbox, taken_after, taken_before)
+        Request body must have the key 'tags' for the tag actions
+        """
+        serializer = BulkPhotoSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        photos = Photo.objects.filter(owner_id=request.user.id)
+        if "ids" in data:
+            photos = photos.filter(id__in=data["ids"])
+        else:
+            photos = filter_photos(photos, data["filter"])
+
+        with transaction.atomic():
+            if data["action"] == "add_tags":
+                count = bulk.add_tags(photos, data["tags"])
+            elif data["action"] == "remove_tags":
+                count = bulk.remove_tags(photos, data["tags"])
+            elif data["action"] == "set_tags":
+                count = bulk.set_tags(photos, data["tags"])
+            else:
+                count = bulk.delete_photos(photos)
+            bump_collection_version(request.user.id)
+
+        return Response({"action": data["action"], "count": count})
+
+
+class PhotoFacets(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request):
+        """
+        Returns the number of photos per tag, the number of untagged photos and the total
+        for the photos matching the same query parameters as the photo list.
+        Results are cached until the user's collection next changes.
+        """
+        photos = filter_photos(Photo.objects.filter(owner_id=request.user.id), request.query_params)
+
+        params = filter_params(request.query_params)
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        key = f"photo-facets:{request.user.id}:{get_collection_version(request.user.id)}:{digest}"
+
+        facets = cache.get(key)
+        if facets is None:
+            facets = tag_facets(photos)
+            cache.set(key, facets, timeout=settings.PHOTO_FACETS_CACHE_SECONDS)
+
+        return Response(facets)
+
+
+class PhotoChanges(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request):
+        """
+        Returns the photos created or modified and the ids of the photos deleted since a token, for incremental sync.
+        Query parameter 'since' is the 'token' of the previous response, omit it to start from the beginning.
+        Keep requesting with the new token while 'more' is true.
+        A change may be sent more than once, applying it again must be harmless.
+        """
+        since = request.query_params.get("since")
+        try:
+            position = read_token(since) if since else None
+        except ValueError:
+            raise exceptions.ParseError("'since' is not a valid token.")
+
+        photos, deleted, token, more = changes_since(request.user.id, position)
+
+        serializer = PhotoSerializer(photos, many=True, context={"request": request})
+        return Response({
+            "type": "FeatureCollection",
+            "features": serializer.data["features"],
+            "deleted": deleted,
+            "token": token,
+            "more": more,
+        })
+
+
+class PhotoArchive(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request):
+        """
+        Downloads the photos matching the same query parameters as the photo list as a ZIP archive,
+        with a manifest.geojson describing them. The archive is generated while it is sent.
+        """
+        photos = filter_photos(Photo.objects.filter(owner_id=request.user.id), request.query_params)
+        # Streaming outlives the routing of this request, keep the database it routes to
+        photos = photos.using(photos.db)
+
+        content = stream_zip(archive_entries(photos, request))
+        # Each handler buffers the other kind of iterator whole, so match the one serving this request
+        if isinstance(request._request, ASGIRequest):
+            content = iterate_async(content)
+
+        response = StreamingHttpResponse(content, content_type="application/zip")
+        response["Content-Disposition"] = 'attachment; filename="photos.zip"'
+        return response
+
+
 class PhotoDetail(GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_photo(self , id):
-        return Photo.objects.get(owner=self.request.user, id=id)
+        return Photo.objects.get(owner_id=self.request.user.id, id=id)
 
     def get(self, request, id=None):
         photo = self.get_photo(id)
@@ -100,11 +320,16 @@ class PhotoDetail(GenericAPIView):
         serializer =  PhotoSerializer(photo, request.data, context = {"request" : request}, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        bump_collection_version(request.user.id)
         return Response(serializer.data)
     
     def delete(self, request, id=None):
         photo = self.get_photo(id)
-        photo.delete()
+        with transaction.atomic():
+            photo_id = photo.id
+            photo.delete()
+            PhotoTombstone.objects.create(photo_id=photo_id, owner_id=request.user.id)
+        bump_collection_version(request.user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -113,6 +338,110 @@ class TagList(GenericAPIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request: Request):
-        tags = Tag.objects.all()
+        """
+        Lists all tags by name.
+        Query parameter 'prefix' turns this into autocomplete: only tags starting with it, case insensitively,
+        at most 'limit' (default 20, max 100) of them.
+        """
+        tags = Tag.objects.annotate(lower_name=Lower("name")).order_by("lower_name")
+
+        prefix = request.query_params.get("prefix")
+        if prefix:
+            try:
+                limit = min(int(request.query_params.get("limit", 20)), 100)
+            except ValueError:
+                raise exceptions.ParseError("'limit' must be an integer.")
+            if limit < 1:
+                raise exceptions.ParseError("'limit' must be positive.")
+            tags = tags.filter(lower_name__startswith=prefix.strip().lower())[:limit]
+
         serializer = TagSerializer(tags, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+class PhotoSimilar(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request, id=None):
+        """
+        Lists the user's photos that look like this one, such as burst shots and edited copies, closest first.
+        Each feature's 'distance' is the number of differing bits between the perceptual hashes, 0 to 64.
+        Query parameter 'max_distance' (default PHOTO_SIMILAR_DEFAULT_DISTANCE, at most 32) bounds it.
+        """
+        try:
+            max_distance = int(request.query_params.get("max_distance", settings.PHOTO_SIMILAR_DEFAULT_DISTANCE))
+        except ValueError:
+            raise exceptions.ParseError("'max_distance' must be an integer.")
+        if not 0 <= max_distance <= 32:
+            raise exceptions.ParseError("'max_distance' must be between 0 and 32.")
+
+        photo = get_object_or_404(Photo, owner_id=request.user.id, id=id)
+
+        distances = {}
+        if photo.perceptual_hash is not None:
+            distances = find_similar(request.user.id, photo.perceptual_hash, max_distance)
+            distances.pop(photo.id, None)
+
+        photos = sorted(
+            Photo.objects.filter(id__in=list(distances))
+            .select_related("owner")
+            .prefetch_related(Prefetch("tags", queryset=Tag.objects.order_by("name"))),
+            key=lambda similar: (distances[similar.id], similar.timestamp),
+        )
+        data = PhotoSerializer(photos, many=True, context={"request": request}).data
+        for feature, similar in zip(data["features"], photos):
+            feature["properties"]["distance"] = distances[similar.id]
+        return Response(data)
+
+
+@lru_cache(maxsize=None)
+def get_variant_cache():
+    return VariantCache(settings.PHOTO_VARIANT_CACHE_DIR, settings.PHOTO_VARIANT_CACHE_MAX_BYTES)
+
+
+class PhotoImage(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: Request, id=None):
+        """
+        Returns a resized variant of the photo.
+        Query parameters 'w' and 'h' give the bounding box in pixels, either may be omitted.
+        They are snapped up to the nearest size in PHOTO_VARIANT_SIZES.
+        Query parameter 'fit' is 'contain' (default) or 'cover'.
+        """
+        width = self._parse_size(request, "w")
+        height = self._parse_size(request, "h")
+        fit = request.query_params.get("fit", "contain")
+
+        if width is None and height is None:
+            raise exceptions.ParseError("At least one of 'w' or 'h' is required.")
+        if fit not in FIT_MODES:
+            raise exceptions.ParseError(f"'fit' must be one of {', '.join(FIT_MODES)}.")
+
+        width = quantize_size(width or height, settings.PHOTO_VARIANT_SIZES)
+        height = quantize_size(height or width, settings.PHOTO_VARIANT_SIZES)
+
+        photo = get_object_or_404(Photo, owner_id=request.user.id, id=id)
+
+        def render():
+            with photo.image.open("rb") as image_file:
+                return render_variant(image_file, width, height, fit)
+
+        key = f"{photo.id.hex}_{width}x{height}_{fit}.jpg"
+        data = get_variant_cache().get_or_render(key, render)
+
+        response = HttpResponse(data, content_type="image/jpeg")
+        response["Cache-Control"] = "private, max-age=86400"
+        return response
+
+    def _parse_size(self, request, param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise exceptions.ParseError(f"'{param}' must be an integer.")
+        if value <= 0:
+            raise exceptions.ParseError(f"'{param}' must be positive.")
+        return value
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PhotoMapperAuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'photo_mapper_auth'
+
+    def ready(self):
+        from photo_mapper_auth import signals
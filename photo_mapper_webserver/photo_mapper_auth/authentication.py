@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_state_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+def get_user_state(user_id):
+    """
+    Returns the parts of a user needed to authenticate a request, from the cache when possible.
+
+    Returns:
+        dict with username, is_active and password_hash, or None if the user does not exist
+    """
+    key = user_state_key(user_id)
+    state = cache.get(key)
+    if state is not None:
+        return state
+
+    user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+    if user is None:
+        return None
+
+    state = {
+        "username": user.get_username(),
+        "is_active": user.is_active,
+        "password_hash": get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None,
+    }
+    cache.set(key, state, timeout=settings.AUTH_USER_CACHE_SECONDS)
+    return state
+
+
+def invalidate_user_state(user_id):
+    cache.delete(user_state_key(user_id))
+
+
+class CachedTokenUser(TokenUser):
+    """
+    Token backed user whose username and active flag come from the cached user state.
+    It has no database row, so filter by owner_id=user.id rather than owner=user.
+    """
+
+    def __init__(self, token, state):
+        super().__init__(token)
+        self.state = state
+
+    @property
+    def username(self):
+        return self.state["username"]
+
+    @property
+    def is_active(self):
+        return self.state["is_active"]
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that does not load the User row on every request.
+    The user's state is cached for settings.AUTH_USER_CACHE_SECONDS and dropped when a save or delete of the user
+    commits, so deactivating a user takes effect immediately. That needs a cache every process shares.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        state = get_user_state(user_id)
+        if state is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not state["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != state["password_hash"]:
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return CachedTokenUser(validated_token, state)
@@ -0,0 +1,14 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from photo_mapper_auth.authentication import invalidate_user_state
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Only once the change is visible, or a concurrent request could cache the state it replaces
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user_state(user_id), using=kwargs.get("using"))
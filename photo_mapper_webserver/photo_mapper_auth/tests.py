@@ -1,3 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .authentication import CachedJWTAuthentication
 
 # Create your tests here.
+
+User = get_user_model()
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="fakeuser", password="fakepwd")
+        self.authentication = CachedJWTAuthentication()
+
+    def _authenticate(self):
+        token = AccessToken.for_user(self.user)
+        request = APIRequestFactory().get('/collections/photos/', HTTP_AUTHORIZATION=f"Bearer {token}")
+        return self.authentication.authenticate(request)
+
+    def test_user_is_only_queried_once(self):
+        with self.assertNumQueries(1):
+            user, _ = self._authenticate()
+        with self.assertNumQueries(0):
+            user, _ = self._authenticate()
+
+        self.assertTrue(user.is_authenticated)
+        self.assertEqual(str(user.id), str(self.user.id))
+        self.assertEqual(user.username, "fakeuser")
+
+    def test_deactivating_a_user_takes_effect_immediately(self):
+        self._authenticate()
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+            # Still cached until the change commits
+            self._authenticate()
+
+        with self.assertRaises(AuthenticationFailed):
+            self._authenticate()
+
+    def test_deleted_user_is_rejected(self):
+        self._authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self._authenticate()
+
+    def test_photo_list_does_not_query_the_user(self):
+        token = AccessToken.for_user(self.user)
+        self.client.get('/collections/photos/', headers={"Authorization": f"Bearer {token}"})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/collections/photos/', headers={"Authorization": f"Bearer {token}"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if User._meta.db_table in query["sql"]])
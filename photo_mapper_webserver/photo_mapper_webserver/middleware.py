@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+from photo_gis.routers import SAFE_METHODS, mark_sticky, routing_request
+from utils.compression import CODECS, acompress_chunks, compress_chunks, negotiate_encoding
+from utils.profiling import profile
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware:
+    """
+    Records per-phase durations and SQL query counts for every request and reports them
+    in a Server-Timing response header. A sample of slow requests is also logged as JSON.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+
+        with profile() as current, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(current.query_wrapper))
+            response = self.get_response(request)
+
+        total = time.perf_counter() - start
+        response["Server-Timing"] = current.server_timing(total)
+
+        if total * 1000 >= settings.PROFILING_SLOW_REQUEST_MS and random.random() < settings.PROFILING_SLOW_REQUEST_SAMPLE_RATE:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+                "total_ms": round(total * 1000, 1),
+                "phases_ms": {name: round(duration * 1000, 1) for name, duration in current.phases.items()},
+                "sql_queries": current.query_count,
+                "sql_ms": round(current.query_time * 1000, 1),
+            }))
+
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Observes the latency of photo_gis requests, labelled by route pattern so the label set stays bounded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+
+        match = request.resolver_match
+        if match is not None and match.func.__module__.startswith("photo_gis."):
+            from photo_gis.metrics import REQUEST_LATENCY
+
+            REQUEST_LATENCY.labels(
+                route=match.route, method=request.method, status=response.status_code
+            ).observe(time.perf_counter() - start)
+
+        return response
+
+
+class CompressionMiddleware:
+    """
+    Compresses photo_gis JSON responses with the best encoding the client accepts, brotli, zstd or gzip.
+    Compressed bodies are cached by a hash of the uncompressed body, which is also sent as the ETag,
+    so polling the same unchanged page serves the stored bytes or a 304. Streaming responses are
+    compressed chunk by chunk as they are sent.
+    """
+    CONTENT_TYPES = {"application/json", "application/geo+json", "application/vnd.geo+json"}
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        match = request.resolver_match
+        if (
+            match is None
+            or not match.func.__module__.startswith("photo_gis.")
+            or response.status_code != 200
+            or response.has_header("Content-Encoding")
+            or response.get("Content-Type", "").split(";")[0].strip() not in self.CONTENT_TYPES
+        ):
+            return response
+
+        patch_vary_headers(response, ["Accept-Encoding"])
+        encoding = negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        from photo_gis.metrics import COMPRESSED_RESPONSES
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_chunks(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_chunks(response.streaming_content, encoding)
+            del response["Content-Length"]
+            response["Content-Encoding"] = encoding
+            COMPRESSED_RESPONSES.labels(encoding=encoding, cache="stream").inc()
+            return response
+
+        if len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+
+        digest = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+        etag = f'"{digest}-{encoding}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            patch_vary_headers(not_modified, ["Accept-Encoding"])
+            COMPRESSED_RESPONSES.labels(encoding=encoding, cache="not_modified").inc()
+            return not_modified
+
+        key = f"compressed:{encoding}:{digest}"
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = CODECS[encoding].compress(response.content)
+            if len(compressed) <= settings.COMPRESSION_CACHE_MAX_BYTES:
+                cache.set(key, compressed, settings.COMPRESSION_CACHE_SECONDS)
+            COMPRESSED_RESPONSES.labels(encoding=encoding, cache="miss").inc()
+        else:
+            COMPRESSED_RESPONSES.labels(encoding=encoding, cache="hit").inc()
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Makes the request visible to the database router and, after a user's write request,
+    keeps that user's reads on the primary so they see their own changes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routing_request(request):
+            response = self.get_response(request)
+
+        if request.method not in SAFE_METHODS:
+            # DRF copies the authenticated user onto the underlying request
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                mark_sticky(user.pk)
+
+        return response
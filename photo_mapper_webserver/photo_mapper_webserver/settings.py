@@ -37,7 +37,6 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'daphne',
     'photo_gis.apps.PhotoGisConfig',
     'photo_mapper_auth.apps.PhotoMapperAuthConfig',
     'django.contrib.admin',
@@ -52,7 +51,15 @@ INSTALLED_APPS = [
     'rest_framework_simplejwt',
 ]
 
+# daphne only swaps runserver for its ASGI server, but importing it installs the Twisted reactor,
+# the largest part of a cold start. Only the development server opts in, Celery workers and
+# deployments leave it out (serve the app with `daphne photo_mapper_webserver.asgi:application`).
+if env.bool('DEV_ASGI_RUNSERVER', default=False):
+    INSTALLED_APPS.insert(0, 'daphne')
+
 MIDDLEWARE = [
+    'photo_mapper_webserver.middleware.MetricsMiddleware',
+    'photo_mapper_webserver.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +67,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'photo_mapper_webserver.middleware.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'photo_mapper_webserver.urls'
@@ -94,9 +102,42 @@ DATABASES = {
         "PASSWORD": env('POSTGRES_PASSWORD'),
         "HOST": env('POSTGRES_HOST'),
         "PORT": env('POSTGRES_PORT'),
+        # Connections are kept open between requests and checked before reuse.
+        # Under ASGI prefer a connection pooler such as PgBouncer and set this to 0.
+        "CONN_MAX_AGE": env.int('POSTGRES_CONN_MAX_AGE', default=60),
+        "CONN_HEALTH_CHECKS": True,
     },
 }
 
+# Read replicas as comma separated host[:port]. They share the primary's name and credentials
+# and mirror it in tests, so routing can be tested against a single database.
+DATABASE_REPLICAS = []
+for i, replica in enumerate(env.list('POSTGRES_REPLICA_HOSTS', default=[])):
+    host, _, port = replica.partition(':')
+    alias = f"replica_{i}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['photo_gis.routers.PrimaryReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write, to hide replication lag from them
+REPLICA_STICKY_SECONDS = env.int('REPLICA_STICKY_SECONDS', default=10)
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Replica routing after writes, facet cache invalidation and cached authentication need a cache shared
+# by all processes, such as redis://localhost:6379/1. The per-process default only suits a single process,
+# `manage.py check --deploy` fails with it.
+
+CACHES = {
+    "default": env.cache_url('CACHE_URL', default='locmemcache://'),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -141,6 +182,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # CELERY SETTINGS
 CELERY_BROKER_URL = 'redis://localhost'
 CELERY_RESULT_BACKEND = 'redis://localhost'
+CELERY_BEAT_SCHEDULE = {
+    "reap-orphaned-images": {
+        "task": "photo_gis.tasks.reap_orphaned_images_task",
+        "schedule": 60 * 60,
+    },
+}
 
 # GEODJANGO
 GDAL_LIBRARY_PATH = env('GDAL_LIBRARY_PATH')
@@ -148,6 +195,85 @@ GDAL_LIBRARY_PATH = env('GDAL_LIBRARY_PATH')
 # REST FRAMEWORK
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "photo_mapper_auth.authentication.CachedJWTAuthentication",
     ]
-}
\ No newline at end of file
+}
+
+# Seconds the state of an authenticated user is cached, saving the user query on most requests.
+# Saving or deleting a user drops its cached state once the change commits, in every process if the cache is shared.
+AUTH_USER_CACHE_SECONDS = env.int('AUTH_USER_CACHE_SECONDS', default=300)
+
+# INGEST ADMISSION
+# Memory each process may spend on decoding uploads at once, estimated from image headers.
+# Uploads that do not fit wait, up to a queue bound and timeout, then get 429 with Retry-After.
+INGEST_DECODE_BUDGET_BYTES = env.int('INGEST_DECODE_BUDGET_BYTES', default=512 * 1024 * 1024)
+INGEST_MAX_QUEUED = env.int('INGEST_MAX_QUEUED', default=16)
+INGEST_QUEUE_TIMEOUT_SECONDS = env.float('INGEST_QUEUE_TIMEOUT_SECONDS', default=10.0)
+# Images with more pixels are refused before decoding (decompression bombs)
+INGEST_MAX_IMAGE_PIXELS = env.int('INGEST_MAX_IMAGE_PIXELS', default=120_000_000)
+
+# PHOTO VARIANTS
+# Requested widths/heights are snapped to these sizes so the number of cached variants stays bounded
+PHOTO_VARIANT_SIZES = [64, 128, 256, 512, 1024, 1920]
+PHOTO_VARIANT_CACHE_DIR = env('PHOTO_VARIANT_CACHE_DIR', default=os.path.join(BASE_DIR, 'cache', 'variants'))
+PHOTO_VARIANT_CACHE_MAX_BYTES = env.int('PHOTO_VARIANT_CACHE_MAX_BYTES', default=512 * 1024 * 1024)
+
+# PHOTO FACETS
+# Facet counts are cached per collection version, so this only bounds how long unused entries linger
+PHOTO_FACETS_CACHE_SECONDS = env.int('PHOTO_FACETS_CACHE_SECONDS', default=60 * 60)
+
+# PHOTO LIST
+# Full GeoJSON list pages are rendered by PostGIS instead of by PhotoSerializer.
+# The output is byte for byte the same, turn it off to compare against the serializer.
+PHOTO_LIST_SQL_GEOJSON = env.bool('PHOTO_LIST_SQL_GEOJSON', default=True)
+
+# PHOTO CHANGES
+# Changes per response of the sync feed, and how far back a caught up client's next token reaches.
+# The window must exceed the longest transaction that saves photos, plus clock skew between servers.
+PHOTO_CHANGES_PAGE_SIZE = env.int('PHOTO_CHANGES_PAGE_SIZE', default=500)
+PHOTO_CHANGES_SAFETY_WINDOW_SECONDS = env.int('PHOTO_CHANGES_SAFETY_WINDOW_SECONDS', default=60)
+
+# SIMILAR PHOTOS
+# Photos are compared by the Hamming distance of their 64 bit perceptual hashes.
+# Copies of the same shot are usually within 4 bits, burst shots within about 10.
+PHOTO_SIMILAR_DEFAULT_DISTANCE = env.int('PHOTO_SIMILAR_DEFAULT_DISTANCE', default=10)
+# Reject uploads within PHOTO_NEAR_DUPLICATE_DISTANCE of a photo the user already has
+PHOTO_REJECT_NEAR_DUPLICATES = env.bool('PHOTO_REJECT_NEAR_DUPLICATES', default=False)
+PHOTO_NEAR_DUPLICATE_DISTANCE = env.int('PHOTO_NEAR_DUPLICATE_DISTANCE', default=4)
+# Each process keeps the hash index of this many recently active users in memory
+SIMILARITY_INDEX_MAX_OWNERS = env.int('SIMILARITY_INDEX_MAX_OWNERS', default=100)
+
+# REVERSE GEOCODING
+# A GeoNames dump (e.g. cities1000.txt from download.geonames.org) used to label photos with a place.
+# Photos are left unlabelled when it is not set or the nearest place is further than the max distance.
+GAZETTEER_PATH = env('GAZETTEER_PATH', default=None)
+GAZETTEER_MAX_DISTANCE_KM = env.float('GAZETTEER_MAX_DISTANCE_KM', default=50.0)
+
+# ORPHANED IMAGE REAPER
+# Files younger than the grace period are never reaped so in-flight uploads are safe
+PHOTO_REAPER_GRACE_PERIOD = env.int('PHOTO_REAPER_GRACE_PERIOD', default=24 * 60 * 60)
+PHOTO_REAPER_BATCH_SIZE = 500
+
+# RESPONSE COMPRESSION
+# photo_gis JSON responses are compressed with brotli or zstd when those packages are installed, gzip otherwise.
+# Compressed bodies are cached by content hash, so unchanged pages are compressed once.
+COMPRESSION_MIN_BYTES = env.int('COMPRESSION_MIN_BYTES', default=1024)
+COMPRESSION_CACHE_SECONDS = env.int('COMPRESSION_CACHE_SECONDS', default=10 * 60)
+COMPRESSION_CACHE_MAX_BYTES = env.int('COMPRESSION_CACHE_MAX_BYTES', default=1024 * 1024)
+
+# METRICS
+# Set the PROMETHEUS_MULTIPROC_DIR environment variable to an empty, writable directory
+# when running several worker processes so /metrics aggregates all of them
+METRICS_CELERY_QUEUES = ['celery']
+# /metrics shares the app's port, so only these networks may scrape it. Behind a reverse proxy
+# REMOTE_ADDR is the proxy's, so block /metrics there and let Prometheus reach the app directly.
+METRICS_ALLOWED_NETWORKS = env.list('METRICS_ALLOWED_NETWORKS', default=['127.0.0.1/32', '::1/128'])
+
+# PROFILING
+# Adds a Server-Timing header with ingest phase and SQL timings to every response
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+PROFILING_SLOW_REQUEST_MS = env.int('PROFILING_SLOW_REQUEST_MS', default=1000)
+PROFILING_SLOW_REQUEST_SAMPLE_RATE = env.float('PROFILING_SLOW_REQUEST_SAMPLE_RATE', default=1.0)
+
+if PROFILING_ENABLED:
+    MIDDLEWARE.insert(0, 'photo_mapper_webserver.middleware.ProfilingMiddleware')
\ No newline at end of file
@@ -17,8 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from photo_gis.metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('collections/', include("photo_gis.urls")),
-    path('auth/', include("photo_mapper_auth.urls"))
+    path('auth/', include("photo_mapper_auth.urls")),
+    path('metrics', metrics_view, name="metrics"),
 ]
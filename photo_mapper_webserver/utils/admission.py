@@ -0,0 +1,140 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+
+
+class ImageTooLarge(Exception):
+    """
+    Raised for images with more pixels than allowed, before any of them are decoded.
+    """
+
+
+class AdmissionRefused(Exception):
+    """
+    Raised when an image can neither be decoded now nor wait for its turn.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Image ingest is overloaded, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def pixel_size(mode: str):
+    """
+    Returns the bytes per pixel Pillow uses in memory for an image mode.
+    Multi band images take 4 bytes per pixel however many bands they have.
+    """
+    if mode in ("1", "L", "P"):
+        return 1
+    if mode.startswith("I;16"):
+        return 2
+    return 4
+
+
+def decode_cost(image_file, max_pixels: int = None):
+    """
+    Estimates the memory needed to ingest an image from its header alone, without decoding it.
+
+    Args:
+        image_file: File-like object of the image, its position is restored on return
+        max_pixels: Images with more pixels raise ImageTooLarge
+    Returns:
+        Estimated bytes: the decoded image, the copy exif_transpose makes of it
+        and the two passes of the resampling filter, each about as large
+    Raises:
+        ImageTooLarge if the image has more than max_pixels pixels
+    """
+    from PIL import Image
+
+    position = image_file.tell()
+    try:
+        with Image.open(image_file) as img:
+            width, height = img.size
+            mode = img.mode
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    finally:
+        image_file.seek(position)
+
+    if max_pixels is not None and width * height > max_pixels:
+        raise ImageTooLarge(f"Image has {width * height} pixels, at most {max_pixels} are allowed")
+
+    return width * height * pixel_size(mode) * 4
+
+
+class IngestAdmission:
+    """
+    Caps the memory held by concurrent image decodes in this process.
+
+    Each decode reserves its estimated cost from a byte budget. Decodes that do not fit wait for
+    running ones to finish, but at most max_queued of them and for at most queue_timeout seconds,
+    after which they are refused so clients back off instead of piling up.
+    An image costing more than the whole budget runs on its own.
+    """
+
+    def __init__(self, budget_bytes: int, max_queued: int, queue_timeout: float):
+        self.budget_bytes = budget_bytes
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._queued = 0
+        self._average_seconds = 1.0 # Smoothed time a decode holds its reservation
+
+    @contextmanager
+    def admit(self, cost: int):
+        """
+        Holds a reservation of cost bytes for the duration of the block.
+
+        Raises:
+            AdmissionRefused if the queue is full or the wait times out
+        """
+        cost = min(cost, self.budget_bytes)
+
+        with self._condition:
+            if not self._fits(cost):
+                if self._queued >= self.max_queued:
+                    raise AdmissionRefused(self.retry_after())
+
+                self._queued += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self._fits(cost), timeout=self.queue_timeout)
+                finally:
+                    self._queued -= 1
+                if not admitted:
+                    raise AdmissionRefused(self.retry_after())
+
+            self._in_use += cost
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_use -= cost
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * (time.monotonic() - start)
+                self._condition.notify_all()
+
+    def retry_after(self):
+        """
+        Returns:
+            Seconds until the decodes currently queued are likely done, at least 1
+        """
+        return max(1, math.ceil(self._average_seconds * (self._queued + 1)))
+
+    def _fits(self, cost):
+        return self._in_use + cost <= self.budget_bytes
+
+
+@lru_cache(maxsize=None)
+def get_ingest_admission():
+    return IngestAdmission(
+        settings.INGEST_DECODE_BUDGET_BYTES,
+        settings.INGEST_MAX_QUEUED,
+        settings.INGEST_QUEUE_TIMEOUT_SECONDS,
+    )
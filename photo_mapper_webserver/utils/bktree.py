@@ -0,0 +1,66 @@
+HASH_MASK = (1 << 64) - 1
+
+
+def hamming_distance(a: int, b: int):
+    """
+    Number of differing bits between two 64 bit hashes, signed or not.
+    """
+    return ((a ^ b) & HASH_MASK).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree for finding every key within a distance of a query in a discrete metric space.
+
+    Each child hangs off its parent at the edge labelled with their distance. By the triangle inequality
+    a search for keys within r of q at a node d away from q only has to follow edges labelled d - r to d + r,
+    so small radius searches visit a small part of the tree.
+    """
+
+    def __init__(self, distance=hamming_distance):
+        self.distance = distance
+        self._root = None # [key, values, {distance: child}]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value):
+        self._size += 1
+        if self._root is None:
+            self._root = [key, [value], {}]
+            return
+
+        node = self._root
+        while True:
+            d = self.distance(key, node[0])
+            if d == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [key, [value], {}]
+                return
+            node = child
+
+    def search(self, key, max_distance: int):
+        """
+        Returns:
+            List of (distance, value) for every value whose key is within max_distance of key, closest first
+        """
+        if self._root is None:
+            return []
+
+        results = []
+        stack = [self._root]
+        while stack:
+            node_key, values, children = stack.pop()
+            d = self.distance(key, node_key)
+            if d <= max_distance:
+                results.extend((d, value) for value in values)
+            for edge, child in children.items():
+                if d - max_distance <= edge <= d + max_distance:
+                    stack.append(child)
+
+        results.sort(key=lambda result: result[0])
+        return results
@@ -0,0 +1,107 @@
+import gzip
+import zlib
+from collections import namedtuple
+
+# brotli and zstandard are optional, without them responses fall back to the encodings that are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Levels that compress JSON well at a cost a request can afford. Results are cached, so each body pays it once
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 6
+GZIP_LEVEL = 6
+
+# compress: bytes -> bytes. stream: () -> (compress a chunk and flush it, finish the stream)
+Codec = namedtuple("Codec", ["compress", "stream"])
+
+
+def _gzip_stream():
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _brotli_stream():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return lambda chunk: compressor.process(chunk) + compressor.flush(), compressor.finish
+
+
+def _zstd_stream():
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return (
+        lambda chunk: compressor.compress(chunk) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+        compressor.flush,
+    )
+
+
+# Installed encodings, most preferred first
+CODECS = {}
+if brotli is not None:
+    CODECS["br"] = Codec(lambda data: brotli.compress(data, quality=BROTLI_QUALITY), _brotli_stream)
+if zstandard is not None:
+    CODECS["zstd"] = Codec(lambda data: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data), _zstd_stream)
+CODECS["gzip"] = Codec(lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0), _gzip_stream)
+
+
+def negotiate_encoding(accept_encoding: str):
+    """
+    Picks the content coding for a response from an Accept-Encoding header.
+
+    Args:
+        accept_encoding: Value of the header, e.g. "gzip, br;q=0.9"
+    Returns:
+        The installed encoding with the highest q value, ties going to the order of CODECS,
+        or None if the client accepts none of them
+    """
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            weights[coding] = q
+
+    best, best_q = None, 0.0
+    for coding in CODECS:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress_chunks(chunks, encoding: str):
+    """
+    Compresses an iterable of bytes as it is consumed, flushing after every chunk
+    so that each one reaches the client without waiting for the next.
+    """
+    compress, finish = CODECS[encoding].stream()
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+async def acompress_chunks(chunks, encoding: str):
+    """
+    compress_chunks for an async iterable of bytes.
+    """
+    compress, finish = CODECS[encoding].stream()
+    async for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
@@ -1,15 +1,26 @@
+import math
 from datetime import datetime
-from PIL import Image, ExifTags
-from PIL.TiffImagePlugin import IFDRational
+from typing import TYPE_CHECKING
 from django.core.files.uploadedfile import UploadedFile
 from django.contrib.gis.geos import Point
 
 from .exif_exception import DateTimeMissingException, GPSInfoMissingException
+from .profiling import phase
+
+# Pillow is imported on first use, so processes that never read a photo do not pay for it at startup
+if TYPE_CHECKING:
+    from PIL import Image
+    from PIL.TiffImagePlugin import IFDRational
+
+
+# Extended EXIF fields kept for filtering, by IFD. Strings are compared exactly, numbers also by range
+CAMERA_STRING_TAGS = {"Base": ["Make", "Model"], "Exif": ["LensMake", "LensModel"]}
+CAMERA_NUMBER_TAGS = {"Exif": ["FocalLength", "FocalLengthIn35mmFilm"], "GPSInfo": ["GPSAltitude", "GPSImgDirection"]}
 
 
 def read_photo_metadata(photo_file: UploadedFile):
     """
-    Read EXIF datetime and location data from a Django Uploaded File object using Pillow
+    Read EXIF datetime, location and camera data from a Django Uploaded File object using Pillow
 
     Args:
         photo_file: The file uploaded
@@ -17,17 +28,22 @@ def read_photo_metadata(photo_file: UploadedFile):
     Returns:
         dt: Datetime object representing when when the photo was taken. Timezone naive.
         point: Geos Point object representing where the photo was taken.
+        camera: dict of the extended EXIF fields the photo has, see get_camera_info
     """
 
-    with Image.open(photo_file) as img:
-        exif = img.getexif()
-    
-    dt = get_datetime(exif)
-    point = get_location(exif)
+    from PIL import Image
+
+    with phase("exif"):
+        with Image.open(photo_file) as img:
+            exif = img.getexif()
+
+        dt = get_datetime(exif)
+        point = get_location(exif)
+        camera = get_camera_info(exif)
 
-    return dt, point
+    return dt, point, camera
         
-def get_datetime(exif: Image.Exif):
+def get_datetime(exif: "Image.Exif"):
     """
     Extracts datetime information from an Exif object.
     
@@ -39,6 +55,8 @@ def get_datetime(exif: Image.Exif):
         DateTimeMissingException if either DateTimeOriginal or OffsetTimeOriginal Exif tags are missing.
         This assumes that any photo with both datetime and GPS information will have timezone information.
     """
+    from PIL import ExifTags
+
     exif_ifd = exif.get_ifd(ExifTags.IFD.Exif) # Returns an empty dict if ExifTags.IFD.Exif not found
     try:
         dt_string = exif_ifd.get(ExifTags.Base.DateTimeOriginal)
@@ -54,7 +72,7 @@ def get_datetime(exif: Image.Exif):
         return dt   
 
 
-def get_location(exif: Image.Exif):
+def get_location(exif: "Image.Exif"):
     """
     Extracts GPS location from an Exif object
 
@@ -66,6 +84,8 @@ def get_location(exif: Image.Exif):
         GPSInfoMissingException if any of GPSLatitude, GPSLatitudeRef,
         GPSLongitude, GPSLongitudeRef are missing.
     """
+    from PIL import ExifTags
+
     gps_ifd = exif.get_ifd(ExifTags.IFD.GPSInfo)
     
     try:
@@ -85,7 +105,7 @@ def get_location(exif: Image.Exif):
     else:
         return Point(lon, lat)
 
-def DMS_to_decimal(degrees: IFDRational, minutes: IFDRational, seconds: IFDRational, direction: str):
+def DMS_to_decimal(degrees: "IFDRational", minutes: "IFDRational", seconds: "IFDRational", direction: str):
     """
     Converts GPS coordinates from DMS format to decimal degree format.
 
@@ -102,4 +122,51 @@ def DMS_to_decimal(degrees: IFDRational, minutes: IFDRational, seconds: IFDRatio
     if direction.upper() in ("S", "W"):
         decimal = -decimal
     
-    return decimal
\ No newline at end of file
+    return decimal
+
+
+def get_camera_info(exif: "Image.Exif"):
+    """
+    Extracts the camera, lens, focal length, altitude and heading from an Exif object.
+
+    Args:
+        exif: An Image.Exif object containing photo metadata
+    Returns:
+        dict of EXIF tag name -> value for the fields in CAMERA_STRING_TAGS and CAMERA_NUMBER_TAGS
+        the photo has. Strings are stripped, numbers are floats, GPSAltitude is negative below sea level.
+    """
+    from PIL import ExifTags
+
+    ifds = {
+        "Base": exif,
+        "Exif": exif.get_ifd(ExifTags.IFD.Exif),
+        "GPSInfo": exif.get_ifd(ExifTags.IFD.GPSInfo),
+    }
+    tag_ids = {"Base": ExifTags.Base, "Exif": ExifTags.Base, "GPSInfo": ExifTags.GPS}
+    camera = {}
+
+    for ifd, names in CAMERA_STRING_TAGS.items():
+        for name in names:
+            value = ifds[ifd].get(tag_ids[ifd][name])
+            if isinstance(value, bytes):
+                value = value.decode(errors="replace")
+            if isinstance(value, str):
+                # Postgres cannot store NUL in jsonb, cameras pad fields with it
+                value = value.replace("\x00", "").strip()
+                if value:
+                    camera[name] = value
+
+    for ifd, names in CAMERA_NUMBER_TAGS.items():
+        for name in names:
+            try:
+                value = float(ifds[ifd].get(tag_ids[ifd][name]))
+            except (TypeError, ValueError, ZeroDivisionError):
+                continue
+            if math.isfinite(value):
+                camera[name] = value
+
+    # Altitude reference 1 means below sea level
+    if "GPSAltitude" in camera and ifds["GPSInfo"].get(ExifTags.GPS.GPSAltitudeRef) in (1, b"\x01"):
+        camera["GPSAltitude"] = -camera["GPSAltitude"]
+
+    return camera
@@ -0,0 +1,167 @@
+import csv
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+EARTH_RADIUS_KM = 6371.0088
+
+Place = namedtuple("Place", ["name", "country_code", "distance_km"])
+
+
+def to_unit_vector(lon: float, lat: float):
+    """
+    Converts lon/lat in degrees to a point on the unit sphere, so straight line distance orders
+    places the same way as great circle distance and the antimeridian needs no special casing.
+    """
+    lon, lat = math.radians(lon), math.radians(lat)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+def chord_to_km(chord: float):
+    return 2 * math.asin(min(chord / 2, 1.0)) * EARTH_RADIUS_KM
+
+
+class KDTree:
+    """
+    Static k-d tree kept in two flat lists. Every slice [lo, hi) is sorted on the axis of its depth
+    with the median at its middle, so the tree needs no node objects.
+    """
+
+    def __init__(self, points, values):
+        """
+        Args:
+            points: Sequence of equal length coordinate tuples
+            values: Sequence of the values returned for each point
+        """
+        if len(points) != len(values):
+            raise ValueError("points and values must have the same length")
+
+        order = list(range(len(points)))
+        self.dimensions = len(points[0]) if points else 0
+        self._build(points, order, 0, len(order), 0)
+        self.points = [points[i] for i in order]
+        self.values = [values[i] for i in order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, points, order, lo, hi, depth):
+        if hi - lo <= 1:
+            return
+        axis = depth % self.dimensions
+        order[lo:hi] = sorted(order[lo:hi], key=lambda i: points[i][axis])
+        mid = (lo + hi) // 2
+        self._build(points, order, lo, mid, depth + 1)
+        self._build(points, order, mid + 1, hi, depth + 1)
+
+    def nearest(self, point):
+        """
+        Finds the stored point closest to point.
+
+        Returns:
+            (value, distance) of the nearest point, or None if the tree is empty
+        """
+        if not self.points:
+            return None
+
+        best = [None, math.inf] # index, squared distance
+        self._search(point, 0, len(self.points), 0, best)
+        return self.values[best[0]], math.sqrt(best[1])
+
+    def _search(self, point, lo, hi, depth, best):
+        if lo >= hi:
+            return
+
+        mid = (lo + hi) // 2
+        candidate = self.points[mid]
+        distance = sum((a - b) ** 2 for a, b in zip(point, candidate))
+        if distance < best[1]:
+            best[0], best[1] = mid, distance
+
+        axis = depth % self.dimensions
+        diff = point[axis] - candidate[axis]
+        near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+
+        self._search(point, *near, depth + 1, best)
+        # The far side can only hold a closer point if the splitting plane is within the best distance
+        if diff * diff < best[1]:
+            self._search(point, *far, depth + 1, best)
+
+
+class ReverseGeocoder:
+    """
+    Offline reverse geocoder resolving coordinates to the nearest place of a gazetteer.
+    """
+
+    def __init__(self, places, max_distance_km: float = None):
+        """
+        Args:
+            places: Iterable of (name, country_code, lon, lat)
+            max_distance_km: Coordinates further than this from every place resolve to None
+        """
+        points, values = [], []
+        for name, country_code, lon, lat in places:
+            points.append(to_unit_vector(lon, lat))
+            values.append((name, country_code))
+
+        self.tree = KDTree(points, values)
+        self.max_distance_km = max_distance_km
+
+    @classmethod
+    def from_geonames(cls, path: str, max_distance_km: float = None):
+        """
+        Loads a GeoNames dump such as cities1000.txt: tab separated, no header,
+        with the name, latitude, longitude and country code in columns 2, 5, 6 and 9.
+        """
+        def places():
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                    if len(row) < 9 or row[0].startswith("#"):
+                        continue
+                    try:
+                        yield row[1], row[8], float(row[5]), float(row[4])
+                    except ValueError:
+                        continue
+
+        return cls(places(), max_distance_km)
+
+    def lookup(self, lon: float, lat: float):
+        """
+        Returns:
+            The nearest Place, or None if there is none within max_distance_km
+        """
+        result = self.tree.nearest(to_unit_vector(lon, lat))
+        if result is None:
+            return None
+
+        (name, country_code), chord = result
+        distance_km = chord_to_km(chord)
+        if self.max_distance_km is not None and distance_km > self.max_distance_km:
+            return None
+        return Place(name, country_code, distance_km)
+
+
+@lru_cache(maxsize=None)
+def get_reverse_geocoder():
+    """
+    Returns the process wide geocoder for settings.GAZETTEER_PATH, loading it on first use,
+    or None if no gazetteer is configured.
+    """
+    if not settings.GAZETTEER_PATH:
+        return None
+    return ReverseGeocoder.from_geonames(settings.GAZETTEER_PATH, settings.GAZETTEER_MAX_DISTANCE_KM)
+
+
+def reverse_geocode(point):
+    """
+    Resolves a lon/lat Point to a Place with the configured gazetteer.
+
+    Returns:
+        Place, or None if no gazetteer is configured or no place is close enough
+    """
+    geocoder = get_reverse_geocoder()
+    if geocoder is None:
+        return None
+    return geocoder.lookup(point.x, point.y)
@@ -0,0 +1,86 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+_phase_listeners = []
+
+
+class Profile:
+    """
+    Per-request record of named phase durations and SQL queries.
+    """
+
+    def __init__(self):
+        self.phases = {} # phase name -> total seconds, in first-seen order
+        self.query_count = 0
+        self.query_time = 0.0
+
+    def record(self, name: str, duration: float):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper, see django.db.connection.execute_wrapper
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_count += 1
+            self.query_time += time.perf_counter() - start
+
+    def server_timing(self, total: float = None):
+        """
+        Formats the profile as a Server-Timing header value with durations in milliseconds.
+        """
+        metrics = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.phases.items()]
+        metrics.append(f'sql;dur={self.query_time * 1000:.1f};desc="{self.query_count} queries"')
+        if total is not None:
+            metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def profile():
+    """
+    Makes a new Profile current for the duration of the block.
+
+    Yields:
+        The Profile phases will be recorded into
+    """
+    current = Profile()
+    token = _current_profile.set(current)
+    try:
+        yield current
+    finally:
+        _current_profile.reset(token)
+
+
+def add_phase_listener(listener):
+    """
+    Registers listener(name, duration) to be called after every phase, whether or not a profile is active.
+    """
+    _phase_listeners.append(listener)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Times the block and records it under name in the current profile and with any phase listeners.
+    Does nothing beyond a context variable lookup when there is neither.
+    """
+    current = _current_profile.get()
+    if current is None and not _phase_listeners:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        if current is not None:
+            current.record(name, duration)
+        for listener in _phase_listeners:
+            listener(name, duration)
@@ -1,21 +1,114 @@
 import io
+from typing import TYPE_CHECKING
 
 from django.core.files.uploadedfile import UploadedFile
-from PIL import Image, ImageOps
+
+from .profiling import phase
+
+# Pillow is imported on first use, so processes that never touch an image do not pay for it at startup
+if TYPE_CHECKING:
+    from PIL import Image
+
+FIT_MODES = ("contain", "cover")
+
 
 def resize_image(image_file: UploadedFile):
     """
-    Resize image in memory and return stream to resized image
+    Resize image in memory and return stream to resized image.
+    The stream's perceptual_hash attribute is the perceptual hash of the resized image.
     """
-    img = Image.open(image_file)
-    img= ImageOps.exif_transpose(img)
+    from PIL import Image, ImageOps
 
-    img.thumbnail((1920, 1920), Image.Resampling.LANCZOS)
+    with phase("decode"):
+        img = Image.open(image_file)
+        img= ImageOps.exif_transpose(img)
 
-    buffer = io.BytesIO()
-    img.save(buffer, format="JPEG", quality=80)
-    buffer.seek(0)
+    with phase("resize"):
+        img.thumbnail((1920, 1920), Image.Resampling.LANCZOS)
+
+    with phase("hash"):
+        image_hash = perceptual_hash(img)
+
+    with phase("encode"):
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=80)
+        buffer.seek(0)
 
     from django.core.files.base import ContentFile
 
-    return ContentFile(buffer.read(), name=image_file.name)
\ No newline at end of file
+    resized = ContentFile(buffer.read(), name=image_file.name)
+    resized.perceptual_hash = image_hash
+    return resized
+
+
+def perceptual_hash(img: "Image.Image"):
+    """
+    Computes the difference hash (dHash) of an image. Each of the 64 bits tells whether a pixel of
+    a 9x8 grayscale thumbnail is brighter than its right neighbour, so re-encoded, resized or lightly
+    edited copies of an image get hashes only a few bits apart.
+
+    Returns:
+        The hash as a signed 64 bit integer, so it fits a BigIntegerField
+    """
+    from PIL import Image
+
+    # Shrinking before the grayscale conversion only touches the 72 pixels that matter
+    pixels = img.resize((9, 8), Image.Resampling.BOX).convert("L").tobytes()
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+
+    return bits - (1 << 64) if bits >= 1 << 63 else bits
+
+
+def quantize_size(value: int, sizes):
+    """
+    Snaps a requested dimension to the smallest whitelisted size that is at least as large.
+
+    Args:
+        value: The requested width or height in pixels
+        sizes: Iterable of allowed sizes
+    Returns:
+        The quantized size. Requests larger than every allowed size get the largest one.
+    """
+    sizes = sorted(sizes)
+    for size in sizes:
+        if size >= value:
+            return size
+    return sizes[-1]
+
+
+def render_variant(image_file, width: int, height: int, fit: str = "contain"):
+    """
+    Renders a resized variant of a stored image.
+
+    Args:
+        image_file: File-like object of the stored (already resized) image
+        width: Width of the bounding box in pixels
+        height: Height of the bounding box in pixels
+        fit: 'contain' scales the image down to fit inside the box,
+            'cover' scales and center-crops the image to fill the box exactly
+    Returns:
+        JPEG encoded bytes of the variant
+    """
+    if fit not in FIT_MODES:
+        raise ValueError(f"Unknown fit mode '{fit}'")
+
+    from PIL import Image, ImageOps
+
+    with Image.open(image_file) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if fit == "cover":
+            img = ImageOps.fit(img, (width, height), Image.Resampling.LANCZOS)
+        else:
+            img.thumbnail((width, height), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=80)
+
+    return buffer.getvalue()
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+ImportTime = namedtuple("ImportTime", ["module", "self_us", "cumulative_us", "depth"])
+
+
+def profile_imports(modules, cwd: str = None, settings_module: str = None):
+    """
+    Sets up Django and imports modules in a fresh interpreter run with -X importtime,
+    so nothing is already cached in sys.modules.
+
+    Args:
+        modules: Names of the modules to import after django.setup()
+        cwd: Directory to run the interpreter in, the project root
+        settings_module: DJANGO_SETTINGS_MODULE, the inherited one by default
+    Returns:
+        (wall clock seconds of the whole process, list of ImportTime in the order imports finished)
+    Raises:
+        RuntimeError if the interpreter fails
+    """
+    code = "import django\ndjango.setup()\n" + "".join(f"import {module}\n" for module in modules)
+    env = dict(os.environ)
+    if settings_module is not None:
+        env["DJANGO_SETTINGS_MODULE"] = settings_module
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Profiled interpreter failed:\n{result.stderr[-2000:]}")
+
+    return wall, parse_importtime(result.stderr)
+
+
+def parse_importtime(output: str):
+    """
+    Parses -X importtime output, lines like 'import time:   310 |   170101 |   django.urls'
+    where the name is indented two spaces per level of nesting.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue # The header
+        indent = len(name) - len(name.lstrip()) - 1
+        imports.append(ImportTime(name.strip(), int(self_us), int(cumulative_us), indent // 2))
+    return imports
+
+
+def time_by_package(imports):
+    """
+    Returns:
+        List of (top level package, total self time in microseconds), most expensive first
+    """
+    totals = {}
+    for entry in imports:
+        package = entry.module.split(".")[0]
+        totals[package] = totals.get(package, 0) + entry.self_us
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
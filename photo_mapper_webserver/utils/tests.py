@@ -1,13 +1,34 @@
+import io
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
 from unittest import TestCase
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from datetime import datetime, timezone
-from PIL import ExifTags
+from PIL import ExifTags, Image
 from PIL.TiffImagePlugin import IFDRational
 from django.contrib.gis.geos import Point
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from .exif_reader import get_datetime, get_location, DMS_to_decimal
+from .exif_reader import get_camera_info, get_datetime, get_location, DMS_to_decimal
 from .exif_exception import DateTimeMissingException, GPSInfoMissingException
+from .resize_photo import quantize_size, render_variant
+from .variant_cache import VariantCache
+from .profiling import Profile, profile, phase
+from .geocoder import KDTree, ReverseGeocoder
+from .admission import AdmissionRefused, ImageTooLarge, IngestAdmission, decode_cost
+from .resize_photo import perceptual_hash, resize_image
+from .bktree import BKTree, hamming_distance
+from .startup import parse_importtime, profile_imports, time_by_package
+from .zipstream import IterableReader, ZipEntry, stream_zip
+from .compression import CODECS, compress_chunks, negotiate_encoding
 
 class ExifReaderTests(TestCase):
 
@@ -158,4 +179,533 @@ class ExifReaderTests(TestCase):
         self.exif_mock.get_ifd.return_value = { }
 
         with self.assertRaises(GPSInfoMissingException):
-            get_location(self.exif_mock)
\ No newline at end of file
+            get_location(self.exif_mock)
+
+    def test_get_camera_info(self):
+        exif = Image.Exif()
+        exif[ExifTags.Base.Make] = "FUJIFILM"
+        exif[ExifTags.Base.Model] = "X-T5\x00\x00"
+        exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+        exif_ifd[ExifTags.Base.LensModel] = "XF56mmF1.2 R WR"
+        exif_ifd[ExifTags.Base.FocalLength] = IFDRational(56, 1)
+        exif_ifd[ExifTags.Base.FocalLengthIn35mmFilm] = 84
+        gps_ifd = exif.get_ifd(ExifTags.IFD.GPSInfo)
+        gps_ifd[ExifTags.GPS.GPSAltitude] = IFDRational(125, 2)
+        gps_ifd[ExifTags.GPS.GPSAltitudeRef] = b"\x01"
+        gps_ifd[ExifTags.GPS.GPSImgDirection] = IFDRational(1, 0)
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(buffer, format="JPEG", exif=exif)
+        with Image.open(buffer) as img:
+            camera = get_camera_info(img.getexif())
+
+        self.assertEqual(camera, {
+            "Make": "FUJIFILM",
+            "Model": "X-T5",
+            "LensModel": "XF56mmF1.2 R WR",
+            "FocalLength": 56.0,
+            "FocalLengthIn35mmFilm": 84.0,
+            "GPSAltitude": -62.5,
+        })
+
+
+class ResizePhotoTests(TestCase):
+
+    def test_quantize_size(self):
+        sizes = [64, 256, 1024]
+        self.assertEqual(quantize_size(1, sizes), 64)
+        self.assertEqual(quantize_size(64, sizes), 64)
+        self.assertEqual(quantize_size(65, sizes), 256)
+        self.assertEqual(quantize_size(5000, sizes), 1024)
+
+    def test_render_variant(self):
+        image = Image.new('RGB', (400, 200))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG")
+
+        buffer.seek(0)
+        with Image.open(io.BytesIO(render_variant(buffer, 100, 100, "contain"))) as variant:
+            self.assertEqual(variant.size, (100, 50))
+
+        buffer.seek(0)
+        with Image.open(io.BytesIO(render_variant(buffer, 100, 100, "cover"))) as variant:
+            self.assertEqual(variant.size, (100, 100))
+
+        with self.assertRaises(ValueError):
+            render_variant(buffer, 100, 100, "stretch")
+
+
+class VariantCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def test_get_or_render_caches_result(self):
+        cache = VariantCache(self.directory, max_bytes=1000)
+        render = MagicMock(return_value=b"variant")
+
+        self.assertEqual(cache.get_or_render("aa_1.jpg", render), b"variant")
+        self.assertEqual(cache.get_or_render("aa_1.jpg", render), b"variant")
+        render.assert_called_once()
+
+        # A fresh instance picks the entry up from disk
+        self.assertEqual(VariantCache(self.directory, max_bytes=1000).get("aa_1.jpg"), b"variant")
+
+    def test_evicts_least_recently_used(self):
+        cache = VariantCache(self.directory, max_bytes=250)
+
+        cache.get_or_render("aa_1.jpg", lambda: b"1" * 100)
+        cache.get_or_render("bb_2.jpg", lambda: b"2" * 100)
+        cache.get("aa_1.jpg") # aa_1 is now more recently used than bb_2
+        cache.get_or_render("cc_3.jpg", lambda: b"3" * 100)
+
+        self.assertIsNotNone(cache.get("aa_1.jpg"))
+        self.assertIsNone(cache.get("bb_2.jpg"))
+        self.assertIsNotNone(cache.get("cc_3.jpg"))
+
+    def test_eviction_does_not_rescan_the_directory(self):
+        cache = VariantCache(self.directory, max_bytes=250)
+        cache.get_or_render("aa_0.jpg", lambda: b"0" * 100)
+
+        with patch("utils.variant_cache.os.scandir", wraps=os.scandir) as scandir:
+            for i in range(1, 10):
+                cache.get_or_render(f"a{i}_{i}.jpg", lambda: b"x" * 100)
+
+        scandir.assert_not_called()
+        sizes = [entry.stat().st_size for shard in os.scandir(self.directory) for entry in os.scandir(shard.path)]
+        self.assertEqual(sizes, [100, 100])
+
+    def test_picks_up_other_processes_entries_when_refreshing(self):
+        cache = VariantCache(self.directory, max_bytes=250, refresh_seconds=0)
+        cache.get_or_render("bb_1.jpg", lambda: b"1" * 100)
+        VariantCache(self.directory, max_bytes=250).get_or_render("cc_2.jpg", lambda: b"2" * 100)
+
+        cache.get_or_render("dd_3.jpg", lambda: b"3" * 100)
+        cache.get_or_render("ee_4.jpg", lambda: b"4" * 100)
+
+        # The other process' entry counts towards the budget and, being unseen, is evicted first
+        self.assertIsNone(cache.get("cc_2.jpg"))
+        self.assertIsNone(cache.get("bb_1.jpg"))
+        self.assertIsNotNone(cache.get("dd_3.jpg"))
+        self.assertIsNotNone(cache.get("ee_4.jpg"))
+
+    def test_concurrent_requests_are_coalesced(self):
+        cache = VariantCache(self.directory, max_bytes=1000)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def render():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return b"variant"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_render("aa_1.jpg", render)))
+            for _ in range(5)
+        ]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [b"variant"] * 5)
+
+
+
+class ProfilingTests(TestCase):
+
+    def test_phase_records_into_current_profile(self):
+        with profile() as current:
+            with phase("decode"):
+                pass
+            with phase("decode"):
+                pass
+            with phase("encode"):
+                pass
+
+        self.assertEqual(list(current.phases), ["decode", "encode"])
+        self.assertGreaterEqual(current.phases["decode"], 0)
+
+    def test_phase_without_profile_is_a_no_op(self):
+        with phase("decode"):
+            result = 1
+        self.assertEqual(result, 1)
+
+    def test_server_timing(self):
+        current = Profile()
+        current.record("exif", 0.0123)
+        current.query_wrapper(lambda *args: None, "SELECT 1", None, False, {})
+
+        header = current.server_timing(total=0.5)
+
+        self.assertTrue(header.startswith("exif;dur=12.3, sql;dur="))
+        self.assertIn('desc="1 queries"', header)
+        self.assertTrue(header.endswith("total;dur=500.0"))
+
+
+class GeocoderTests(TestCase):
+
+    def test_kd_tree_matches_brute_force(self):
+        rng = random.Random(0)
+        points = [(rng.random(), rng.random(), rng.random()) for _ in range(500)]
+        tree = KDTree(points, list(range(len(points))))
+
+        for _ in range(100):
+            query = (rng.random(), rng.random(), rng.random())
+            expected = min(range(len(points)), key=lambda i: math.dist(points[i], query))
+
+            value, distance = tree.nearest(query)
+
+            self.assertEqual(value, expected)
+            self.assertAlmostEqual(distance, math.dist(points[expected], query))
+
+    def test_kd_tree_empty(self):
+        self.assertIsNone(KDTree([], []).nearest((0, 0, 0)))
+
+    def test_lookup_nearest_place(self):
+        geocoder = ReverseGeocoder([
+            ("Lahore", "PK", 74.3436, 31.5497),
+            ("Islamabad", "PK", 73.0479, 33.6844),
+            ("Delhi", "IN", 77.2090, 28.6139),
+        ])
+
+        place = geocoder.lookup(74.30, 31.50)
+
+        self.assertEqual((place.name, place.country_code), ("Lahore", "PK"))
+        self.assertLess(place.distance_km, 10)
+
+    def test_lookup_across_antimeridian(self):
+        geocoder = ReverseGeocoder([("Suva", "FJ", 178.4419, -18.1416), ("Papeete", "PF", -149.5585, -17.5350)])
+
+        self.assertEqual(geocoder.lookup(-179.9, -18.0).name, "Suva")
+
+    def test_lookup_beyond_max_distance(self):
+        geocoder = ReverseGeocoder([("Lahore", "PK", 74.3436, 31.5497)], max_distance_km=50)
+
+        self.assertIsNone(geocoder.lookup(0, 0))
+
+    def test_from_geonames(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "cities.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("1172451\tLahore\tLahore\t\t31.54972\t74.34361\tP\tPPLA\tPK\t\t04\t\t\t\t6310888\t\t217\tAsia/Karachi\t2019-12-06\n")
+            f.write("malformed row\n")
+            f.write("2988507\tParis\tParis\t\t48.85341\t2.3488\tP\tPPLC\tFR\t\t11\t75\t751\t75056\t2138551\t\t42\tEurope/Paris\t2023-01-01\n")
+
+        geocoder = ReverseGeocoder.from_geonames(path)
+
+        self.assertEqual(len(geocoder.tree), 2)
+        self.assertEqual(geocoder.lookup(2.35, 48.86)[:2], ("Paris", "FR"))
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class AdmissionTests(TestCase):
+
+    def setUp(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (2000, 1500), (90, 120, 200)).save(buffer, format="JPEG")
+        self.jpeg = buffer.getvalue()
+        self.cost = 2000 * 1500 * 4 * 4
+
+    def test_decode_cost_reads_only_the_header(self):
+        image_file = io.BytesIO(self.jpeg)
+        image_file.seek(5)
+
+        self.assertEqual(decode_cost(image_file), self.cost)
+        self.assertEqual(image_file.tell(), 5)
+        with self.assertRaises(ImageTooLarge):
+            decode_cost(io.BytesIO(self.jpeg), max_pixels=2000 * 1500 - 1)
+
+    def test_refuses_once_the_queue_is_full(self):
+        admission = IngestAdmission(budget_bytes=self.cost, max_queued=1, queue_timeout=5)
+        release = threading.Event()
+        queued = []
+
+        def hold():
+            with admission.admit(self.cost):
+                release.wait()
+
+        def wait_in_queue():
+            with admission.admit(self.cost):
+                queued.append(True)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        waiter = threading.Thread(target=wait_in_queue)
+        waiter.start()
+        while admission._queued < 1:
+            time.sleep(0.01)
+
+        with self.assertRaises(AdmissionRefused) as refused:
+            with admission.admit(self.cost):
+                pass
+        self.assertGreaterEqual(refused.exception.retry_after, 1)
+
+        release.set()
+        holder.join()
+        waiter.join()
+        self.assertEqual(queued, [True])
+
+    def test_times_out_in_the_queue(self):
+        admission = IngestAdmission(budget_bytes=self.cost, max_queued=1, queue_timeout=0.05)
+        with admission.admit(self.cost):
+            with self.assertRaises(AdmissionRefused):
+                with admission.admit(1):
+                    pass
+
+    def test_burst_of_uploads_keeps_memory_bounded(self):
+        # Room for three decodes at a time out of a burst of 100 concurrent uploads
+        budget = 3 * self.cost
+        admission = IngestAdmission(budget_bytes=budget, max_queued=100, queue_timeout=60)
+        lock = threading.Lock()
+        state = {"running": 0, "most_running": 0, "peak_rss": 0, "done": 0}
+        stop = threading.Event()
+
+        def sample():
+            while not stop.is_set():
+                state["peak_rss"] = max(state["peak_rss"], rss_bytes())
+                time.sleep(0.002)
+
+        def upload(index):
+            image_file = SimpleUploadedFile(f"{index}.jpg", self.jpeg, content_type="image/jpeg")
+            with admission.admit(decode_cost(image_file)):
+                with lock:
+                    state["running"] += 1
+                    state["most_running"] = max(state["most_running"], state["running"])
+                resize_image(image_file)
+                with lock:
+                    state["running"] -= 1
+                    state["done"] += 1
+
+        # Warm up allocator arenas and Pillow so the baseline includes them
+        upload(-1)
+        baseline = rss_bytes()
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        threads = [threading.Thread(target=upload, args=(i,)) for i in range(100)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        sampler.join()
+
+        self.assertEqual(state["done"], 101)
+        self.assertLessEqual(state["most_running"], 3)
+        # The allocator holds on to some freed memory so RSS overshoots the estimate,
+        # but it stays a small multiple of the budget instead of growing to 100 * self.cost
+        self.assertLess(state["peak_rss"] - baseline, 2 * budget)
+
+
+class ZerosFile(io.RawIOBase):
+    # size bytes of zeros, read without allocating them
+    def __init__(self, size, chunk=bytes(1024 * 1024)):
+        self.remaining = size
+        self.chunk = chunk
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        size = min(size if size >= 0 else self.remaining, len(self.chunk), self.remaining)
+        self.remaining -= size
+        return self.chunk if size == len(self.chunk) else self.chunk[:size]
+
+
+class ZipStreamTests(TestCase):
+
+    def test_archive_round_trips(self):
+        taken = datetime(2024, 5, 6, 7, 8, 10, tzinfo=timezone.utc)
+        entries = [
+            ZipEntry("manifest.json", lambda: IterableReader([b'{"a":', b"", b"1}"]), None, taken, True),
+            ZipEntry("photos/a.jpg", lambda: io.BytesIO(b"\xff\xd8" * 5000), 10000, taken, False),
+            ZipEntry("old.txt", lambda: io.BytesIO(b""), 0, datetime(1970, 1, 1, tzinfo=timezone.utc), True),
+        ]
+        chunks = list(stream_zip(entries, chunk_size=1000))
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["manifest.json", "photos/a.jpg", "old.txt"])
+            self.assertEqual(archive.read("manifest.json"), b'{"a":1}')
+            self.assertEqual(archive.read("photos/a.jpg"), b"\xff\xd8" * 5000)
+
+            photo = archive.getinfo("photos/a.jpg")
+            self.assertEqual(photo.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(photo.date_time, (2024, 5, 6, 7, 8, 10))
+            self.assertEqual(archive.getinfo("manifest.json").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.getinfo("old.txt").date_time, (1980, 1, 1, 0, 0, 0))
+
+        # Sent as it is read, not once the archive is complete
+        self.assertGreater(len(chunks), 10)
+        self.assertLess(max(len(chunk) for chunk in chunks), 2000)
+
+    def test_multi_gigabyte_archive_streams_in_flat_memory(self):
+        # Over 4 GiB, so both an entry and the archive need ZIP64
+        big = 4 * 1024 ** 3 + 512 * 1024 ** 2
+        small = 10 * 1024 ** 2
+        taken = datetime(2024, 5, 6, tzinfo=timezone.utc)
+        entries = [
+            ZipEntry("photos/big.jpg", lambda: ZerosFile(big), big, taken, False),
+            ZipEntry("photos/small.jpg", lambda: ZerosFile(small), small, taken, False),
+        ]
+
+        baseline = rss_bytes()
+        peak_rss = baseline
+        total = 0
+        tail = b""
+        for i, chunk in enumerate(stream_zip(entries)):
+            total += len(chunk)
+            tail = (tail + chunk)[-4096:]
+            if i % 64 == 0:
+                peak_rss = max(peak_rss, rss_bytes())
+
+        self.assertGreater(total, big + small)
+        self.assertLess(total, big + small + 4096)
+        self.assertIn(b"PK\x06\x06", tail) # ZIP64 end of central directory record
+        # A few chunks at a time, nowhere near the size of the archive
+        self.assertLess(peak_rss - baseline, 64 * 1024 ** 2)
+
+
+class CompressionTests(TestCase):
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding("gzip;q=0.5, identity"), "gzip")
+        self.assertEqual(negotiate_encoding("GZIP"), "gzip")
+        self.assertEqual(negotiate_encoding("*"), next(iter(CODECS)))
+        self.assertIsNone(negotiate_encoding(""))
+        self.assertIsNone(negotiate_encoding("identity"))
+        self.assertIsNone(negotiate_encoding("gzip;q=0"))
+        self.assertIsNone(negotiate_encoding("*;q=0"))
+
+    def test_compress_chunks_flushes_every_chunk(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = compress_chunks(iter([b'{"type": ', b'"FeatureCollection"}']), "gzip")
+
+        # The first chunk can be decoded before the second is produced
+        self.assertEqual(decompressor.decompress(next(chunks)), b'{"type": ')
+        self.assertEqual(b"".join(decompressor.decompress(chunk) for chunk in chunks), b'"FeatureCollection"}')
+        self.assertTrue(decompressor.eof)
+
+
+class SimilarityTests(TestCase):
+
+    def _photo(self, seed):
+        rng = random.Random(seed)
+        img = Image.new("RGB", (64, 48))
+        img.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(64 * 48)])
+        return img.resize((640, 480), Image.Resampling.BICUBIC)
+
+    def test_perceptual_hash_of_edited_copy_is_close(self):
+        img = self._photo(0)
+        original = perceptual_hash(img)
+
+        buffer = io.BytesIO()
+        img.resize((320, 240)).save(buffer, format="JPEG", quality=50)
+        buffer.seek(0)
+        copy = perceptual_hash(Image.open(buffer))
+
+        self.assertLessEqual(hamming_distance(original, copy), 4)
+        self.assertGreater(hamming_distance(original, perceptual_hash(self._photo(1))), 16)
+        self.assertTrue(-2 ** 63 <= original < 2 ** 63)
+
+    def test_resize_image_hashes_the_resized_image(self):
+        buffer = io.BytesIO()
+        self._photo(0).save(buffer, format="JPEG")
+        resized = resize_image(SimpleUploadedFile("photo.jpg", buffer.getvalue()))
+
+        self.assertLessEqual(hamming_distance(resized.perceptual_hash, perceptual_hash(self._photo(0))), 4)
+
+    def test_hamming_distance(self):
+        self.assertEqual(hamming_distance(0, -1), 64)
+        self.assertEqual(hamming_distance(0b1011, 0b0001), 2)
+
+    def test_bk_tree_matches_brute_force(self):
+        rng = random.Random(0)
+        keys = [rng.getrandbits(64) - 2 ** 63 for _ in range(2000)]
+        # Clusters of near duplicates
+        keys += [key ^ (1 << rng.randrange(64)) for key in keys[:200]]
+        tree = BKTree()
+        for i, key in enumerate(keys):
+            tree.add(key, i)
+        self.assertEqual(len(tree), len(keys))
+
+        for query in keys[:50] + [rng.getrandbits(64) for _ in range(10)]:
+            for max_distance in (0, 3, 12):
+                expected = sorted(
+                    (hamming_distance(query, key), i) for i, key in enumerate(keys)
+                    if hamming_distance(query, key) <= max_distance
+                )
+                self.assertEqual(sorted(tree.search(query, max_distance)), expected)
+
+    def test_bk_tree_search_visits_part_of_the_tree(self):
+        calls = 0
+
+        def counting_distance(a, b):
+            nonlocal calls
+            calls += 1
+            return hamming_distance(a, b)
+
+        rng = random.Random(1)
+        tree = BKTree(distance=counting_distance)
+        for i in range(5000):
+            tree.add(rng.getrandbits(64), i)
+
+        calls = 0
+        tree.search(rng.getrandbits(64), 4)
+        self.assertLess(calls, 5000 // 2)
+
+
+class StartupTests(TestCase):
+    # Time spent importing during a cold start of the web process. It was about 0.9s when set, on a machine
+    # where importing Pillow and the Twisted reactor of daphne at startup took it to 1.3s. The default leaves
+    # room for loaded CI machines, set STARTUP_IMPORT_BUDGET_SECONDS (e.g. to 1.2) to tighten it.
+    IMPORT_BUDGET_SECONDS = float(os.environ.get("STARTUP_IMPORT_BUDGET_SECONDS", 5.0))
+    # Modules only needed to handle images or to run the dev server
+    DEFERRED_MODULES = ["PIL.Image", "daphne.server", "twisted.internet.reactor"]
+
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       120 |        120 |     b.c\n"
+            "import time:       300 |        420 |   b\n"
+            "import time:        80 |        500 | a\n"
+        )
+        imports = parse_importtime(output)
+
+        self.assertEqual([(entry.module, entry.depth) for entry in imports], [("b.c", 2), ("b", 1), ("a", 0)])
+        self.assertEqual(time_by_package(imports), [("b", 420), ("a", 80)])
+
+    def _profile_cold_start(self):
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        _, imports = profile_imports(
+            ["photo_mapper_webserver.urls"], cwd=project_root, settings_module="photo_mapper_webserver.settings"
+        )
+        return imports
+
+    def test_cold_start_defers_heavy_modules(self):
+        modules = {entry.module for entry in self._profile_cold_start()}
+
+        for module in self.DEFERRED_MODULES:
+            self.assertNotIn(module, modules, f"{module} is imported at startup")
+
+    def test_cold_start_stays_within_budget(self):
+        imports = self._profile_cold_start()
+
+        self.assertLess(sum(entry.self_us for entry in imports) / 1e6, self.IMPORT_BUDGET_SECONDS)
+
@@ -0,0 +1,167 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class VariantCache:
+    """
+    On-disk LRU cache for rendered image variants with a byte budget.
+
+    Recency is kept in memory and mirrored to the files' mtime so it survives restarts.
+    Entries written by other processes sharing the directory are picked up by rescanning it
+    at most every refresh_seconds, so the budget may be exceeded by their writes in between.
+    Concurrent requests for the same key inside a process are coalesced so that only
+    one of them renders; the others wait for the result.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, refresh_seconds: float = 60):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        self._entries = None # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+        self._refreshed_at = None
+        self._inflight = {} # key -> threading.Event set once the leader is done
+
+    def get(self, key: str):
+        """
+        Returns the cached bytes for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                # Evicted by another process. Re-check as a leader may have just written it.
+                if not os.path.exists(path):
+                    self._forget(key)
+            return None
+
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                # Written by another process sharing the directory
+                self._entries[key] = len(data)
+                self._total_bytes += len(data)
+            self._entries.move_to_end(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def get_or_render(self, key: str, render):
+        """
+        Returns the cached bytes for key, calling render() to produce them on a miss.
+
+        Args:
+            key: Filename safe cache key
+            render: Callable returning the bytes to cache
+        Returns:
+            The variant bytes
+        """
+        while True:
+            data = self.get(key)
+            if data is not None:
+                return data
+
+            with self._lock:
+                if self._entries is not None and key in self._entries:
+                    # A leader finished between our miss and taking the lock
+                    continue
+                event = self._inflight.get(key)
+                leader = event is None
+                if leader:
+                    event = self._inflight[key] = threading.Event()
+
+            if not leader:
+                # Retry once the leader finishes. If it failed we become the next leader.
+                event.wait()
+                continue
+
+            try:
+                data = render()
+                self._put(key, data)
+                return data
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                event.set()
+
+    def _put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so readers never see a partial variant
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self._load()
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+
+            if self._total_bytes > self.max_bytes:
+                # Scanning the directory is O(files), only pick up other processes' entries now and then
+                if time.monotonic() - self._refreshed_at >= self.refresh_seconds:
+                    self._refresh()
+                self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, key):
+        if self._entries is not None and key in self._entries:
+            self._total_bytes -= self._entries.pop(key)
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = OrderedDict()
+            self._refresh()
+
+    def _refresh(self):
+        """
+        Re-reads the directory. Entries this process has not seen are ordered by mtime and
+        treated as older than the ones it has, whose in-memory order is kept.
+        """
+        found = {}
+        if os.path.isdir(self.directory):
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found[entry.name] = (stat.st_mtime, stat.st_size)
+
+        unseen = sorted((mtime, name) for name, (mtime, _) in found.items() if name not in self._entries)
+        known = [name for name in self._entries if name in found]
+
+        self._entries = OrderedDict((name, found[name][1]) for name in [name for _, name in unseen] + known)
+        self._total_bytes = sum(self._entries.values())
+        self._refreshed_at = time.monotonic()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
@@ -0,0 +1,105 @@
+import io
+import zipfile
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+
+# open is a callable returning a binary file object, size its length in bytes if known
+ZipEntry = namedtuple("ZipEntry", ["name", "open", "size", "modified", "compress"])
+
+CHUNK_SIZE = 1024 * 1024
+# Earliest date a ZIP entry can carry
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+class IterableReader(io.RawIOBase):
+    """
+    Read only binary file object over an iterable of bytes, for entries generated as they are written.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._iterator, None)
+            if self._pending is None:
+                self._pending = b""
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class _Sink:
+    """
+    Write only, unseekable file object collecting what zipfile writes until it is drained.
+    Being unseekable makes zipfile write sizes and CRCs in data descriptors after each entry
+    instead of seeking back to the entry's header.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, chunk_size: int = CHUNK_SIZE):
+    """
+    Generates a ZIP archive on the fly, yielding it in pieces of about chunk_size bytes.
+    Memory use is independent of the size of the entries: each is read and written a chunk at a time,
+    and nothing is written to disk. Archives and entries over 4 GiB use ZIP64.
+
+    Args:
+        entries: Iterable of ZipEntry. Entries that are not compressed are stored as is,
+            which suits already compressed data such as JPEGs
+        chunk_size: Bytes read from an entry at a time
+    Yields:
+        bytes of the archive
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, date_time=max(entry.modified.timetuple()[:6], ZIP_EPOCH))
+            info.compress_type = zipfile.ZIP_DEFLATED if entry.compress else zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            if entry.size is not None:
+                info.file_size = entry.size
+
+            # Unknown sizes could exceed 4 GiB, the local header must say so up front
+            with archive.open(info, "w", force_zip64=entry.size is None) as destination, entry.open() as source:
+                while chunk := source.read(chunk_size):
+                    destination.write(chunk)
+                    yield sink.drain()
+
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+async def iterate_async(iterator):
+    """
+    Iterates a synchronous iterator from async code, one item at a time in the sync thread.
+    Django's ASGI handler reads a synchronous StreamingHttpResponse into a list first,
+    which for an archive would hold all of it in memory. The WSGI handler does the same
+    to an asynchronous one, so use this only for requests served over ASGI.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while (item := await sync_to_async(next)(iterator, done)) is not done:
+        yield item